@@ -1,6 +1,22 @@
+import atexit
+import gzip
+import hashlib
+import io
+import json
 import os
-import subprocess
-from flask import Flask, request, send_file, jsonify
+import threading
+import time
+import numpy as np
+from flask import Flask, Response, request, send_file, jsonify, redirect, url_for
+
+from derived_metrics import get_derived_metrics
+from map_render import MAX_WIDTH, cache_key, map_options
+from rate_cube import get_rate_cube
+from regions import county_regions, load_region_scheme
+from render_cache import cache_from_env
+from render_metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram, collect_spans
+from render_service import RenderInterrupted, RenderQueueFull, RenderTimeout, SingleFlight, pool_from_env
+from topology import DEFAULT_QUANTIZATION, encode_topology
 
 app = Flask(__name__)
 
@@ -8,40 +24,361 @@ app = Flask(__name__)
 OUTPUT_FOLDER = os.path.join(os.getcwd(), "static/maps")
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# Correct path to the main map script
-MAP_GENERATION_SCRIPT = os.path.join(os.getcwd(), "v9_main_map.py")
+# Rendered maps, keyed by inputs + renderer version (the key is also the ETag)
+render_cache = cache_from_env()
+# Browsers may reuse a map this long before revalidating with If-None-Match
+HTTP_MAX_AGE = int(os.environ.get("MAP_HTTP_MAX_AGE", 3600))
+# Output formats of /update_map and the bounds of its width and dpi parameters
+MAP_FORMATS = {"png": "image/png", "webp": "image/webp", "svg": "image/svg+xml"}
+# (widths are capped at what the largest master resolution draws natively)
+MIN_MAP_WIDTH, MAX_MAP_WIDTH = 64, MAX_WIDTH
+MIN_MAP_DPI, MAX_MAP_DPI = 50, 300
+
+# Metrics served at /metrics
+REQUEST_SECONDS = Histogram("map_request_seconds", "Latency of /update_map responses per selection.",
+                            ["year", "race"])
+RENDER_SECONDS = Histogram("map_render_seconds", "Time to render a map on a cache miss.", ["year", "race"])
+RENDER_STAGE_SECONDS = Histogram("map_render_stage_seconds", "Time spent in each render stage.", ["stage"])
+CACHE_REQUESTS = Counter("map_cache_requests_total", "Map requests by render cache outcome.", ["result"])
+RENDERS_IN_FLIGHT = Gauge("map_renders_in_flight", "Renders currently running in the worker pool.")
+RENDERS_COALESCED = Counter("map_renders_coalesced_total", "Cache misses served by another request's render.")
+RENDERS_REJECTED = Counter("map_renders_rejected_total", "Renders refused with 503 because the queue was full.")
+WORKER_MEMORY = Gauge("map_render_worker_memory_bytes",
+                      "Memory of each render worker process at its latest job (rss, pss, shared, private).",
+                      ["worker", "kind"])
+
+# Client-side rendering API: geometry is served once per version and cached
+# "forever" by URL; the per-selection payloads are a few hundred bytes
+TOPOLOGY_MAX_AGE = 365 * 24 * 3600
+# Level of detail served by default (250 m, sharp on screens up to ~2000 px wide)
+DEFAULT_TOPOLOGY_LOD = 2
+_topologies = {}
+_topologies_lock = threading.Lock()
+# Topology versions per (level of detail, region scheme), from the geometry meta
+_topology_versions = {}
+# Largest batch of points /api/locate resolves in one request
+MAX_LOCATE_POINTS = 10000
+
+# Meta of the geometry store, which is built or validated before the first
+# cache key: the key hashes the store file, which must not change under it
+_geometry_meta = None
+_geometry_meta_lock = threading.Lock()
+
+# Warm render workers, started on the first request (pool size, per-job
+# timeout and queue bound come from MAP_RENDER_WORKERS / _TIMEOUT / _QUEUE)
+_render_pool = None
+_render_pool_lock = threading.Lock()
+# Concurrent misses for the same cache key wait for a single render
+_render_flights = SingleFlight()
+
+
+def get_geometry_meta():
+    """Source fingerprint of the geometry store, building the store first if it is missing or stale."""
+    global _geometry_meta
+    if _geometry_meta is None:
+        with _geometry_meta_lock:
+            if _geometry_meta is None:
+                from geometry_store import ensure_store
+                _geometry_meta = ensure_store()
+    return _geometry_meta
+
+
+def get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = pool_from_env()
+            atexit.register(_render_pool.close)
+        return _render_pool
+
+
+def _bounded_int_arg(name, low, high):
+    """Integer query parameter within [low, high], or None when absent."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    if not value.isdigit() or not low <= int(value) <= high:
+        raise ValueError(f"Invalid {name} '{value}' (expected an integer from {low} to {high}).")
+    return int(value)
+
 
 @app.route('/update_map', methods=['GET'])
 def update_map():
-    """Generate and return the updated map based on user selection."""
-    year = request.args.get('year', "2023")
+    """Generate and return the updated map based on user selection.
+
+    Optional: format=png (default), webp or svg; width in pixels (PNG/WebP,
+    height follows); dpi of the drawing (default 100, or just enough for width).
+    """
+    year = request.args.get('year') or str(get_rate_cube().years[-1])
     race = request.args.get('race', "NHA").upper()  # Ensure uppercase for dataset consistency
+    fmt = request.args.get('format', 'png').lower()
+
+    try:
+        year = int(year)
+    except ValueError:
+        return jsonify({"error": f"Invalid year '{year}'."}), 400
+    if fmt not in MAP_FORMATS:
+        return jsonify({"error": f"Unsupported format '{fmt}' (use one of {', '.join(MAP_FORMATS)})."}), 400
+    try:
+        width = _bounded_int_arg('width', MIN_MAP_WIDTH, MAX_MAP_WIDTH)
+        dpi = _bounded_int_arg('dpi', MIN_MAP_DPI, MAX_MAP_DPI)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Vector output has no pixel width, and maps are only drawn at a few
+    # resolutions (every other dpi would cost the workers a base layer)
+    dpi, width = map_options(fmt, dpi, width)
 
-    # Define expected map file path
-    map_path = os.path.join(OUTPUT_FOLDER, f"{race}_{year}.png")
+    # Unknown selections are rejected without involving a render worker
+    if not get_rate_cube().has(race, year):
+        return jsonify({"error": f"Map '{race}_{year}' not found.",
+                        "details": f"No data found for Race={race}, Year={year}"}), 404
 
-    # Remove old map if it exists to force regeneration
-    if os.path.exists(map_path):
-        os.remove(map_path)
+    start = time.perf_counter()
 
-    # Run the main map script with parameters
+    # Unchanged inputs mean an unchanged image: answer revalidation without rendering
+    # Every size and format is a cache entry of its own, keyed as batch_render keys it
+    # (and only once the geometry store exists, as workers would build it mid-request)
     try:
-        result = subprocess.run(
-            ["python", MAP_GENERATION_SCRIPT, str(year), race],
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        print("Map Generation Output:", result.stdout)
-        print("Map Generation Errors:", result.stderr)
-    except subprocess.CalledProcessError as e:
+        get_geometry_meta()
+    except Exception as e:
         return jsonify({"error": "Map generation failed", "details": str(e)}), 500
+    key = cache_key(render_cache, year, race, fmt, dpi=dpi, width=width)
+    if request.if_none_match.contains(key):
+        CACHE_REQUESTS.inc(result="not_modified")
+        REQUEST_SECONDS.observe(time.perf_counter() - start, year=year, race=race)
+        response = app.response_class(status=304)
+        response.set_etag(key)
+        response.cache_control.public = True
+        response.cache_control.max_age = HTTP_MAX_AGE
+        return response
+
+    def render_and_store():
+        # Render in a pre-warmed worker process
+        with RENDERS_IN_FLIGHT.track_inprogress(), collect_spans() as spans:
+            image = get_render_pool().render(year, race, dpi=dpi, fmt=fmt, width=width)
+        render_cache.put(key, image, fmt)
+        return image, spans
+
+    image = render_cache.get(key, fmt)
+    if image is None:
+        CACHE_REQUESTS.inc(result="miss")
+        try:
+            (image, spans), shared = _render_flights.do(key, render_and_store)
+        except RenderQueueFull as e:
+            RENDERS_REJECTED.inc()
+            response = jsonify({"error": "Map renderer is busy, try again shortly", "details": str(e)})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        except RenderInterrupted as e:
+            response = jsonify({"error": "Map renderer restarted, try again shortly", "details": str(e)})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        except RenderTimeout as e:
+            return jsonify({"error": "Map generation timed out", "details": str(e)}), 504
+        except (ValueError, KeyError) as e:
+            return jsonify({"error": f"Map '{race}_{year}' not found.", "details": str(e)}), 404
+        except Exception as e:
+            return jsonify({"error": "Map generation failed", "details": str(e)}), 500
+        if shared:
+            RENDERS_COALESCED.inc()
+        else:
+            for stage, seconds in spans:
+                RENDER_STAGE_SECONDS.observe(seconds, stage=stage)
+        RENDER_SECONDS.observe(time.perf_counter() - start, year=year, race=race)
+    else:
+        CACHE_REQUESTS.inc(result="hit")
+
+    REQUEST_SECONDS.observe(time.perf_counter() - start, year=year, race=race)
+    return send_file(io.BytesIO(image), mimetype=MAP_FORMATS[fmt], etag=key, max_age=HTTP_MAX_AGE)
+
+
+def topology_version(lod):
+    """Version of the county TopoJSON at one level of detail, computed from the store's meta alone."""
+    meta = get_geometry_meta()
+    if not 0 <= lod < len(meta.get("lod_tolerances", [0])):
+        raise IndexError(f"No level of detail {lod}")
+    key = (lod, load_region_scheme().fingerprint)
+    version = _topology_versions.get(key)
+    if version is None:
+        payload = json.dumps([meta, lod, DEFAULT_QUANTIZATION, county_regions()], sort_keys=True)
+        version = _topology_versions[key] = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    return version
+
+
+def get_topology(lod):
+    """(version, JSON bytes, gzipped bytes) of the county TopoJSON at one level of detail."""
+    version = topology_version(lod)
+    with _topologies_lock:
+        if version not in _topologies:
+            # GeoPandas is only needed here, so the app does not load it until the first geometry request
+            from geometry_store import get_geometry_store
+
+            geo = get_geometry_store()
+            level = geo.level(lod)
+            counties = level.counties.to_crs(epsg=4326)
+            region_of = county_regions()
+            topology = encode_topology({
+                "counties": (counties.geometry.values, [
+                    {"name": name, "type": kind, "region": region_of.get(name)}
+                    for name, kind in zip(counties["name"], counties["Urban_Rural"])
+                ]),
+                "state": (level.state_boundary.to_crs(epsg=4326).geometry.values, [None]),
+            })
+            body = json.dumps(topology, separators=(",", ":")).encode()
+            _topologies[version] = (version, body, gzip.compress(body, 9))
+        return _topologies[version]
+
+
+@app.route('/api/geometry', methods=['GET'])
+def geometry():
+    """County and state outlines as quantized TopoJSON (lon/lat), cacheable by version."""
+    lod = request.args.get('lod', DEFAULT_TOPOLOGY_LOD)
+    try:
+        lod = int(lod)
+        version, body, gzipped = get_topology(lod)
+    except (ValueError, IndexError):
+        return jsonify({"error": f"Invalid level of detail '{lod}'."}), 400
+
+    requested = request.args.get('v')
+    if requested is not None and requested != version:
+        return redirect(url_for('geometry', lod=lod, v=version))
+
+    use_gzip = 'gzip' in request.accept_encodings
+    etag = f"{version}-gz" if use_gzip else version
+    response = Response(gzipped if use_gzip else body, mimetype='application/json')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    if requested:
+        # A versioned URL never changes content
+        response.cache_control.public = True
+        response.cache_control.max_age = TOPOLOGY_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/api/data', methods=['GET'])
+def selection_data():
+    """Rates, ranked table, statewide values and total count of one (year, race)."""
+    year = request.args.get('year') or str(get_rate_cube().years[-1])
+    race = request.args.get('race', "NHA").upper()
+    try:
+        year = int(year)
+    except ValueError:
+        return jsonify({"error": f"Invalid year '{year}'."}), 400
+
+    cube = get_rate_cube()
+    if not cube.has(race, year):
+        return jsonify({"error": f"No data found for Race={race}, Year={year}"}), 404
+
+    payload = cube.summary(race, year)
+    # Versioned link, so clients can cache the geometry indefinitely
+    payload["geometry"] = url_for('geometry', lod=DEFAULT_TOPOLOGY_LOD, v=topology_version(DEFAULT_TOPOLOGY_LOD))
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = HTTP_MAX_AGE
+    return response.make_conditional(request)
+
+
+def _list_arg(payload, name):
+    """Values of a parameter given as a list, a scalar or a comma-separated string."""
+    value = payload.get(name)
+    if value is None or value == "":
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(",") if v.strip()]
+    return value if isinstance(value, list) else [value]
+
+
+@app.route('/api/locate', methods=['GET', 'POST'])
+def locate():
+    """County, urban/rural class, region and region rates of lat/lon points.
+
+    GET ?lat=41.88&lon=-87.63 (comma-separated for several points), or POST
+    JSON {"lat": [...], "lon": [...]}. Optional year and race (lists or
+    comma-separated) default to the latest year and every race.
+    """
+    payload = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    try:
+        lat = np.asarray(_list_arg(payload, 'lat'), dtype=float)
+        lon = np.asarray(_list_arg(payload, 'lon'), dtype=float)
+        years = [int(y) for y in _list_arg(payload, 'year')]
+    except (TypeError, ValueError):
+        return jsonify({"error": "lat, lon and year must be numbers."}), 400
+    races = [str(r) for r in _list_arg(payload, 'race')]
+    if not len(lat) or lat.shape != lon.shape or lat.ndim != 1:
+        return jsonify({"error": "Pass one or more points as matching lat and lon lists."}), 400
+    if len(lat) > MAX_LOCATE_POINTS:
+        return jsonify({"error": f"At most {MAX_LOCATE_POINTS} points per request."}), 400
+    if not (np.isfinite(lat).all() and np.isfinite(lon).all()
+            and (np.abs(lat) <= 90).all() and (np.abs(lon) <= 180).all()):
+        return jsonify({"error": "Coordinates must be latitudes in [-90, 90] and longitudes in [-180, 180]."}), 400
+
+    # GeoPandas and the spatial index are only loaded for the first lookup
+    from county_lookup import get_county_locator
+    try:
+        result = get_county_locator().lookup(lat, lon, years=years, races=races)
+    except KeyError as e:
+        return jsonify({"error": "No such race or year.", "details": str(e)}), 404
+    response = jsonify(result)
+    if request.method == 'GET':
+        response.add_etag()
+        response.cache_control.public = True
+        response.cache_control.max_age = HTTP_MAX_AGE
+        return response.make_conditional(request)
+    return response
+
+
+@app.route('/api/derived', methods=['GET'])
+def derived():
+    """YoY change, rank, disparity vs NHW and statewide deviation, as JSON, CSV or Parquet.
+
+    Optional filters: race, region, year; format=json (default), csv or parquet.
+    """
+    filters = {name: request.args[name] for name in ('race', 'region', 'year') if request.args.get(name)}
+    fmt = request.args.get('format', 'json').lower()
+    metrics = get_derived_metrics()
+    try:
+        if fmt == 'json':
+            response = jsonify({"version": list(metrics.version), "records": metrics.records(**filters)})
+        elif fmt == 'csv':
+            response = Response(metrics.to_csv(**filters), mimetype='text/csv')
+        elif fmt == 'parquet':
+            response = Response(metrics.to_parquet(**filters), mimetype='application/vnd.apache.parquet')
+        else:
+            return jsonify({"error": f"Unsupported format '{fmt}'."}), 400
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": "No such race, region or year.", "details": str(e)}), 404
+    except RuntimeError as e:
+        return jsonify({"error": "Export failed", "details": str(e)}), 500
+    if fmt != 'json':
+        response.headers['Content-Disposition'] = f'attachment; filename=asthma_metrics.{fmt}'
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = HTTP_MAX_AGE
+    return response.make_conditional(request)
+
+
+def _update_worker_memory():
+    # Only the current workers: a recycled pool's processes are gone
+    WORKER_MEMORY.clear()
+    if _render_pool is not None:
+        for pid, memory in _render_pool.worker_memory().items():
+            for kind, value in memory.items():
+                WORKER_MEMORY.set(value, worker=pid, kind=kind)
 
-    # Ensure the new map is created
-    if not os.path.exists(map_path):
-        return jsonify({"error": f"Map '{map_path}' not found."}), 404
 
-    return send_file(map_path, mimetype='image/png')
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Render latency, cache, in-flight and worker memory metrics in Prometheus text format."""
+    _update_worker_memory()
+    return Response(REGISTRY.exposition(), content_type=CONTENT_TYPE)
 
 if __name__ == '__main__':
     app.run(debug=True)
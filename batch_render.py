@@ -0,0 +1,186 @@
+"""
+Parallel batch pre-render of every (year, race, dpi, format) combination.
+
+Data and geometry are loaded once in the parent process and shared with the
+worker processes, which fan the renders out over all cores. Results go into
+the same content-addressed render cache used by the Flask app, under the keys
+/update_map looks up (map_render.cache_key), so a batch run warms the app and
+is incremental: a combination is only re-rendered when its cache key (input
+data + renderer version) has changed. Resolutions are rounded up to the
+master resolutions maps are drawn at (map_render.MASTER_DPIS).
+
+    python batch_render.py --all
+    python batch_render.py --years 2022 2023 --races NHB HISP --dpi 100 200
+    python v9_main_map.py --all --output-dir static/maps
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from map_render import cache_key, map_options, warm_up
+from rate_cube import get_rate_cube
+from render_cache import atomic_write, cache_from_env, RenderCache
+
+RACES = ("NHB", "NHW", "NHA", "HISP")
+MANIFEST_NAME = ".manifest.json"
+
+
+def available_years():
+    """Years present in the asthma CSV."""
+    return list(get_rate_cube().years)
+
+
+def _timed_render(year, race, dpi, fmt):
+    import map_render
+    start = time.perf_counter()
+    data = map_render.render_map(year, race, fmt, dpi=dpi)
+    return data, time.perf_counter() - start
+
+
+def _output_name(year, race, dpi, fmt, default_dpi):
+    suffix = "" if dpi == default_dpi else f"_{dpi}dpi"
+    return f"{race}_{year}{suffix}.{fmt}"
+
+
+def _load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _prepare_inputs():
+    """Build the geometry store now if it is missing or stale.
+
+    Cache keys hash the store file, so it has to exist before they are
+    computed: a key hashed while the file was still missing would never match
+    the key of the next run.
+    """
+    from geometry_store import get_geometry_store
+    get_geometry_store()
+
+
+def _executor(jobs):
+    """Process pool whose workers start with the geometry and base layer loaded."""
+    if "fork" in multiprocessing.get_all_start_methods():
+        # Warm the parent once; forked workers inherit everything it loaded
+        warm_up()
+        return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("fork"))
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=warm_up)
+
+
+def run_batch(years, races, dpis, formats, jobs=None, cache=None, output_dir=None, force=False, log=print):
+    """Render the requested matrix; return a list of per-job result dicts."""
+    cache = cache or cache_from_env()
+    jobs = jobs or os.cpu_count() or 1
+    manifest = _load_manifest(output_dir) if output_dir else {}
+    _prepare_inputs()
+    # Maps are only drawn at master resolutions (map_render.snap_dpi)
+    dpis = list(dict.fromkeys(map_options(dpi=dpi)[0] for dpi in dpis))
+
+    matrix = [(y, r, d, f) for y in years for r in races for d in dpis for f in formats]
+    results = []
+    pending = []
+    for year, race, dpi, fmt in matrix:
+        # The key /update_map?year=..&race=..&format=..&dpi=.. looks up
+        key = cache_key(cache, year, race, fmt, dpi=dpi)
+        job = {"year": year, "race": race, "dpi": dpi, "format": fmt, "key": key, "seconds": 0.0}
+        if output_dir:
+            job["output"] = os.path.join(output_dir, _output_name(year, race, dpi, fmt, dpis[0]))
+        if force or not cache.contains(key, fmt):
+            pending.append(job)
+        else:
+            job["status"] = "up-to-date"
+            results.append(job)
+
+    def report(job):
+        line = (f"[{len(results):>3}/{len(matrix)}] {job['race']:<4} {job['year']} {job['format']:<4} "
+                f"{job['dpi']:>4}dpi {job['status']:<10} {job['seconds']:6.2f}s")
+        log(line + (f"  {job['error']}" if "error" in job else ""))
+
+    def write_output(job, data):
+        name = os.path.basename(job["output"])
+        if data is None and manifest.get(name) == job["key"] and os.path.exists(job["output"]):
+            return
+        if data is None:
+            data = cache.get(job["key"], job["format"])
+        atomic_write(job["output"], data)
+        manifest[name] = job["key"]
+
+    for job in results:
+        if output_dir:
+            write_output(job, None)
+    for n, job in enumerate(results, 1):
+        log(f"[{n:>3}/{len(matrix)}] {job['race']:<4} {job['year']} {job['format']:<4} "
+            f"{job['dpi']:>4}dpi {job['status']:<10}")
+
+    if pending:
+        with _executor(min(jobs, len(pending))) as executor:
+            futures = {
+                executor.submit(_timed_render, j["year"], j["race"], j["dpi"], j["format"]): j
+                for j in pending
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    data, job["seconds"] = future.result()
+                except Exception as e:
+                    job["status"] = "failed"
+                    job["error"] = str(e)
+                else:
+                    cache.put(job["key"], data, job["format"])
+                    job["status"] = "rendered"
+                    if output_dir:
+                        write_output(job, data)
+                results.append(job)
+                report(job)
+
+    if output_dir:
+        atomic_write(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, indent=2).encode())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-render maps for every year x race combination.")
+    parser.add_argument("--all", action="store_true", help="every year in the data and every race")
+    parser.add_argument("--years", type=int, nargs="+", help="years to render (default: all)")
+    parser.add_argument("--races", nargs="+", help="race groups to render (default: all)")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[100], help="output resolutions")
+    parser.add_argument("--formats", nargs="+", default=["png"], help="output formats, e.g. png svg")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--output-dir", default=None, help="also write {race}_{year}.{fmt} files here")
+    parser.add_argument("--cache-dir", default=None, help="render cache directory")
+    parser.add_argument("--force", action="store_true", help="re-render even if the cache is up to date")
+    parser.add_argument("--report", default=None, help="write per-job timings to this JSON file")
+    args = parser.parse_args(argv)
+
+    if not (args.all or args.years or args.races):
+        parser.error("pass --all or choose --years/--races")
+
+    years = args.years or available_years()
+    races = [r.upper() for r in (args.races or RACES)]
+    cache = RenderCache(cache_dir=args.cache_dir) if args.cache_dir else cache_from_env()
+
+    start = time.perf_counter()
+    results = run_batch(years, races, args.dpi, args.formats, jobs=args.jobs, cache=cache,
+                        output_dir=args.output_dir, force=args.force)
+    wall = time.perf_counter() - start
+
+    counts = {s: sum(1 for r in results if r["status"] == s) for s in ("rendered", "up-to-date", "failed")}
+    render_total = sum(r["seconds"] for r in results)
+    print(f"{len(results)} jobs: {counts['rendered']} rendered, {counts['up-to-date']} up to date, "
+          f"{counts['failed']} failed in {wall:.2f}s wall ({render_total:.2f}s render time)")
+
+    if args.report:
+        atomic_write(args.report, json.dumps({"wall_seconds": wall, "jobs": results}, indent=2).encode())
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Shared by the benchmark scripts: paths, the JSON-lines history of their runs
+and the command-line options that read it.
+
+Each script appends one record per run to its own history file
+(bench_pipeline.py to history.jsonl, load_test.py to load_history.jsonl).
+Records start with run_record()'s common fields, so `compare` can find a
+baseline by label or commit in either file. The history files are local
+results and are not committed.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+VENDORED_GEOJSON = os.path.join(BENCH_DIR, "data", "illinois-counties.geojson")
+FIXTURE_GEOJSON = os.path.join(BENCH_DIR, "data", "synthetic-counties.geojson")
+
+
+def default_geojson():
+    """The vendored real GeoJSON if there is one, else the committed synthetic fixture."""
+    return VENDORED_GEOJSON if os.path.exists(VENDORED_GEOJSON) else FIXTURE_GEOJSON
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_record(label, geojson, **fields):
+    """A history record: when, what code and machine, which GeoJSON, then `fields`."""
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "label": label,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "geojson": os.path.relpath(geojson, BENCH_DIR),
+        **fields,
+    }
+
+
+# -------------------------------------------------------------------------
+# History file
+# -------------------------------------------------------------------------
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(record, path):
+    with open(path, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def find_record(history, ref):
+    """Latest record whose label or commit matches `ref` (or the first record)."""
+    if ref is None:
+        return history[0]
+    for record in reversed(history):
+        if ref in (record.get("label"), record.get("commit")):
+            return record
+    sys.exit(f"No record with label or commit '{ref}' in the history file.")
+
+
+def compare_runs(args, compare):
+    """Run compare(baseline, current, threshold) on the records picked by the compare options."""
+    history = load_history(args.history)
+    if len(history) < 2:
+        sys.exit("Need at least two runs in the history file to compare.")
+    baseline = find_record(history, args.baseline)
+    current = find_record(history, args.current) if args.current else history[-1]
+    return compare(baseline, current, args.threshold)
+
+
+# -------------------------------------------------------------------------
+# Command line
+# -------------------------------------------------------------------------
+def argument_parser(description, history_file):
+    """Parser with the --history and --geojson options every benchmark script takes."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--history", default=history_file, help="JSON-lines results file")
+    parser.add_argument("--geojson", default=None,
+                        help="counties GeoJSON (default: the vendored copy, else the synthetic fixture)")
+    return parser
+
+
+def add_compare_command(sub, threshold_help):
+    """The `compare` subcommand: the latest run (or --current) against --baseline."""
+    cmp_ = sub.add_parser("compare", help="compare the latest run against a baseline")
+    cmp_.add_argument("--baseline", default=None, help="label or commit (default: first run)")
+    cmp_.add_argument("--current", default=None, help="label or commit (default: latest run)")
+    cmp_.add_argument("--threshold", type=float, default=0.10, help=threshold_help)
+    return cmp_
@@ -0,0 +1,403 @@
+"""
+Offline stage-level benchmarks for the map pipeline.
+
+Every stage of a render is timed on its own against the bundled CSVs and the
+county GeoJSON (no network access), and the peak Python heap allocated by the
+stage is recorded with tracemalloc. The GeoJSON is a vendored copy of the real
+boundaries when `vendor` has been run, and otherwise the committed synthetic
+fixture benchmarks/data/synthetic-counties.geojson (see make_fixture.py); each
+run records which one it used. The cold start of a
+fresh `python map_render.py` process (interpreter, imports, geometry load,
+base layer, first render) is timed as cold_* stages. Results are appended to
+benchmarks/history.jsonl so changes can be compared against a baseline.
+
+    python benchmarks/bench_pipeline.py run --label my-change
+    python benchmarks/bench_pipeline.py vendor          # optional: copy/download the real GeoJSON
+    python benchmarks/bench_pipeline.py compare         # latest run vs. first run
+    python benchmarks/bench_pipeline.py compare --baseline main --threshold 0.15
+    python benchmarks/bench_pipeline.py soak --renders 2000 --threads 4
+
+`soak` renders in a thread pool inside one process and fails if a render's
+bytes differ from a serial render of the same selection, if any Figure
+outlives its render, or if RSS keeps growing after the warm-up renders.
+"""
+import gc
+import hashlib
+import io
+import itertools
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from _history import (BENCH_DIR, REPO_DIR, VENDORED_GEOJSON, add_compare_command, append_history,
+                      argument_parser, compare_runs, default_geojson, run_record)
+
+HISTORY_FILE = os.path.join(BENCH_DIR, "history.jsonl")
+
+
+# -------------------------------------------------------------------------
+# Environment
+# -------------------------------------------------------------------------
+def _offline_environment(geojson_path):
+    """Point the pipeline at the county GeoJSON and throwaway geometry and rate stores."""
+    if not os.path.exists(geojson_path):
+        sys.exit(f"County GeoJSON not found at {geojson_path}.")
+    os.chdir(REPO_DIR)
+    sys.path.insert(0, REPO_DIR)
+    store_dir = tempfile.mkdtemp(prefix="bench-geo-")
+    os.environ["ILLINOIS_GEOJSON_PATH"] = geojson_path
+    os.environ["GEOMETRY_STORE_PATH"] = os.path.join(store_dir, "store.npz")
+    os.environ["RATE_STORE_PATH"] = os.path.join(store_dir, "rates.arrow")
+    import matplotlib
+    matplotlib.use("Agg")
+    return store_dir
+
+
+# -------------------------------------------------------------------------
+# Measurement
+# -------------------------------------------------------------------------
+def measure(fn, repeat, setup=None):
+    """Time `fn` `repeat` times, then run it once more under tracemalloc for its peak heap.
+
+    Tracing slows allocation-heavy code considerably, so it is kept out of the timed runs.
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        result = fn(arg) if setup else fn()
+        times.append(time.perf_counter() - start)
+        del result
+
+    arg = setup() if setup else None
+    tracemalloc.start()
+    try:
+        result = fn(arg) if setup else fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "max_s": max(times),
+        "peak_kb": round(peak / 1024, 1),
+        "repeat": repeat,
+    }
+
+
+def run_stages(geojson_path, repeat=5, year=2020, race="NHB"):
+    import geopandas as gpd
+    from shapely.ops import unary_union
+
+    import geometry_store
+    import image_encode
+    import rate_cube
+    import rate_store
+    import v9_main_map
+
+    stages = {}
+
+    def stage(name, fn, setup=None, n=repeat):
+        stages[name] = measure(fn, n, setup)
+        s = stages[name]
+        print(f"  {name:<24} median {s['median_s'] * 1000:9.2f} ms   peak {s['peak_kb']:10.1f} KiB")
+
+    print(f"Benchmarking {race} {year}, {repeat} repeats per stage")
+
+    # Data
+    stage("csv_load_reshape", lambda: rate_cube.RateCube(rate_cube.CSV_PATH, rate_cube.TOTAL_COUNT_CSV))
+    stage("rate_store_ingest", lambda: rate_store.load_cube(rebuild=True), n=1)
+    stage("rate_store_load", lambda: rate_store.load_cube())
+    cube = rate_cube.get_rate_cube()
+    stage("data_prep", lambda: v9_main_map.prepare_map_data(year, race, cube=cube))
+
+    # Geometry, the way renders used to do it on every call
+    stage("geometry_read_reproject", lambda: gpd.read_file(geojson_path).to_crs(epsg=geometry_store.TARGET_EPSG))
+    illinois = gpd.read_file(geojson_path).to_crs(epsg=geometry_store.TARGET_EPSG)
+    stage("dissolve", lambda: illinois.dissolve())
+    stage("halo_union_buffer", lambda: unary_union(illinois.geometry).buffer(geometry_store.HALO_BUFFER))
+
+    # Geometry store
+    stage("geometry_store_build", lambda: geometry_store.build_store(), n=1)
+    stage("geometry_store_load", lambda: geometry_store._read_store(geometry_store.GEOMETRY_STORE_PATH))
+    # Levels are built from the mapped arrays on first use
+    stage("geometry_level_build",
+          lambda: geometry_store._read_store(geometry_store.GEOMETRY_STORE_PATH).level(2).counties)
+    geo = geometry_store.get_geometry_store()
+
+    # Drawing
+    def fresh_axes():
+        fig = v9_main_map.new_figure()
+        ax = fig.subplots()
+        ax.set_xlim(*geo.halo.bounds[0::2])
+        ax.set_ylim(*geo.halo.bounds[1::2])
+        ax.set_aspect('equal')
+        return fig, ax
+
+    counties = v9_main_map.prepare_geography()
+
+    def labels(fig_ax):
+        fig, ax = fig_ax
+        v9_main_map.draw_county_labels(fig, ax, counties)
+        v9_main_map.draw_county_markers(ax, counties)
+        fig.canvas.draw()
+
+    # Glyph outlines are built once per process, then shared by every base layer
+    names = counties["name"].to_numpy()
+    stage("county_label_paths",
+          lambda: v9_main_map._build_label_paths(names, v9_main_map.COUNTY_LABEL_FONTSIZE), n=1)
+    stage("county_labels", labels, setup=fresh_axes)
+    stage("base_layer", lambda: v9_main_map._build_base_layer(v9_main_map.FIGSIZE, v9_main_map.DPI))
+    v9_main_map.get_base_layer()
+
+    def table():
+        fig = v9_main_map.new_figure()
+        data = v9_main_map.prepare_map_data(year, race, cube=cube)
+        table_ax = fig.add_axes([0.25, 0.38, 0.12, 0.4])
+        tab = v9_main_map.Table(table_ax, bbox=[0, 0, 1, 1])
+        for i, row_data in enumerate(data[0]):
+            tab.add_cell(i, 0, width=2.5, height=0.8, text=row_data[0], loc='center')
+        table_ax.add_table(tab)
+        fig.canvas.draw()
+
+    stage("table", table)
+
+    stage("layout", lambda: v9_main_map._build_layout(v9_main_map.FIGSIZE, cube), n=1)
+    v9_main_map.get_map_layout()
+    stage("figure_assembly", lambda: v9_main_map.compose_map_figure(year, race))
+
+    def encode(fig):
+        fig.savefig(io.BytesIO(), format="png", bbox_inches=v9_main_map.get_map_layout())
+
+    stage("png_encode", encode, setup=lambda: v9_main_map.compose_map_figure(year, race))
+    stage("render_total", lambda: v9_main_map.render_map_png(year, race))
+
+    # Single draw + Pillow encoders (the map_render path for PNG/WebP)
+    stage("draw_rgba", lambda: v9_main_map.render_map_rgba(year, race))
+    pixels = v9_main_map.render_map_rgba(year, race)
+    stage("png_quantized_encode", lambda: image_encode.encode_image(pixels, "png"))
+    stage("webp_encode", lambda: image_encode.encode_image(pixels, "webp"))
+    stage("png_quantized_encode_640", lambda: image_encode.encode_image(pixels, "png", width=640))
+    return stages
+
+
+def run_cold_start(repeat=3, year=2020, race="NHB"):
+    """Time fresh `map_render.py` processes from interpreter start to the first saved map.
+
+    peak_kb of these stages is the largest peak RSS of the child processes, not
+    a tracemalloc heap peak.
+    """
+    import resource
+
+    print(f"Cold start of a fresh process, {repeat} runs")
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="bench-cold-") as tmp:
+        cmd = [sys.executable, os.path.join(REPO_DIR, "map_render.py"), str(year), race,
+               "-o", os.path.join(tmp, "map.png"), "--cold-start", "--json"]
+        for _ in range(repeat):
+            start = time.perf_counter()
+            out = subprocess.run(cmd, cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout
+            breakdown = json.loads(out.strip().splitlines()[-1])
+            breakdown["process"] = time.perf_counter() - start
+            runs.append(breakdown)
+    peak_kb = float(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    stages = {}
+    for name in ("cold_import", "cold_geometry", "cold_base_layer", "cold_layout", "first_render", "process"):
+        times = [run.get(name, 0.0) for run in runs]
+        name = name if name.startswith("cold_") else f"cold_{name}"
+        stages[name] = {
+            "median_s": statistics.median(times),
+            "min_s": min(times),
+            "max_s": max(times),
+            "peak_kb": peak_kb,
+            "repeat": repeat,
+        }
+        print(f"  {name:<24} median {stages[name]['median_s'] * 1000:9.2f} ms")
+    return stages
+
+
+def _rss_kb():
+    """Current resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _live_figures():
+    from matplotlib.figure import Figure
+    gc.collect()
+    return sum(isinstance(obj, Figure) for obj in gc.get_objects())
+
+
+def run_soak(renders, threads, warmup, checkpoint):
+    """Render `renders` maps on `threads` threads; return (failures, checkpoints)."""
+    import map_render
+    import rate_cube
+
+    # Every render must actually draw, not reuse a cached master
+    map_render.MASTER_CACHE_BYTES = 0
+    cube = rate_cube.get_rate_cube()
+    selections = [(year, race) for year in cube.years for race in ("NHB", "NHW", "NHA", "HISP")
+                  if cube.has(race, year)]
+    # Serial reference image of every selection
+    reference = {sel: hashlib.sha256(map_render.render_map(*sel)).hexdigest() for sel in selections}
+
+    failures = []
+    checkpoints = []
+    jobs = itertools.islice(itertools.cycle(selections), renders)
+
+    def render(sel):
+        return sel, hashlib.sha256(map_render.render_map(*sel)).hexdigest()
+
+    print(f"Soak: {renders} renders of {len(selections)} selections on {threads} threads")
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        baseline_kb = None
+        for done, (sel, digest) in enumerate(pool.map(render, jobs), 1):
+            if digest != reference[sel]:
+                failures.append(f"render {done} of {sel[1]} {sel[0]} differs from the serial render")
+            if done == min(warmup, renders) or done % checkpoint == 0 or done == renders:
+                rss, figures = _rss_kb(), _live_figures()
+                if baseline_kb is None:
+                    baseline_kb = rss
+                checkpoints.append({"renders": done, "rss_kb": rss, "figures": figures})
+                print(f"  {done:>6} renders   rss {rss / 1024:8.1f} MiB ({(rss - baseline_kb) / 1024:+7.1f})"
+                      f"   live figures {figures}")
+    if checkpoints[-1]["figures"]:
+        failures.append(f"{checkpoints[-1]['figures']} Figure objects outlived their renders")
+    return failures, checkpoints
+
+
+# -------------------------------------------------------------------------
+# Comparison
+# -------------------------------------------------------------------------
+def compare(baseline, current, threshold):
+    """Print a stage-by-stage comparison; return the names of regressed stages."""
+    regressions = []
+    print(f"baseline: {baseline.get('label') or baseline.get('commit')} ({baseline['timestamp']})")
+    print(f"current:  {current.get('label') or current.get('commit')} ({current['timestamp']})")
+    if baseline.get("geojson") != current.get("geojson"):
+        print(f"warning: the runs used different GeoJSON ({baseline.get('geojson')} vs {current.get('geojson')}); "
+              f"geometry stages are not comparable")
+    print(f"{'stage':<24} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for name, cur in current["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            print(f"{name:<24} {'-':>12} {cur['median_s'] * 1000:12.2f} {'new':>8}")
+            continue
+        change = cur["median_s"] / base["median_s"] - 1 if base["median_s"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<24} {base['median_s'] * 1000:12.2f} {cur['median_s'] * 1000:12.2f} {change:+8.1%}{flag}")
+    return regressions
+
+
+# -------------------------------------------------------------------------
+# Commands
+# -------------------------------------------------------------------------
+def cmd_vendor(args):
+    args.geojson = args.geojson or VENDORED_GEOJSON
+    os.makedirs(os.path.dirname(args.geojson), exist_ok=True)
+    local_copy = os.path.join(REPO_DIR, "static", "geo", "illinois-counties.geojson")
+    if os.path.exists(local_copy):
+        shutil.copyfile(local_copy, args.geojson)
+    else:
+        sys.path.insert(0, REPO_DIR)
+        from geometry_store import ILLINOIS_GEOJSON_URL
+        with urllib.request.urlopen(ILLINOIS_GEOJSON_URL, timeout=30) as resp, open(args.geojson, "wb") as f:
+            f.write(resp.read())
+    print(f"Vendored GeoJSON -> {args.geojson}")
+    return 0
+
+
+def cmd_run(args):
+    store_dir = _offline_environment(args.geojson)
+    try:
+        stages = run_stages(args.geojson, repeat=args.repeat, year=args.year, race=args.race)
+        if args.cold_repeat:
+            stages.update(run_cold_start(repeat=args.cold_repeat, year=args.year, race=args.race))
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    record = run_record(args.label, args.geojson, stages=stages)
+    append_history(record, args.history)
+    print(f"Appended results to {args.history}")
+    return 0
+
+
+def cmd_compare(args):
+    regressions = compare_runs(args, compare)
+    if regressions:
+        print(f"{len(regressions)} stage(s) slower than baseline by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+def cmd_soak(args):
+    store_dir = _offline_environment(args.geojson)
+    try:
+        failures, checkpoints = run_soak(args.renders, args.threads, args.warmup, args.checkpoint)
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    growth_mb = (checkpoints[-1]["rss_kb"] - checkpoints[0]["rss_kb"]) / 1024
+    if growth_mb > args.max_growth_mb:
+        failures.append(f"RSS grew {growth_mb:.1f} MiB after the warm-up (limit {args.max_growth_mb:g} MiB)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(f"OK: RSS {growth_mb:+.1f} MiB after the warm-up, no leaked figures, identical output")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argument_parser("Offline stage-level benchmarks for the map pipeline.", HISTORY_FILE)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("vendor", help="copy or download the real counties GeoJSON to benchmark against")
+
+    run = sub.add_parser("run", help="benchmark every stage and append to the history file")
+    run.add_argument("--repeat", type=int, default=5)
+    run.add_argument("--year", type=int, default=2020)
+    run.add_argument("--race", default="NHB")
+    run.add_argument("--label", default=None, help="name for this run, e.g. a branch")
+    run.add_argument("--cold-repeat", type=int, default=3,
+                     help="fresh processes for the cold-start stages (0 to skip)")
+
+    add_compare_command(sub, "allowed slowdown, e.g. 0.10")
+
+    soak = sub.add_parser("soak", help="check threaded renders for leaks and cross-talk")
+    soak.add_argument("--renders", type=int, default=2000)
+    soak.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    soak.add_argument("--warmup", type=int, default=100, help="renders before the RSS baseline is taken")
+    soak.add_argument("--checkpoint", type=int, default=250, help="renders between RSS/figure checks")
+    soak.add_argument("--max-growth-mb", type=float, default=50.0, help="allowed RSS growth after warm-up")
+
+    args = parser.parse_args(argv)
+    if args.command == "vendor":
+        return cmd_vendor(args)
+    args.geojson = args.geojson or default_geojson()
+    if args.command == "compare":
+        return cmd_compare(args)
+    if args.command == "soak":
+        return cmd_soak(args)
+    return cmd_run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
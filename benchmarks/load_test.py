@@ -0,0 +1,380 @@
+"""
+Local load test of the Flask map service.
+
+Every concurrency level gets a fresh app process (python app.py's Flask app on
+a free localhost port) pointed at the county GeoJSON (the real copy of
+`bench_pipeline.py vendor` if present, else the committed synthetic fixture),
+a throwaway geometry/rate store and an empty render cache, so runs are
+reproducible and need no network access. Requests are replayed from a seeded mix of (year,
+race) selections:
+
+    uniform   every selection equally likely
+    zipf      a few hot selections get most of the traffic (--zipf-s skew)
+    sweep     every selection in turn; against the empty cache, a cold sweep
+
+The report has throughput, p50/p95/p99 latency, status counts, the error rate,
+the peak RSS and PSS of the app and its render workers, and the memory of each
+of those processes at the end of the level. Summed RSS counts pages that the
+processes share (the memory-mapped rate and geometry stores, libraries) once
+per process; summed PSS counts them once, so it is what the service really
+takes and what shrinks when workers share more. Results are appended to
+benchmarks/load_history.jsonl so runs can be compared across commits and
+server configurations (pass those as --env, e.g. MAP_RENDER_MODE=thread).
+
+    python benchmarks/load_test.py run --mix zipf --concurrency 1 4 16 --requests 400
+    python benchmarks/load_test.py run --mix sweep --env MAP_RENDER_WORKERS=2 --label two-workers
+    python benchmarks/load_test.py compare --baseline main
+"""
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from _history import (BENCH_DIR, REPO_DIR, add_compare_command, append_history, argument_parser,
+                      compare_runs, default_geojson, run_record)
+
+HISTORY_FILE = os.path.join(BENCH_DIR, "load_history.jsonl")
+
+MIXES = ("uniform", "zipf", "sweep")
+RACES = ("NHB", "NHW", "NHA", "HISP")
+STARTUP_TIMEOUT = 120.0
+REQUEST_TIMEOUT = 120.0
+
+
+# -------------------------------------------------------------------------
+# Request mixes
+# -------------------------------------------------------------------------
+def selections():
+    """Every (year, race) with data, in a fixed order."""
+    sys.path.insert(0, REPO_DIR)
+    from rate_cube import CSV_PATH, TOTAL_COUNT_CSV, RateCube
+    cube = RateCube(os.path.join(REPO_DIR, CSV_PATH), os.path.join(REPO_DIR, TOTAL_COUNT_CSV))
+    return [(year, race) for year in cube.years for race in RACES if cube.has(race, year)]
+
+
+def request_mix(mix, n, seed=0, zipf_s=1.1):
+    """n (year, race) selections drawn from `mix`, the same for the same seed."""
+    keys = selections()
+    rng = random.Random(seed)
+    if mix == "sweep":
+        return [keys[i % len(keys)] for i in range(n)]
+    if mix == "uniform":
+        return [rng.choice(keys) for _ in range(n)]
+    if mix == "zipf":
+        ranked = keys[:]
+        rng.shuffle(ranked)
+        weights = [1 / rank ** zipf_s for rank in range(1, len(ranked) + 1)]
+        return rng.choices(ranked, weights=weights, k=n)
+    raise ValueError(f"Unknown mix '{mix}' (use one of {', '.join(MIXES)})")
+
+
+# -------------------------------------------------------------------------
+# Server
+# -------------------------------------------------------------------------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _process_tree(pid):
+    """pid and all of its descendants (Linux /proc)."""
+    pids, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        pids.append(p)
+        try:
+            for task in os.listdir(f"/proc/{p}/task"):
+                with open(f"/proc/{p}/task/{task}/children") as f:
+                    stack.extend(int(c) for c in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _memory_kb(pid):
+    """(RSS, PSS) of a process in KiB (Linux /proc); zeros once it has exited."""
+    memory = {"Rss:": 0, "Pss:": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                field = line.split()
+                if field and field[0] in memory:
+                    memory[field[0]] = int(field[1])
+    except OSError:
+        pass
+    return memory["Rss:"], memory["Pss:"]
+
+
+class AppServer:
+    """The Flask app in its own process, with isolated stores and cache."""
+
+    def __init__(self, geojson, env=None):
+        if not os.path.exists(geojson):
+            sys.exit(f"County GeoJSON not found at {geojson}.")
+        self.workdir = tempfile.mkdtemp(prefix="load-test-")
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ)
+        self.env.update({
+            "ILLINOIS_GEOJSON_PATH": geojson,
+            "GEOMETRY_STORE_PATH": os.path.join(self.workdir, "store.npz"),
+            "RATE_STORE_PATH": os.path.join(self.workdir, "rates.arrow"),
+            "MAP_CACHE_DIR": os.path.join(self.workdir, "cache"),
+        })
+        self.env.update(env or {})
+        self.peak_rss_kb = 0
+        self.peak_pss_kb = 0
+        self._sampling = False
+
+    def __enter__(self):
+        self.log = open(os.path.join(self.workdir, "server.log"), "w+")
+        code = f"from app import app; app.run(host='127.0.0.1', port={self.port}, threaded=True)"
+        self.process = subprocess.Popen([sys.executable, "-c", code], cwd=REPO_DIR, env=self.env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                urllib.request.urlopen(f"{self.url}/metrics", timeout=5).read()
+                break
+            except (urllib.error.URLError, OSError):
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.log.seek(0)
+                    output = self.log.read()[-2000:]
+                    self.close()
+                    sys.exit(f"App did not start:\n{output}")
+                time.sleep(0.2)
+        self._sampling = True
+        self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+        self._sampler.start()
+        return self
+
+    def _sample_rss(self):
+        while self._sampling:
+            memory = [_memory_kb(p) for p in _process_tree(self.process.pid)]
+            self.peak_rss_kb = max(self.peak_rss_kb, sum(rss for rss, _ in memory))
+            self.peak_pss_kb = max(self.peak_pss_kb, sum(pss for _, pss in memory))
+            time.sleep(0.1)
+
+    def processes(self):
+        """Current RSS and PSS of the app process and of each render worker."""
+        result = []
+        for pid in _process_tree(self.process.pid):
+            rss, pss = _memory_kb(pid)
+            if rss:
+                role = "app" if pid == self.process.pid else "worker"
+                result.append({"pid": pid, "role": role, "rss_kb": rss, "pss_kb": pss})
+        return result
+
+    def close(self):
+        self._sampling = False
+        if self.process.poll() is None:
+            # Kill the workers too: they are children of the app process
+            children = _process_tree(self.process.pid)[1:]
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        self.log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -------------------------------------------------------------------------
+# Load generation
+# -------------------------------------------------------------------------
+def _fetch(url):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=REQUEST_TIMEOUT) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except OSError as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - start
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) by linear interpolation between closest ranks."""
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_level(server, endpoint, keys, concurrency, warmup=0):
+    """Replay `keys` against the server with `concurrency` client threads."""
+    urls = [f"{server.url}{endpoint}?year={year}&race={race}" for year, race in keys]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(_fetch, urls[:warmup]))
+        start = time.perf_counter()
+        results = list(pool.map(_fetch, urls[warmup:]))
+        elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [seconds for status, seconds in results if status in (200, 304)]
+    errors = len(results) - len(ok)
+    return {
+        "requests": len(results),
+        "seconds": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else None,
+        "p50_s": percentile(ok, 50),
+        "p95_s": percentile(ok, 95),
+        "p99_s": percentile(ok, 99),
+        "mean_s": statistics.fmean(ok) if ok else None,
+        "max_s": max(ok) if ok else None,
+        "statuses": statuses,
+        "error_rate": errors / len(results) if results else 0.0,
+        "peak_rss_kb": server.peak_rss_kb,
+        "peak_pss_kb": server.peak_pss_kb,
+        "processes": server.processes(),
+    }
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:9.1f}" if seconds is not None else f"{'-':>9}"
+
+
+def print_level(concurrency, level):
+    print(f"  c={concurrency:<4} {level['throughput_rps']:8.2f} req/s   p50 {_ms(level['p50_s'])} ms"
+          f"   p95 {_ms(level['p95_s'])} ms   p99 {_ms(level['p99_s'])} ms"
+          f"   errors {level['error_rate']:6.1%}   peak RSS {level['peak_rss_kb'] / 1024:7.1f} MiB"
+          f"   peak PSS {level['peak_pss_kb'] / 1024:7.1f} MiB")
+    for process in level["processes"]:
+        print(f"         {process['role']:<6} {process['pid']:>7}   RSS {process['rss_kb'] / 1024:7.1f} MiB"
+              f"   PSS {process['pss_kb'] / 1024:7.1f} MiB")
+
+
+# -------------------------------------------------------------------------
+# Comparison
+# -------------------------------------------------------------------------
+def compare(baseline, current, threshold):
+    """Print throughput and p95 per concurrency level; return the regressed levels."""
+    regressions = []
+    print(f"baseline: {baseline.get('label') or baseline.get('commit')} ({baseline['timestamp']}, {baseline['config']['mix']})")
+    print(f"current:  {current.get('label') or current.get('commit')} ({current['timestamp']}, {current['config']['mix']})")
+    print(f"{'level':<8} {'base rps':>9} {'rps':>9} {'base p95 ms':>12} {'p95 ms':>9} {'errors':>8}")
+    for level, cur in current["levels"].items():
+        base = baseline["levels"].get(level)
+        if base is None:
+            print(f"c={level:<6} {'-':>9} {cur['throughput_rps']:9.2f} {'-':>12} {_ms(cur['p95_s'])} {cur['error_rate']:8.1%}")
+            continue
+        flag = ""
+        slower = (base["throughput_rps"] and cur["throughput_rps"] < base["throughput_rps"] * (1 - threshold))
+        laggier = (base["p95_s"] and cur["p95_s"] and cur["p95_s"] > base["p95_s"] * (1 + threshold))
+        if slower or laggier or cur["error_rate"] > base["error_rate"]:
+            flag = "  REGRESSION"
+            regressions.append(level)
+        print(f"c={level:<6} {base['throughput_rps']:9.2f} {cur['throughput_rps']:9.2f} "
+              f"{_ms(base['p95_s']):>12} {_ms(cur['p95_s'])} {cur['error_rate']:8.1%}{flag}")
+    return regressions
+
+
+# -------------------------------------------------------------------------
+# Commands
+# -------------------------------------------------------------------------
+def _parse_env(pairs):
+    env = {}
+    for pair in pairs:
+        name, sep, value = pair.partition("=")
+        if not sep:
+            sys.exit(f"--env expects NAME=VALUE, got '{pair}'")
+        env[name] = value
+    return env
+
+
+def cmd_run(args):
+    env = _parse_env(args.env)
+    keys = request_mix(args.mix, args.warmup + args.requests, seed=args.seed, zipf_s=args.zipf_s)
+    print(f"Load test: {args.mix} mix, {args.requests} requests per level against {args.endpoint}"
+          + (f", env {env}" if env else ""))
+
+    levels = {}
+    for concurrency in args.concurrency:
+        with AppServer(args.geojson, env) as server:
+            levels[str(concurrency)] = run_level(server, args.endpoint, keys, concurrency, args.warmup)
+        print_level(concurrency, levels[str(concurrency)])
+
+    config = {
+        "mix": args.mix,
+        "zipf_s": args.zipf_s if args.mix == "zipf" else None,
+        "seed": args.seed,
+        "requests": args.requests,
+        "warmup": args.warmup,
+        "endpoint": args.endpoint,
+        "env": env,
+    }
+    record = run_record(args.label, args.geojson, cpus=os.cpu_count(), config=config, levels=levels)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+        print(f"Wrote {args.output}")
+    append_history(record, args.history)
+    print(f"Appended results to {args.history}")
+    return 1 if any(level["error_rate"] > args.max_error_rate for level in levels.values()) else 0
+
+
+def cmd_compare(args):
+    regressions = compare_runs(args, compare)
+    if regressions:
+        print(f"{len(regressions)} level(s) regressed by more than {args.threshold:.0%} (or with more errors)")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argument_parser("Local load test of the Flask map service.", HISTORY_FILE)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="load-test the app and append the results to the history file")
+    run.add_argument("--mix", choices=MIXES, default="uniform")
+    run.add_argument("--zipf-s", type=float, default=1.1, help="skew of the zipf mix")
+    run.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    run.add_argument("--requests", type=int, default=200, help="timed requests per concurrency level")
+    run.add_argument("--warmup", type=int, default=0, help="untimed requests before each level")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--endpoint", default="/update_map", help="e.g. /update_map or /api/data")
+    run.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                     help="server setting, e.g. MAP_RENDER_WORKERS=2 (repeatable)")
+    run.add_argument("--label", default=None, help="name for this run, e.g. a branch or configuration")
+    run.add_argument("--output", default=None, help="also write this run's results to a JSON file")
+    run.add_argument("--max-error-rate", type=float, default=0.0, help="exit 1 above this error rate")
+
+    add_compare_command(sub, "allowed throughput/p95 change")
+
+    args = parser.parse_args(argv)
+    args.geojson = args.geojson or default_geojson()
+    if args.command == "compare":
+        return cmd_compare(args)
+    return cmd_run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
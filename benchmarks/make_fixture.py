@@ -0,0 +1,83 @@
+"""
+Synthetic county GeoJSON for offline benchmarks and load tests.
+
+The real county boundaries are not part of the repository (geometry_store.py
+downloads them on the first build), so the benchmarks ship this stand-in:
+the 102 counties of county_type.csv as a 6 x 17 grid of cells over Illinois'
+longitude/latitude box. Interior edges are wavy polylines shared exactly by
+both neighbouring cells, so the file has the same structure as the real data:
+a polygon coverage that dissolves into one state outline, simplifies per level
+of detail, and carries enough vertices to make geometry stages measurable.
+The output is deterministic, so benchmark runs on different machines draw the
+same shapes.
+
+    python benchmarks/make_fixture.py        # writes benchmarks/data/synthetic-counties.geojson
+
+Timings measured on this fixture are comparable with each other, not with
+timings of the real boundaries; bench_pipeline.py and load_test.py prefer a
+vendored real copy (bench_pipeline.py vendor) when one exists and record which
+file they used.
+"""
+import csv
+import json
+import math
+import os
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FIXTURE_GEOJSON = os.path.join(BENCH_DIR, "data", "synthetic-counties.geojson")
+
+COLUMNS, ROWS = 6, 17
+WEST, SOUTH, WIDTH, HEIGHT = -91.4, 37.0, 3.8, 5.4
+EDGE_POINTS = 20
+
+
+def county_names(path=os.path.join(REPO_DIR, "county_type.csv")):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return [row["County"] for row in csv.DictReader(f) if row["County"]]
+
+
+def corner(i, j):
+    """Grid corner (i, j) in lon/lat; interior corners are jittered, the outline stays straight."""
+    x = WEST + i * WIDTH / COLUMNS + (0.05 * math.sin(i * 3.1 + j * 1.7) if 0 < i < COLUMNS else 0)
+    y = SOUTH + j * HEIGHT / ROWS + (0.03 * math.cos(i * 2.3 + j * 0.7) if 0 < j < ROWS else 0)
+    return x, y
+
+
+def edge(a, b):
+    """Interior points of the wavy edge from corner a to corner b, identical for both cells sharing it."""
+    start, end = sorted((a, b))
+    (x0, y0), (x1, y1) = corner(*start), corner(*end)
+    points = []
+    for k in range(1, EDGE_POINTS):
+        t = k / EDGE_POINTS
+        wave = 0.01 * math.sin(t * math.pi * 6 + start[0] + start[1] * 2)
+        points.append((x0 + (x1 - x0) * t + wave * (y1 - y0), y0 + (y1 - y0) * t - wave * (x1 - x0)))
+    return points if (a, b) == (start, end) else points[::-1]
+
+
+def build_fixture(names):
+    if len(names) != COLUMNS * ROWS:
+        raise ValueError(f"Expected {COLUMNS * ROWS} counties, got {len(names)}")
+    features = []
+    for n, name in enumerate(names):
+        i, j = n % COLUMNS, n // COLUMNS
+        corners = [(i, j), (i + 1, j), (i + 1, j + 1), (i, j + 1)]
+        ring = []
+        for k, a in enumerate(corners):
+            ring.append(corner(*a))
+            ring += edge(a, corners[(k + 1) % 4])
+        ring.append(ring[0])
+        features.append({
+            "type": "Feature",
+            "properties": {"name": name, "cartodb_id": n},
+            "geometry": {"type": "Polygon", "coordinates": [[[round(x, 6), round(y, 6)] for x, y in ring]]},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+if __name__ == '__main__':
+    os.makedirs(os.path.dirname(FIXTURE_GEOJSON), exist_ok=True)
+    with open(FIXTURE_GEOJSON, "w") as f:
+        json.dump(build_fixture(county_names()), f, separators=(",", ":"))
+    print(f"Synthetic county GeoJSON -> {FIXTURE_GEOJSON}")
@@ -0,0 +1,110 @@
+"""
+Point lookup: latitude/longitude -> county -> region -> rates.
+
+Points are projected to the geometry store's CRS (EPSG:26971) and matched
+against the full-resolution county polygons the maps are drawn from, through
+an STRtree built once per geometry store and region scheme. A batch of points
+is one vectorized projection and one tree query, so thousands of points
+resolve in milliseconds instead of a point-in-polygon test against every
+county per point.
+
+    locator = get_county_locator()
+    counties = locator.locate([41.88, 40.12], [-87.63, -88.24])   # county rows, -1 outside
+    payload = locator.lookup([41.88], [-87.63], years=[2020], races=["NHB"])
+
+A point on a border shared by two counties resolves to the first of them in
+the store's county order; a point outside Illinois has no county or region.
+"""
+import threading
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+from geometry_store import get_geometry_store
+from rate_cube import get_rate_cube, race_key
+from regions import load_region_scheme
+
+LONLAT_CRS = "EPSG:4326"
+
+
+class CountyLocator:
+    """STRtree over the county polygons plus each county's region and urban/rural class."""
+
+    def __init__(self, geo, scheme):
+        self.geo = geo
+        self.fingerprint = scheme.fingerprint
+        counties = geo.counties
+        self.names = list(counties["name"])
+        self.urban_rural = list(counties["Urban_Rural"])
+        regions = scheme.region_keys()
+        self.regions = [regions.get(name) for name in self.names]
+        self.tree = shapely.STRtree(counties.geometry.values)
+        self.transformer = Transformer.from_crs(LONLAT_CRS, counties.crs, always_xy=True)
+
+    def locate(self, lat, lon):
+        """Row of the county containing each point (in self.names order), -1 where there is none."""
+        x, y = self.transformer.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+        points = shapely.points(np.atleast_1d(x), np.atleast_1d(y))
+        point_idx, county_idx = self.tree.query(points, predicate="intersects")
+        # Lowest county row per point; len(names) marks "no county"
+        rows = np.full(len(points), len(self.names), dtype=np.intp)
+        np.minimum.at(rows, point_idx, county_idx)
+        rows[rows == len(self.names)] = -1
+        return rows
+
+    def lookup(self, lat, lon, years=None, races=None, cube=None):
+        """JSON-ready county, urban/rural class and region of each point, plus the rates of those regions.
+
+        years default to the latest year of the data, races to every race.
+        Rates are given once per region: {region: {race: {year: rate}}},
+        null where the data has no value. Raises KeyError for an unknown
+        year or race.
+        """
+        cube = cube or get_rate_cube()
+        years = [int(y) for y in years] if years else [cube.years[-1]]
+        races = [race_key(r) for r in races] if races else list(cube.races)
+        y_idx = [cube.year_index[y] for y in years]
+        r_idx = [cube.race_index[r] for r in races]
+
+        lat, lon = np.atleast_1d(lat), np.atleast_1d(lon)
+        rows = self.locate(lat, lon)
+        locations = []
+        for point_lat, point_lon, row in zip(lat.tolist(), lon.tolist(), rows.tolist()):
+            found = row >= 0
+            locations.append({
+                "lat": point_lat,
+                "lon": point_lon,
+                "county": self.names[row] if found else None,
+                "urban_rural": self.urban_rural[row] if found else None,
+                "region": self.regions[row] if found else None,
+            })
+
+        rates = {}
+        for region in sorted({self.regions[row] for row in set(rows.tolist()) if row >= 0} - {None}):
+            g = cube.region_index.get(region)
+            if g is None:
+                continue
+            block = cube.rates[np.ix_(r_idx, [g], y_idx)][:, 0, :]
+            rates[region] = {
+                race: {str(year): None if np.isnan(v) else float(v) for year, v in zip(years, values)}
+                for race, values in zip(races, block)
+            }
+        return {"years": years, "races": races, "locations": locations, "rates": rates}
+
+
+_LOCATOR = None
+_LOCATOR_LOCK = threading.Lock()
+
+
+def get_county_locator():
+    """Locator of the current geometry store and region scheme, rebuilt when the scheme changes."""
+    global _LOCATOR
+    geo, scheme = get_geometry_store(), load_region_scheme()
+    locator = _LOCATOR
+    if locator is None or locator.geo is not geo or locator.fingerprint != scheme.fingerprint:
+        with _LOCATOR_LOCK:
+            locator = _LOCATOR
+            if locator is None or locator.geo is not geo or locator.fingerprint != scheme.fingerprint:
+                locator = _LOCATOR = CountyLocator(geo, scheme)
+    return locator
@@ -1,5 +1,11 @@
+import threading
+
 import streamlit as st 
-from v9_main_map import plot_illinois_map
+from geometry_store import get_geometry_store
+import map_render
+from map_prefetch import PrefetchCache, adjacent_selections
+from rate_cube import get_rate_cube
+from render_metrics import collect_spans
 
 # Set up the page configuration (using a wide layout)
 st.set_page_config(
@@ -57,6 +63,103 @@ st.markdown(
     unsafe_allow_html=True
 )
 
+# -------------------------------------------------------------------------
+# Caches shared by every session of this server process
+# -------------------------------------------------------------------------
+# Width (px) of the main container set in the CSS above; images are drawn at
+# the smallest master resolution at least PIXEL_RATIO times as wide (2048 px
+# for 2x), sharp on high-DPI screens and never resampled
+MAP_WIDTH = 1000
+PIXEL_RATIO = 2
+# Rendered maps kept in memory (8 years x 4 races x a couple of widths)
+MAX_CACHED_MAPS = 64
+RACES = ["NHB", "NHW", "NHA", "HISP"]
+
+
+@st.cache_resource
+def _cache_stats():
+    return {"lock": threading.Lock(), "calls": {}, "misses": {}}
+
+
+def _record(name, miss=False):
+    stats = _cache_stats()
+    with stats["lock"]:
+        counter = stats["misses"] if miss else stats["calls"]
+        counter[name] = counter.get(name, 0) + 1
+
+
+@st.cache_resource
+def load_geometry():
+    _record("geometry", miss=True)
+    return get_geometry_store()
+
+
+def _render(year, race, width, data_version):
+    # Also runs on the prefetch thread, so no Streamlit calls in here
+    return map_render.render_map(year, race, "png", dpi=map_render.master_dpi(PIXEL_RATIO * width))
+
+
+@st.cache_resource
+def map_cache():
+    """Rendered maps shared by every session, filled on demand and by background prefetch."""
+    return PrefetchCache(_render, MAX_CACHED_MAPS)
+
+
+def cached_map(year, race, width=MAP_WIDTH):
+    _record("geometry")
+    load_geometry()
+    cache = map_cache()
+    # The cube reloads itself when a CSV changes; its version keys the image cache
+    cube = get_rate_cube()
+    with st.spinner("Rendering map..."), collect_spans() as spans:
+        image, source = cache.get((year, race, width, cube.version))
+    if source == "render":
+        # Kept for the debug panel; cache hits leave the previous render's timings
+        st.session_state["last_render"] = {"selection": f"{race} {year}, {width}px", "spans": spans}
+    # Render the likely next selections while this one is on screen
+    cache.prefetch([(y, r, width, cube.version) for y, r in adjacent_selections(cube, year, race, RACES)])
+    return image
+
+
+def _stats_row(name, requests, hits):
+    return {
+        "cache": name,
+        "requests": requests,
+        "hits": hits,
+        "misses": requests - hits,
+        "hit rate": f"{hits / requests:.0%}" if requests else "-",
+    }
+
+
+def show_cache_stats():
+    stats = _cache_stats()
+    with stats["lock"]:
+        calls, misses = dict(stats["calls"]), dict(stats["misses"])
+    maps = map_cache().stats()
+    n_calls = calls.get("geometry", 0)
+    rows = [
+        _stats_row("maps", maps["requests"], maps["hits"]),
+        # "requests" of the prefetcher are maps it rendered, "hits" those later viewed
+        _stats_row("prefetch", maps["prefetch_rendered"], maps["prefetch_hits"]),
+        _stats_row("geometry", n_calls, n_calls - min(misses.get("geometry", 0), n_calls)),
+    ]
+    with st.expander("Cache statistics"):
+        st.table(rows)
+        st.caption(f"Prefetch: {maps['prefetch_queued']} queued, {maps['prefetch_cancelled']} cancelled "
+                   f"by a newer selection, {maps['prefetch_evicted']} evicted unused.")
+
+
+def show_render_timings():
+    """Debug panel (open the app with ?debug=1): stage timings of this session's last render."""
+    last = st.session_state.get("last_render")
+    with st.expander("Render timings", expanded=True):
+        if last is None:
+            st.caption("No map rendered by this session yet; every map so far came from the cache.")
+            return
+        st.caption(f"Last render: {last['selection']}")
+        st.table([{"stage": name, "ms": f"{seconds * 1000:.1f}"} for name, seconds in last["spans"]])
+
+
 # Group dropdowns and map in one container for a tighter layout
 with st.container():
     # Title and subtitle at the top
@@ -67,16 +170,17 @@ with st.container():
     col1, col2 = st.columns(2)
     
     with col1:
+        # Years come from the data, so a new year shows up on its own
         year = st.selectbox(
             "📅 Select Year",
-            options=[2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023],
+            options=get_rate_cube().years,
             key="selected_year"
         )
     
     with col2:
         race = st.selectbox(
             "🎨 Select Race",
-            options=["NHB", "NHW", "NHA", "HISP"],
+            options=RACES,
             format_func=lambda x: {
                 "NHB": "Non-Hispanic Black",
                 "NHW": "Non-Hispanic White",
@@ -88,10 +192,14 @@ with st.container():
     
     # Display the map visualization immediately below the dropdowns
     try:
-        plot_illinois_map()
+        st.image(cached_map(year, race), width="stretch")
     except Exception as e:
         st.error(f"Error generating map: {str(e)}")
 
+    show_cache_stats()
+    if st.query_params.get("debug"):
+        show_render_timings()
+
 # Footer (outside the container)
 st.markdown(
     '<div class="footer">Developed by hoclz | Powered by Streamlit 🚀</div>',
@@ -0,0 +1,152 @@
+"""
+Derived metrics for every race x region x year, computed from the rate cube.
+
+    yoy_change          rate minus the previous year's rate
+    yoy_pct             yoy_change as a fraction of the previous year's rate
+    rank                1 = highest rate among the regions (statewide excluded)
+    disparity_vs_nhw    rate divided by the NHW rate of the same region and year
+    statewide_deviation rate minus the statewide rate of the same race and year
+
+All metrics are whole-array NumPy operations on RateCube.rates and are
+memoized per data version, so get_derived_metrics() is a dict lookup until a
+CSV changes. Missing inputs and ratios over a zero rate give NaN (null in
+JSON, empty in CSV), never an infinity that JSON cannot carry.
+
+    python derived_metrics.py --csv static/metrics.csv --parquet static/metrics.parquet
+"""
+import csv
+import io
+import threading
+
+import numpy as np
+
+from rate_cube import STATEWIDE, get_rate_cube, race_key, region_key
+
+REFERENCE_RACE = "NHW"
+METRICS = ("rate", "yoy_change", "yoy_pct", "rank", "disparity_vs_nhw", "statewide_deviation")
+
+
+class DerivedMetrics:
+    """Arrays shaped like RateCube.rates, one per entry of METRICS."""
+
+    def __init__(self, cube):
+        self.cube = cube
+        self.version = cube.version
+        rates = cube.rates
+
+        # Zero rates are not divided by: those ratios are NaN, not +-inf
+        divisors = np.where(rates == 0, np.nan, rates)
+        with np.errstate(invalid="ignore"):
+            yoy = np.full_like(rates, np.nan)
+            yoy[..., 1:] = rates[..., 1:] - rates[..., :-1]
+            yoy_pct = np.full_like(rates, np.nan)
+            yoy_pct[..., 1:] = yoy[..., 1:] / divisors[..., :-1]
+
+            ref = cube.race_index.get(REFERENCE_RACE)
+            disparity = rates / divisors[ref] if ref is not None else np.full_like(rates, np.nan)
+
+            statewide = cube.region_index.get(STATEWIDE)
+            deviation = (rates - rates[:, statewide:statewide + 1, :] if statewide is not None
+                         else np.full_like(rates, np.nan))
+
+        # Rank among the real regions: 1 + number of regions with a higher rate (ties share a rank)
+        regional = np.ones(len(cube.regions), dtype=bool)
+        if statewide is not None:
+            regional[statewide] = False
+        sub = rates[:, regional, :]
+        higher = (sub[:, None, :, :] > sub[:, :, None, :]).sum(axis=2)
+        rank = np.full_like(rates, np.nan)
+        rank[:, regional, :] = np.where(np.isnan(sub), np.nan, higher + 1)
+
+        self.arrays = {
+            "rate": rates,
+            "yoy_change": yoy,
+            "yoy_pct": yoy_pct,
+            "rank": rank,
+            "disparity_vs_nhw": disparity,
+            "statewide_deviation": deviation,
+        }
+        for array in self.arrays.values():
+            array.setflags(write=False)
+
+    # ---------------------------------------------------------------------
+    # Queries
+    # ---------------------------------------------------------------------
+    def records(self, race=None, region=None, year=None):
+        """Long-format rows (one per race, region, year), optionally filtered."""
+        cube = self.cube
+        races = range(len(cube.races)) if race is None else [cube.race_index[race_key(race)]]
+        regions = range(len(cube.regions)) if region is None else [cube.region_index[region_key(region)]]
+        years = range(len(cube.years)) if year is None else [cube.year_index[int(year)]]
+
+        rows = []
+        for r in races:
+            for g in regions:
+                for y in years:
+                    row = {"race": cube.races[r], "region": cube.regions[g], "year": cube.years[y]}
+                    for name in METRICS:
+                        value = self.arrays[name][r, g, y]
+                        if not np.isfinite(value):
+                            row[name] = None
+                        else:
+                            row[name] = int(value) if name == "rank" else float(value)
+                    rows.append(row)
+        return rows
+
+    # ---------------------------------------------------------------------
+    # Export
+    # ---------------------------------------------------------------------
+    def to_csv(self, **filters):
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=["race", "region", "year", *METRICS], lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(self.records(**filters))
+        return buf.getvalue().encode()
+
+    def to_parquet(self, **filters):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from e
+        buf = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist(self.records(**filters)), buf)
+        return buf.getvalue()
+
+
+_METRICS = None
+_METRICS_LOCK = threading.Lock()
+
+
+def get_derived_metrics():
+    """Metrics of the current rate cube, recomputed only when the data version changes."""
+    global _METRICS
+    cube = get_rate_cube()
+    metrics = _METRICS
+    if metrics is None or metrics.cube is not cube:
+        with _METRICS_LOCK:
+            metrics = _METRICS
+            if metrics is None or metrics.cube is not cube:
+                metrics = _METRICS = DerivedMetrics(cube)
+    return metrics
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from render_cache import atomic_write
+
+    parser = argparse.ArgumentParser(description="Export derived asthma rate metrics.")
+    parser.add_argument("--csv", metavar="PATH", help="write all metrics as CSV")
+    parser.add_argument("--parquet", metavar="PATH", help="write all metrics as Parquet")
+    args = parser.parse_args()
+    if not (args.csv or args.parquet):
+        parser.error("pass --csv and/or --parquet")
+
+    metrics = get_derived_metrics()
+    if args.csv:
+        atomic_write(args.csv, metrics.to_csv())
+        print(f"Saved {args.csv}")
+    if args.parquet:
+        atomic_write(args.parquet, metrics.to_parquet())
+        print(f"Saved {args.parquet}")
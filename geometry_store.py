@@ -0,0 +1,424 @@
+"""
+Local, pre-projected county geometry store for the Illinois map.
+
+The counties GeoJSON is read and reprojected to EPSG:26971 once, joined with
+county_type.csv, and written to a compact .npz file together with the shapes
+that never change between renders (dissolved state boundary, 5 km halo and
+county centroids). Renders load that file lazily, once per process, instead of
+downloading and reprojecting the GeoJSON every time.
+
+The store also holds simplified levels of detail (LOD_TOLERANCES). Counties are
+simplified as a coverage, so neighbouring counties keep sharing the exact same
+border; the state outline is the union of the simplified counties. Renderers
+call GeometryStore.for_resolution() with their map scale and get the coarsest
+level whose error stays below LOD_PIXEL_ERROR of a pixel.
+
+The .npz is written uncompressed, with every array aligned to 64 bytes, and
+loaded as read-only views of one memory map of the file: the flat coordinate
+and offset arrays are read from the page cache that every render worker on the
+machine shares, not copied into each process. Shapely geometries (which GEOS
+keeps in its own memory) are built from those views per level of detail on
+first use, so a worker only holds the levels it actually draws with. The file
+is still a regular .npz for numpy.load().
+
+GeoPandas is imported on first use of the geometry, so a process that only
+reads the store's meta (read_store_meta(), ensure_store() on an up-to-date
+store) never loads it.
+
+Build or refresh the store from the command line:
+
+    python geometry_store.py            # build if missing or stale
+    python geometry_store.py --rebuild  # force a rebuild
+"""
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import urllib.request
+import zipfile
+
+import numpy as np
+import shapely
+
+# -------------------------------------------------------------------------
+# PARAMETERS
+# -------------------------------------------------------------------------
+ILLINOIS_GEOJSON_URL = "https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/illinois-counties.geojson"
+# Local copy of the GeoJSON; downloaded from the URL above on the first build
+ILLINOIS_GEOJSON_PATH = os.environ.get("ILLINOIS_GEOJSON_PATH", "static/geo/illinois-counties.geojson")
+COUNTY_TYPE_CSV = "county_type.csv"
+GEOMETRY_STORE_PATH = os.environ.get("GEOMETRY_STORE_PATH", "static/geo/illinois_counties_26971.npz")
+
+TARGET_EPSG = 26971
+HALO_BUFFER = 5000
+# Simplification tolerances (metres) of the stored levels of detail; level 0 is the source
+LOD_TOLERANCES = (0, 100, 250, 500, 1000, 2500, 5000)
+# Largest simplification error allowed, as a fraction of an output pixel
+LOD_PIXEL_ERROR = 0.5
+# Bump whenever the layout of the .npz file changes
+STORE_VERSION = 3
+# Alignment of the array data inside the .npz (as numpy aligns it inside a .npy)
+ARRAY_ALIGN = 64
+# Zip extra-field ID of the padding that aligns a member's data
+_PADDING_EXTRA_ID = 0x5041
+
+
+class GeometryStore:
+    """Read-only county geometry, already projected to EPSG:26971.
+
+    counties        GeoDataFrame with name, Urban_Rural, cx, cy and geometry
+    state_boundary  single-row GeoDataFrame of the dissolved state
+    halo            shapely geometry of the state buffered by HALO_BUFFER
+    tolerance       simplification tolerance (m) of this level of detail
+
+    The store returned by load_store() is the full-resolution level; its
+    simplified siblings are reached through level() and for_resolution().
+    `arrays` are the (memory-mapped) arrays of the store file; each of the
+    three geometries above is built from them on first access.
+    """
+
+    def __init__(self, arrays, meta, index=0, levels=None):
+        self.arrays = arrays
+        self.meta = meta
+        self.index = index
+        self.tolerance = meta.get("lod_tolerances", [0])[index]
+        self.levels = levels if levels is not None else [self]
+        self._regions = {}
+        self._geometries = {}
+        self._lock = threading.Lock()
+
+    def _geometry(self, name):
+        geometry = self._geometries.get(name)
+        if geometry is None:
+            with self._lock:
+                geometry = self._geometries.get(name)
+                if geometry is None:
+                    geometry = self._geometries[name] = self._build_geometry(name)
+        return geometry
+
+    def _build_geometry(self, name):
+        import geopandas as gpd
+        import pandas as pd
+
+        crs = f"EPSG:{self.meta['epsg']}"
+        geoms = _unpack_geometries(name + (f"_lod{self.index}" if self.index else ""), self.arrays)
+        if name == "halo":
+            return geoms[0]
+        if name == "state":
+            return gpd.GeoDataFrame(geometry=geoms, crs=crs)
+        urban_rural = pd.Series(self.arrays["urban_rural"], dtype=object).replace({"": None})
+        attributes = pd.DataFrame({
+            "name": self.arrays["names"],
+            "Urban_Rural": urban_rural,
+            "cx": self.arrays["cx"],
+            "cy": self.arrays["cy"],
+        })
+        return gpd.GeoDataFrame(attributes, geometry=geoms, crs=crs)
+
+    @property
+    def counties(self):
+        return self._geometry("county")
+
+    @property
+    def state_boundary(self):
+        return self._geometry("state")
+
+    @property
+    def halo(self):
+        return self._geometry("halo")
+
+    @property
+    def centroids(self):
+        return np.column_stack([self.arrays["cx"], self.arrays["cy"]])
+
+    def level(self, index):
+        return self.levels[index]
+
+    def county_regions(self, scheme):
+        """Region of every county row under a regions.RegionScheme (None if unassigned)."""
+        key = ("index", scheme.fingerprint)
+        index = self._regions.get(key)
+        if index is None:
+            index = self._regions[key] = np.array(
+                [scheme.county_index.get(name) for name in self.counties["name"]], dtype=object)
+        return index
+
+    def regions(self, scheme):
+        """Dissolved region polygons (region, color, geometry) of a scheme, built once per level."""
+        key = ("polygons", scheme.fingerprint)
+        dissolved = self._regions.get(key)
+        if dissolved is None:
+            import geopandas as gpd
+
+            index = self.county_regions(scheme)
+            geoms = self.counties.geometry.values
+            names = [name for name in scheme.names if (index == name).any()]
+            dissolved = self._regions[key] = gpd.GeoDataFrame(
+                {"region": names, "color": [scheme.colors[name] for name in names]},
+                geometry=[shapely.coverage_union_all(geoms[index == name]) for name in names],
+                crs=self.counties.crs,
+            )
+        return dissolved
+
+    def for_resolution(self, metres_per_pixel):
+        """Coarsest level of detail that is indistinguishable at this map scale."""
+        max_error = metres_per_pixel * LOD_PIXEL_ERROR
+        best = self.levels[0]
+        for level in self.levels[1:]:
+            if level.tolerance <= max_error:
+                best = level
+        return best
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+# -------------------------------------------------------------------------
+# SOURCE FINGERPRINT
+# -------------------------------------------------------------------------
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_fingerprint(geojson_path=None, county_type_csv=COUNTY_TYPE_CSV):
+    """Hashes of the inputs the store is built from (None if a file is absent)."""
+    geojson_path = geojson_path or ILLINOIS_GEOJSON_PATH
+    return {
+        "version": STORE_VERSION,
+        "epsg": TARGET_EPSG,
+        "halo_buffer": HALO_BUFFER,
+        "lod_tolerances": list(LOD_TOLERANCES),
+        "geojson_sha256": _file_sha256(geojson_path) if os.path.exists(geojson_path) else None,
+        "county_type_sha256": _file_sha256(county_type_csv) if os.path.exists(county_type_csv) else None,
+    }
+
+
+def _is_stale(meta, current):
+    """A store is stale when any input that is still present no longer matches."""
+    for key, value in current.items():
+        if value is None:
+            # Source not available locally (e.g. offline deployment): trust the store
+            continue
+        if meta.get(key) != value:
+            return True
+    return False
+
+
+# -------------------------------------------------------------------------
+# PACKING HELPERS
+# -------------------------------------------------------------------------
+def _pack_geometries(prefix, geoms, arrays):
+    geom_type, coords, offsets = shapely.to_ragged_array(np.asarray(geoms, dtype=object))
+    arrays[f"{prefix}_type"] = np.array(int(geom_type))
+    arrays[f"{prefix}_coords"] = coords
+    for i, off in enumerate(offsets):
+        arrays[f"{prefix}_offsets{i}"] = off
+
+
+def _unpack_geometries(prefix, data):
+    geom_type = shapely.GeometryType(int(data[f"{prefix}_type"]))
+    offsets = []
+    i = 0
+    while f"{prefix}_offsets{i}" in data:
+        offsets.append(data[f"{prefix}_offsets{i}"])
+        i += 1
+    return shapely.from_ragged_array(geom_type, data[f"{prefix}_coords"], tuple(offsets))
+
+
+# -------------------------------------------------------------------------
+# BUILD & LOAD
+# -------------------------------------------------------------------------
+def _fetch_geojson(path):
+    """Download the GeoJSON once and keep a local copy next to the store."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with urllib.request.urlopen(ILLINOIS_GEOJSON_URL, timeout=30) as resp:
+        payload = resp.read()
+    with open(path, "wb") as f:
+        f.write(payload)
+
+
+def _write_aligned_npz(f, arrays):
+    """np.savez() without compression, padding each member so its array data is ARRAY_ALIGN-aligned."""
+    with zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as archive:
+        for name, array in arrays.items():
+            info = zipfile.ZipInfo(f"{name}.npy")
+            # Local file header: 30 bytes, the file name, then the extra field
+            data_start = f.tell() + 30 + len(info.filename.encode()) + 4
+            padding = -data_start % ARRAY_ALIGN
+            info.extra = struct.pack("<HH", _PADDING_EXTRA_ID, padding) + bytes(padding)
+            with archive.open(info, "w") as member:
+                np.lib.format.write_array(member, np.asanyarray(array), allow_pickle=False)
+
+
+def _map_npz(path):
+    """Arrays of an uncompressed .npz as read-only views of one memory map of the file."""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path}: {info.filename} is compressed and cannot be memory-mapped")
+            offset = info.header_offset
+            name_len, extra_len = struct.unpack("<HH", mapped[offset + 26:offset + 30])
+            offset += 30 + name_len + extra_len
+            # .npy header: magic, version, header length (2 bytes in v1.0, 4 after), then the dict
+            version = (mapped[offset + 6], mapped[offset + 7])
+            length_size = 2 if version == (1, 0) else 4
+            header_len = int.from_bytes(mapped[offset + 8:offset + 8 + length_size], "little")
+            header = io.BytesIO(mapped[offset:offset + 8 + length_size + header_len])
+            np.lib.format.read_magic(header)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+            count = int(np.prod(shape, dtype=np.int64))
+            array = np.frombuffer(mapped, dtype=dtype, count=count, offset=offset + header.tell())
+            arrays[info.filename[:-len(".npy")]] = array.reshape(shape, order="F" if fortran_order else "C")
+    return arrays
+
+
+def _atomic_savez(path, arrays):
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".npz.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            _write_aligned_npz(f, arrays)
+        # Processes that still map the old file keep reading it until they reload
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def build_store(store_path=None, geojson_path=None):
+    """Read, reproject and derive all geometry, then write the .npz store."""
+    import geopandas as gpd
+    import pandas as pd
+    from shapely.ops import unary_union
+
+    store_path = store_path or GEOMETRY_STORE_PATH
+    geojson_path = geojson_path or ILLINOIS_GEOJSON_PATH
+    if not os.path.exists(geojson_path):
+        _fetch_geojson(geojson_path)
+
+    illinois = gpd.read_file(geojson_path).to_crs(epsg=TARGET_EPSG)
+    state_geom = illinois.dissolve().geometry.iloc[0]
+    halo = unary_union(illinois.geometry).buffer(HALO_BUFFER)
+
+    df_county_type = pd.read_csv(COUNTY_TYPE_CSV)
+    illinois = illinois.merge(df_county_type, left_on="name", right_on="County", how="left")
+    centroids = illinois.geometry.centroid
+
+    meta = source_fingerprint(geojson_path)
+    arrays = {
+        "meta": np.array(json.dumps(meta)),
+        "names": illinois["name"].to_numpy(dtype=str),
+        "urban_rural": illinois["Urban_Rural"].fillna("").to_numpy(dtype=str),
+        "cx": centroids.x.to_numpy(),
+        "cy": centroids.y.to_numpy(),
+    }
+    _pack_geometries("county", illinois.geometry.values, arrays)
+    _pack_geometries("state", [state_geom], arrays)
+    _pack_geometries("halo", [halo], arrays)
+
+    # Levels of detail; shared borders are simplified once for both neighbours
+    for i, tolerance in enumerate(LOD_TOLERANCES[1:], 1):
+        simplified = shapely.coverage_simplify(illinois.geometry.values, tolerance)
+        _pack_geometries(f"county_lod{i}", simplified, arrays)
+        _pack_geometries(f"state_lod{i}", [shapely.coverage_union_all(simplified)], arrays)
+        _pack_geometries(f"halo_lod{i}", [shapely.simplify(halo, tolerance, preserve_topology=True)], arrays)
+
+    _atomic_savez(store_path, arrays)
+    return meta
+
+
+def _read_store(store_path):
+    data = _map_npz(store_path)
+    meta = json.loads(str(data["meta"]))
+    levels = []
+    for i in range(len(meta.get("lod_tolerances", [0]))):
+        levels.append(GeometryStore(data, meta, i, levels))
+    return levels[0]
+
+
+def read_store_meta(store_path=None):
+    """Source fingerprint a store file was built from, or None if it is missing or unreadable.
+
+    Reads only the small meta member, not the geometry.
+    """
+    try:
+        with np.load(store_path or GEOMETRY_STORE_PATH) as data:
+            return json.loads(str(data["meta"]))
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def ensure_store(store_path=None, geojson_path=None):
+    """Build the store if it is missing or stale, without loading it; returns its meta.
+
+    Lets a process that only needs the store file settled (e.g. to hash it
+    into cache keys) do so before a renderer loads it.
+    """
+    meta = read_store_meta(store_path)
+    if (meta is None or meta.get("version") != STORE_VERSION
+            or _is_stale(meta, source_fingerprint(geojson_path))):
+        meta = build_store(store_path, geojson_path)
+    return meta
+
+
+def load_store(store_path=None, geojson_path=None, rebuild=False):
+    """Load the store from disk, (re)building it first when missing or stale."""
+    store_path = store_path or GEOMETRY_STORE_PATH
+    needs_build = rebuild or not os.path.exists(store_path)
+    if not needs_build:
+        try:
+            store = _read_store(store_path)
+        except (ValueError, KeyError, zipfile.BadZipFile):
+            # Written by an older version (compressed) or truncated
+            store = None
+        if (store is None or store.meta.get("version") != STORE_VERSION
+                or _is_stale(store.meta, source_fingerprint(geojson_path))):
+            needs_build = True
+        else:
+            return store
+    build_store(store_path, geojson_path)
+    return _read_store(store_path)
+
+
+def get_geometry_store():
+    """Process-wide store, loaded lazily on first use."""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = load_store()
+    return _STORE
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the pre-projected county geometry store.")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild even if the store is up to date")
+    parser.add_argument("--source", default=None, help="path of the counties GeoJSON")
+    parser.add_argument("--output", default=None, help="path of the .npz store")
+    args = parser.parse_args()
+
+    store = load_store(args.output, args.source, rebuild=args.rebuild)
+    print(f"Geometry store: {len(store.counties)} counties, EPSG:{store.meta['epsg']} "
+          f"-> {args.output or GEOMETRY_STORE_PATH}")
+    for level in store.levels:
+        vertices = shapely.get_num_coordinates(level.counties.geometry.values).sum()
+        print(f"  LOD {level.tolerance:>5} m: {vertices:>7} county vertices")
@@ -0,0 +1,76 @@
+"""
+Fast encoders for rendered map pixels.
+
+Matplotlib's PNG writer stores every map as 24-bit truecolor at a fixed
+compression level. The maps are flat region colors, text and a few
+anti-aliased edges, so a 256-color palette (fast octree quantization, a few
+milliseconds) is visually identical and compresses to under a third of the
+size. encode_image() takes the RGBA pixels of v9_main_map.render_map_rgba(),
+optionally downscales them to the requested width (never up) and encodes them
+with Pillow:
+
+    png    palette-quantized (MAP_PNG_COLORS colors, 0 keeps truecolor),
+           zlib level MAP_PNG_COMPRESS_LEVEL
+    webp   lossy at MAP_WEBP_QUALITY (100 = lossless), encoder effort MAP_WEBP_METHOD
+
+encoder_settings() returns the settings that shape the bytes of a format, so
+callers can put them in cache keys.
+
+Configuration (environment variables):
+    MAP_PNG_COLORS           palette size of PNG output (default: 256; 0 = truecolor)
+    MAP_PNG_COMPRESS_LEVEL   zlib level 0-9 of PNG output (default: 6)
+    MAP_WEBP_QUALITY         WebP quality 1-100 (default: 85; 100 = lossless)
+    MAP_WEBP_METHOD          WebP effort 0 (fastest) - 6 (smallest) (default: 4)
+"""
+import io
+import os
+
+ENCODED_FORMATS = ("png", "webp")
+
+PNG_COLORS = int(os.environ.get("MAP_PNG_COLORS", 256))
+PNG_COMPRESS_LEVEL = int(os.environ.get("MAP_PNG_COMPRESS_LEVEL", 6))
+WEBP_QUALITY = int(os.environ.get("MAP_WEBP_QUALITY", 85))
+WEBP_METHOD = int(os.environ.get("MAP_WEBP_METHOD", 4))
+
+
+def encoder_settings(fmt):
+    """Settings that determine the encoded bytes of `fmt` ({} for formats not encoded here)."""
+    if fmt == "png":
+        return {"colors": PNG_COLORS, "compress_level": PNG_COMPRESS_LEVEL}
+    if fmt == "webp":
+        return {"quality": WEBP_QUALITY, "method": WEBP_METHOD}
+    return {}
+
+
+def scaled_size(size, width):
+    """(width, height) of an image of `size` scaled to `width`, keeping the aspect ratio."""
+    w, h = size
+    return width, max(1, round(h * width / w))
+
+
+def encode_image(pixels, fmt="png", width=None):
+    """Encode an (height, width, 4) uint8 RGBA array as PNG or WebP bytes.
+
+    With `width` the image is first downscaled (Lanczos) to that many pixels
+    wide; a width at or above the image's own keeps it as it is.
+    """
+    from PIL import Image
+
+    if fmt not in ENCODED_FORMATS:
+        raise ValueError(f"Unsupported image format '{fmt}' (use one of {', '.join(ENCODED_FORMATS)})")
+    # The maps are drawn on an opaque white figure: the alpha channel carries nothing
+    image = Image.fromarray(pixels, "RGBA").convert("RGB")
+    if width and int(width) < image.width:
+        image = image.resize(scaled_size(image.size, int(width)), Image.Resampling.LANCZOS)
+
+    buf = io.BytesIO()
+    if fmt == "png":
+        if PNG_COLORS:
+            image = image.quantize(PNG_COLORS, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+        image.save(buf, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+    else:
+        if WEBP_QUALITY >= 100:
+            image.save(buf, "WEBP", lossless=True, method=WEBP_METHOD)
+        else:
+            image.save(buf, "WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD)
+    return buf.getvalue()
@@ -0,0 +1,166 @@
+"""
+Bounded map cache with speculative background prefetch.
+
+Dashboard users mostly step to the neighbouring year or switch race while
+keeping the year. Once a map is on screen, prefetch() queues exactly those
+selections (adjacent_selections()), and one low-priority background thread
+renders them into the same bounded LRU cache that foreground requests read,
+so the next click is usually a cache hit.
+
+A real request always wins: get() drops the prefetches still queued for the
+previous selection, and the background thread does not start another render
+while a foreground render is running. A prefetch that is already rendering
+the requested map is waited for rather than rendered twice.
+
+stats() reports foreground hits and misses and how many prefetched maps were
+actually requested (the prefetch hit rate). Renders go through map_render,
+which is safe to call from several threads.
+"""
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+DEFAULT_MAX_ENTRIES = 64
+
+
+def adjacent_selections(cube, year, race, races):
+    """Likely next (year, race) selections: the neighbouring years, then the other races."""
+    years = cube.years
+    i = years.index(year)
+    candidates = [(y, race) for y in years[i + 1:i + 2] + years[max(i - 1, 0):i]]
+    candidates += [(year, r) for r in races if r != race]
+    return [(y, r) for y, r in candidates if cube.has(r, y)]
+
+
+class PrefetchCache:
+    """LRU cache of rendered maps, filled on demand and by a background prefetch thread.
+
+    `render(*key)` produces the image of a key; keys are any hashable tuples,
+    e.g. (year, race, width, data_version).
+    """
+
+    def __init__(self, render, max_entries=DEFAULT_MAX_ENTRIES):
+        self._render = render
+        self.max_entries = max(1, int(max_entries))
+        self._images = OrderedDict()
+        self._unused = set()          # prefetched, not requested yet
+        self._queue = deque()
+        self._inflight = {}           # key -> Future of a running prefetch
+        self._foreground = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = dict.fromkeys(
+            ("requests", "hits", "misses", "prefetch_hits",
+             "prefetch_queued", "prefetch_rendered", "prefetch_cancelled", "prefetch_evicted", "prefetch_failed"), 0)
+
+    # ---------------------------------------------------------------------
+    # Foreground
+    # ---------------------------------------------------------------------
+    def get(self, key):
+        """Return (image, source), source being "cache", "prefetch" or "render".
+
+        Misses are rendered in the calling thread.
+        """
+        with self._cond:
+            self._stats["requests"] += 1
+            # The user has moved on: guesses queued for the previous selection are stale
+            self._cancel_queued()
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key], self._hit(key)
+            future = self._inflight.get(key)
+            if future is None:
+                self._stats["misses"] += 1
+                self._foreground += 1
+        if future is not None:
+            image = future.result()
+            with self._cond:
+                self._hit(key)
+            return image, "prefetch"
+
+        try:
+            image = self._render(*key)
+        finally:
+            with self._cond:
+                self._foreground -= 1
+                self._cond.notify_all()
+        self._store(key, image)
+        return image, "render"
+
+    def _hit(self, key):
+        self._stats["hits"] += 1
+        if key in self._unused:
+            self._unused.discard(key)
+            self._stats["prefetch_hits"] += 1
+            return "prefetch"
+        return "cache"
+
+    # ---------------------------------------------------------------------
+    # Background
+    # ---------------------------------------------------------------------
+    def prefetch(self, keys):
+        """Replace the queued prefetches with `keys` (most likely first)."""
+        with self._cond:
+            self._cancel_queued()
+            for key in keys:
+                if key in self._images or key in self._inflight or key in self._queue:
+                    continue
+                self._queue.append(key)
+                self._stats["prefetch_queued"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="map-prefetch", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _cancel_queued(self):
+        self._stats["prefetch_cancelled"] += len(self._queue)
+        self._queue.clear()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Low priority: wait while a foreground render is running
+                while not self._queue or self._foreground:
+                    self._cond.wait()
+                key = self._queue.popleft()
+                future = self._inflight[key] = Future()
+            try:
+                image = self._render(*key)
+            except Exception as e:
+                with self._cond:
+                    self._stats["prefetch_failed"] += 1
+                    del self._inflight[key]
+                future.set_exception(e)
+                continue
+            self._store(key, image, prefetched=True)
+            with self._cond:
+                self._stats["prefetch_rendered"] += 1
+                del self._inflight[key]
+            future.set_result(image)
+
+    # ---------------------------------------------------------------------
+    # Storage & stats
+    # ---------------------------------------------------------------------
+    def _store(self, key, image, prefetched=False):
+        with self._cond:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            if prefetched:
+                self._unused.add(key)
+            while len(self._images) > self.max_entries:
+                evicted, _ = self._images.popitem(last=False)
+                if evicted in self._unused:
+                    self._unused.discard(evicted)
+                    self._stats["prefetch_evicted"] += 1
+
+    def __len__(self):
+        return len(self._images)
+
+    def stats(self):
+        """Counters plus hit_rate (foreground) and prefetch_hit_rate (prefetched maps later requested)."""
+        with self._cond:
+            stats = dict(self._stats)
+        stats["hit_rate"] = stats["hits"] / stats["requests"] if stats["requests"] else None
+        stats["prefetch_hit_rate"] = (stats["prefetch_hits"] / stats["prefetch_rendered"]
+                                      if stats["prefetch_rendered"] else None)
+        return stats
@@ -0,0 +1,259 @@
+"""
+Headless map rendering: the entry point for every front end.
+
+Importing this module costs only the standard library. Matplotlib (forced to
+the Agg backend), GeoPandas, shapely and the drawing code are imported on the
+first render or warm_up(), and Streamlit is never imported at all:
+
+    from map_render import render_map
+    png = render_map(2023, "NHB")
+    webp = render_map(2023, "NHB", fmt="webp", width=640)
+    render_map(2023, "NHB", fmt="svg", dpi=150, output="static/maps/NHB_2023.svg")
+
+Every map is cropped to a fixed layout computed once per figure size
+(v9_main_map.get_map_layout()), so a render draws the figure exactly once.
+PNG and WebP are encoded from the drawn pixels by image_encode (palette PNG,
+tunable compression); a width is served by downscaling a master rendered at
+the smallest of MASTER_DPIS that is at least that wide. Other formats (svg,
+pdf, ...) are saved by Matplotlib.
+
+Every render is drawn at one of MASTER_DPIS: a requested dpi is rounded up to
+the next of them (snap_dpi()). Each resolution drawn costs a cached base layer
+per process, so arbitrary client dpi values must not each add one. The most
+recently used masters are kept in memory up to MAP_MASTER_CACHE_MB (default
+64 MB; a 100 dpi master is about 3.5 MB, a 300 dpi one about 33 MB), so the
+other sizes and formats of a selection only cost an encode.
+
+cache_key() is the render cache key of a request; the Flask app and the batch
+pre-render both use it, so a batch run warms exactly the entries the app
+looks up.
+
+render_map() is safe to call from several threads at once: each call draws on
+its own Figure and Agg canvas and only reads the shared geometry, data and
+cached base layers and layouts.
+
+The cold start (imports, geometry store load, base layer rasterization, output
+layout) is timed as spans named cold_import, cold_geometry, cold_base_layer
+and cold_layout. The first render of the process adds them to its
+collect_spans(), so the Flask app's /metrics reports each worker's cold start
+next to the per-render stages, and `python map_render.py --cold-start` prints
+them for a fresh process.
+
+    python map_render.py 2023 NHB                 # static/maps/NHB_2023.png
+    python map_render.py 2023 NHB -o map.svg --dpi 150
+    python map_render.py 2023 NHB -o map.webp --width 640
+    python map_render.py --cold-start --json
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from image_encode import ENCODED_FORMATS, encode_image, encoder_settings
+from render_metrics import record_spans, span
+
+# Resolutions every map is drawn at; sized PNG/WebP output is scaled down from these masters
+MASTER_DPIS = (50, 100, 150, 200, 300)
+# Resolution of a map requested without dpi or width (v9_main_map.DPI)
+DEFAULT_DPI = 100
+# Widest PNG/WebP served: a 300 dpi master is about 3070 px wide, and wider
+# output could only be upscaled from it
+MAX_WIDTH = 3000
+MASTER_CACHE_BYTES = int(float(os.environ.get("MAP_MASTER_CACHE_MB", 64)) * 1024 * 1024)
+
+_renderer = None
+_renderer_lock = threading.Lock()
+_warm = set()
+_warm_lock = threading.Lock()
+_cold_spans = []
+_cold_spans_lock = threading.Lock()
+_cold_reported = False
+_masters = OrderedDict()
+_masters_bytes = 0
+_masters_lock = threading.Lock()
+
+
+def _record_cold(name, seconds):
+    with _cold_spans_lock:
+        _cold_spans.append((f"cold_{name}", seconds))
+
+
+def _load_renderer():
+    """The drawing module, imported on first use with the Agg backend selected."""
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                start = time.perf_counter()
+                import matplotlib
+                matplotlib.use("Agg")
+                import v9_main_map
+                _record_cold("import", time.perf_counter() - start)
+                _renderer = v9_main_map
+    return _renderer
+
+
+def _warm_stage(name, fn):
+    with _warm_lock:
+        if name in _warm:
+            return
+        start = time.perf_counter()
+        fn()
+        _warm.add(name)
+        _record_cold(name, time.perf_counter() - start)
+
+
+def warm_up(figsize=None, dpi=None):
+    """Import the renderer, load the geometry, rasterize the base layer and fix the layout ahead of a render.
+
+    Safe to call from several threads: the work is done, and timed, once.
+    """
+    renderer = _load_renderer()
+    figsize, dpi = figsize or renderer.FIGSIZE, dpi or renderer.DPI
+    from geometry_store import get_geometry_store
+    _warm_stage("geometry", get_geometry_store)
+    _warm_stage("base_layer", lambda: renderer.get_base_layer(figsize, dpi))
+    _warm_stage("layout", lambda: renderer.get_map_layout(figsize))
+
+
+def cold_start_spans():
+    """Cold-start spans measured so far in this process."""
+    with _cold_spans_lock:
+        return list(_cold_spans)
+
+
+def snap_dpi(dpi):
+    """Smallest of MASTER_DPIS at or above `dpi` (the largest one for anything beyond it)."""
+    return next((d for d in MASTER_DPIS if d >= dpi), MASTER_DPIS[-1])
+
+
+def map_options(fmt="png", dpi=None, width=None):
+    """(dpi, width) that a render of `fmt` actually uses.
+
+    width only applies to PNG/WebP; without one, dpi defaults to DEFAULT_DPI.
+    dpi is snapped to MASTER_DPIS, and None means master_dpi(width).
+    """
+    if fmt not in ENCODED_FORMATS:
+        width = None
+    if width is None:
+        dpi = dpi or DEFAULT_DPI
+    return (snap_dpi(dpi) if dpi else None), width
+
+
+def cache_key(cache, year, race, fmt="png", dpi=None, width=None):
+    """Key of a rendered map in a render_cache.RenderCache: selection, format, map_options() and encoder settings."""
+    dpi, width = map_options(fmt, dpi, width)
+    return cache.key(year, race, fmt, dpi=dpi, width=width, encoder=encoder_settings(fmt))
+
+
+def master_dpi(width=None, figsize=None):
+    """Lowest of MASTER_DPIS whose map is at least `width` pixels wide (the renderer's DPI without a width)."""
+    renderer = _load_renderer()
+    if not width:
+        return renderer.DPI
+    inches = renderer.get_map_layout(figsize or renderer.FIGSIZE).width
+    return next((dpi for dpi in MASTER_DPIS if inches * dpi >= width), MASTER_DPIS[-1])
+
+
+def render_pixels(year, race, dpi=None, figsize=None):
+    """RGBA pixels of one selection cropped to the layout, from the master cache when possible."""
+    global _masters_bytes
+    renderer = _load_renderer()
+    year, race = int(year), race.upper()
+    figsize, dpi = tuple(figsize or renderer.FIGSIZE), dpi or renderer.DPI
+    version = renderer.get_rate_cube(renderer.CSV_PATH, renderer.TOTAL_COUNT_CSV).version
+    key = (year, race, figsize, dpi, version, renderer.load_region_scheme().fingerprint)
+    with _masters_lock:
+        pixels = _masters.get(key)
+        if pixels is not None:
+            _masters.move_to_end(key)
+            return pixels
+    pixels = renderer.render_map_rgba(year, race, figsize=figsize, dpi=dpi)
+    # Shared by every later render of the key
+    pixels.flags.writeable = False
+    if pixels.nbytes > MASTER_CACHE_BYTES:
+        return pixels
+    with _masters_lock:
+        if key not in _masters:
+            _masters[key] = pixels
+            _masters_bytes += pixels.nbytes
+        while _masters_bytes > MASTER_CACHE_BYTES:
+            _masters_bytes -= _masters.popitem(last=False)[1].nbytes
+    return pixels
+
+
+def render_map(year, race, fmt="png", dpi=None, figsize=None, output=None, width=None):
+    """Render one (year, race) selection and return the encoded image bytes.
+
+    fmt is png or webp (encoded by image_encode, optionally scaled to `width`
+    pixels) or any other format Matplotlib's Agg canvas saves (svg, pdf, jpg,
+    ...; `width` is ignored). dpi defaults to master_dpi(width) and is rounded
+    up to one of MASTER_DPIS; figsize defaults to the renderer's FIGSIZE. With `output` the image is also written there
+    atomically. Raises ValueError when the data has no rows for the selection.
+    """
+    global _cold_reported
+    renderer = _load_renderer()
+    if fmt in ENCODED_FORMATS:
+        pixels = render_pixels(year, race, snap_dpi(dpi) if dpi else master_dpi(width, figsize), figsize)
+        with span("encode"):
+            data = encode_image(pixels, fmt, width)
+    else:
+        data = renderer.render_map_image(int(year), race.upper(), fmt,
+                                         figsize=figsize or renderer.FIGSIZE, dpi=snap_dpi(dpi or renderer.DPI))
+    # The first render of the process also reports what the start cost
+    if not _cold_reported:
+        _cold_reported = True
+        record_spans(cold_start_spans())
+    if output:
+        from render_cache import atomic_write
+        atomic_write(output, data)
+    return data
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+
+    process_start = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Render one map without Streamlit or Flask.")
+    parser.add_argument("year", nargs="?", type=int)
+    parser.add_argument("race", nargs="?")
+    parser.add_argument("-o", "--output", help="output path (default: static/maps/<RACE>_<YEAR>.<format>)")
+    parser.add_argument("--format", default=None, help="image format (default: from --output, else png)")
+    parser.add_argument("--dpi", type=int, default=None)
+    parser.add_argument("--width", type=int, default=None, help="width in pixels of PNG/WebP output")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="print the cold-start breakdown of this process")
+    parser.add_argument("--json", action="store_true", help="print the cold-start breakdown as JSON")
+    args = parser.parse_args()
+
+    if args.year is None or args.race is None:
+        if not args.cold_start:
+            parser.error("expected a year and a race (or --cold-start)")
+        warm_up(dpi=args.dpi)
+    else:
+        race = args.race.upper()
+        fmt = args.format or (os.path.splitext(args.output)[1].lstrip(".").lower() if args.output else "png")
+        output = args.output or os.path.join("static/maps", f"{race}_{args.year}.{fmt}")
+        if args.cold_start:
+            # Separate the set-up stages from the render itself
+            warm_up(dpi=args.dpi)
+        try:
+            start = time.perf_counter()
+            render_map(args.year, race, fmt, dpi=args.dpi, output=output, width=args.width)
+            first_render = time.perf_counter() - start
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f"Saved {output}", file=sys.stderr if args.json else sys.stdout)
+
+    if args.cold_start:
+        stages = {name: seconds for name, seconds in cold_start_spans()}
+        if args.year is not None and args.race is not None:
+            stages["first_render"] = first_render
+        stages["total"] = time.perf_counter() - process_start
+        if args.json:
+            print(json.dumps(stages))
+        else:
+            for name, seconds in stages.items():
+                print(f"  {name:<16} {seconds * 1000:9.1f} ms")
@@ -0,0 +1,215 @@
+"""
+Time-series views of one race group across every year in the data.
+
+Two render modes share the same set-up, done once per call: dissolved region
+outlines (as Matplotlib paths), county borders, the state outline and one
+color scale spanning every year of the race.
+
+    render_small_multiples(race)   grid of per-year panels with one colorbar
+    render_animation(race, "gif")  one map whose colors and labels are updated
+                                   frame by frame (GIF/WebP via Pillow, MP4 via ffmpeg)
+
+Command line:
+
+    python map_series.py NHB --grid static/maps/NHB_series.png
+    python map_series.py NHB --animate static/maps/NHB_series.gif --fps 1
+"""
+import io
+import math
+import os
+import tempfile
+
+import matplotlib
+from matplotlib import animation
+from matplotlib.cm import ScalarMappable
+from matplotlib.collections import LineCollection, PathCollection
+from matplotlib.colors import Normalize
+from matplotlib.path import Path
+import numpy as np
+import shapely
+
+from geometry_store import get_geometry_store
+from rate_cube import STATEWIDE, get_rate_cube, race_key, region_key
+from regions import load_region_scheme
+from v9_main_map import new_figure, race_descriptions
+
+SERIES_CMAP = "YlOrRd"
+MISSING_COLOR = "#d9d9d9"
+GRID_COLUMNS = 4
+PANEL_SIZE = (4, 3.6)
+ANIMATION_FIGSIZE = (8, 9)
+
+
+# -------------------------------------------------------------------------
+# SHARED GEOMETRY
+# -------------------------------------------------------------------------
+def _polygon_path(geom):
+    """One compound Path for a (Multi)Polygon, holes included."""
+    vertices, codes = [], []
+    for polygon in getattr(geom, "geoms", [geom]):
+        for ring in [polygon.exterior, *polygon.interiors]:
+            coords = np.asarray(ring.coords)
+            ring_codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+            ring_codes[0], ring_codes[-1] = Path.MOVETO, Path.CLOSEPOLY
+            vertices.append(coords)
+            codes.append(ring_codes)
+    return Path(np.concatenate(vertices), np.concatenate(codes))
+
+
+class SeriesLayout:
+    """Everything that is identical in every year's panel or frame of one race."""
+
+    def __init__(self, race, panel_px):
+        self.cube = get_rate_cube()
+        self.race = race_key(race)
+        self.years = [y for y in self.cube.years if self.cube.has(self.race, y)]
+        if not self.years:
+            raise ValueError(f"No data found for Race={self.race}")
+
+        geo = get_geometry_store()
+        geo = geo.for_resolution(max(np.ptp(geo.halo.bounds[0::2]), np.ptp(geo.halo.bounds[1::2])) / panel_px)
+        self.bounds = geo.halo.bounds
+
+        # Dissolved region polygons (cached by the store) that have rates in the cube
+        dissolved = geo.regions(load_region_scheme())
+        mapped = [(region_key(name), geom) for name, geom in zip(dissolved["region"], dissolved.geometry)
+                  if region_key(name) in self.cube.region_index]
+        self.regions = [key for key, _ in mapped]
+        self.region_paths = [_polygon_path(geom) for _, geom in mapped]
+        self.county_segments = [np.asarray(line.coords) for line in
+                                shapely.get_parts(shapely.boundary(geo.counties.geometry.values))]
+        self.state_segments = [np.asarray(line.coords) for line in
+                               shapely.get_parts(geo.state_boundary.boundary.values)]
+
+        # Rates of the mapped regions for every year, and one color scale for all of them
+        rows = [self.cube.region_index[k] for k in self.regions]
+        r = self.cube.race_index[self.race]
+        self.rates = np.ma.masked_invalid(self.cube.rates[r][np.ix_(rows, [self.cube.year_index[y] for y in self.years])])
+        vmax = float(self.rates.max()) if self.rates.count() else 1.0
+        self.norm = Normalize(vmin=0, vmax=vmax)
+        self.cmap = matplotlib.colormaps[SERIES_CMAP].with_extremes(bad=MISSING_COLOR)
+
+    def year_rates(self, i):
+        return self.rates[:, i]
+
+    def caption(self, year):
+        statewide = self.cube.rate(self.race, STATEWIDE, year)
+        return f"Statewide {statewide:g}   T={self.cube.total_count(self.race, year)}"
+
+    def title(self):
+        return (f"Regional Asthma Age-Adjusted Rates Per 100,000 HOSPITALIZATION Discharges\n"
+                f"{race_descriptions.get(self.race, self.race)} ({self.race}), "
+                f"{self.years[0]}-{self.years[-1]}")
+
+    def draw_panel(self, ax, values):
+        """Add the map artists to `ax`; returns the region collection to recolor."""
+        regions = PathCollection(self.region_paths, cmap=self.cmap, norm=self.norm,
+                                 edgecolors="none")
+        regions.set_array(values)
+        ax.add_collection(regions, autolim=False)
+        ax.add_collection(LineCollection(self.county_segments, colors="white", linewidths=0.3))
+        ax.add_collection(LineCollection(self.state_segments, colors="gray", linewidths=0.8))
+        ax.set_xlim(self.bounds[0], self.bounds[2])
+        ax.set_ylim(self.bounds[1], self.bounds[3])
+        ax.set_aspect("equal")
+        ax.set_axis_off()
+        return regions
+
+    def colorbar(self, fig, axes):
+        bar = fig.colorbar(ScalarMappable(norm=self.norm, cmap=self.cmap), ax=axes, shrink=0.6, pad=0.02)
+        bar.set_label("Age-adjusted rate per 100,000")
+        return bar
+
+
+# -------------------------------------------------------------------------
+# SMALL MULTIPLES
+# -------------------------------------------------------------------------
+def render_small_multiples(race, fmt="png", dpi=100, columns=GRID_COLUMNS):
+    """One image with a panel per year for `race`, sharing a single color scale."""
+    layout = SeriesLayout(race, panel_px=PANEL_SIZE[0] * dpi)
+    rows = math.ceil(len(layout.years) / columns)
+    fig = new_figure((PANEL_SIZE[0] * columns, PANEL_SIZE[1] * rows), dpi)
+    axes = fig.subplots(rows, columns, squeeze=False)
+    for i, ax in enumerate(axes.flat):
+        if i >= len(layout.years):
+            ax.set_axis_off()
+            continue
+        year = layout.years[i]
+        layout.draw_panel(ax, layout.year_rates(i))
+        ax.set_title(str(year), fontsize=12, fontweight="bold")
+        ax.text(0.5, -0.02, layout.caption(year), transform=ax.transAxes,
+                ha="center", va="top", fontsize=8)
+    layout.colorbar(fig, axes)
+    fig.suptitle(layout.title(), fontsize=13)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, bbox_inches="tight")
+    return buf.getvalue()
+
+
+# -------------------------------------------------------------------------
+# ANIMATION
+# -------------------------------------------------------------------------
+ANIMATION_FORMATS = ("gif", "webp", "mp4")
+
+
+def _animation_writer(fmt, fps):
+    if fmt in ("gif", "webp"):
+        return animation.PillowWriter(fps=fps)
+    if fmt == "mp4":
+        if not animation.FFMpegWriter.isAvailable():
+            raise RuntimeError("MP4 output needs ffmpeg on the PATH")
+        return animation.FFMpegWriter(fps=fps, codec="libx264", extra_args=["-pix_fmt", "yuv420p"])
+    raise ValueError(f"Unsupported animation format '{fmt}' (use one of {', '.join(ANIMATION_FORMATS)})")
+
+
+def render_animation(race, fmt="gif", dpi=100, fps=1):
+    """Animated map of `race` across the years; returns the encoded bytes."""
+    writer = _animation_writer(fmt, fps)
+    layout = SeriesLayout(race, panel_px=ANIMATION_FIGSIZE[0] * dpi)
+    fig = new_figure(ANIMATION_FIGSIZE, dpi)
+    ax = fig.subplots()
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        regions = layout.draw_panel(ax, layout.year_rates(0))
+        layout.colorbar(fig, ax)
+        fig.suptitle(layout.title(), fontsize=12)
+        year_text = ax.set_title("", fontsize=20, fontweight="bold", color="#444444")
+        caption = ax.text(0.5, -0.01, "", transform=ax.transAxes, ha="center", va="top", fontsize=10)
+
+        # Only the region colors and two labels change between frames
+        with writer.saving(fig, path, dpi):
+            for i, year in enumerate(layout.years):
+                regions.set_array(layout.year_rates(i))
+                year_text.set_text(str(year))
+                caption.set_text(layout.caption(year))
+                writer.grab_frame()
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render a race group's maps for every year in one pass.")
+    parser.add_argument("race", help="race group, e.g. NHB")
+    parser.add_argument("--grid", metavar="PATH", help="write small multiples (format from the extension)")
+    parser.add_argument("--animate", metavar="PATH", help="write an animation (.gif, .webp or .mp4)")
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--fps", type=float, default=1.0, help="animation frames (years) per second")
+    args = parser.parse_args()
+    if not (args.grid or args.animate):
+        parser.error("pass --grid and/or --animate")
+
+    from render_cache import atomic_write
+    if args.grid:
+        fmt = os.path.splitext(args.grid)[1].lstrip(".") or "png"
+        atomic_write(args.grid, render_small_multiples(args.race, fmt, dpi=args.dpi))
+        print(f"Saved {args.grid}")
+    if args.animate:
+        fmt = os.path.splitext(args.animate)[1].lstrip(".").lower()
+        atomic_write(args.animate, render_animation(args.race, fmt, dpi=args.dpi, fps=args.fps))
+        print(f"Saved {args.animate}")
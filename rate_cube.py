@@ -0,0 +1,279 @@
+"""
+Indexed in-memory view of the asthma rate and total-count CSVs.
+
+Both CSVs are parsed once into dense NumPy arrays:
+
+    rates[race, region, year]   age-adjusted rate (NaN where a row is missing)
+    totals[race, year]          statewide hospitalization count
+
+Race and region keys are normalized ("Hisp" -> "HISP", "North_Central" ->
+"NORTH CENTRAL") so lookups are plain dict indexing. Year columns are
+discovered from the header ("_2024" or "2024"), so a new year needs no code
+change. The CSVs are checked against the schema below while parsing; every
+problem found is reported at once in a SchemaError.
+
+get_rate_cube() serves the cube from the memory-mapped Arrow file written by
+rate_store.py (re-ingesting the CSVs when they change) and falls back to
+parsing the CSVs when pyarrow is not installed. It reloads automatically when
+either file's mtime changes. Only the standard library and NumPy are imported
+up front, so the Flask app and CLI can import this cheaply.
+"""
+import csv
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+CSV_PATH = "Asthma_regional_data.csv"
+TOTAL_COUNT_CSV = "total_count_per_race_ethnicity.csv"
+
+STATEWIDE = "STATEWIDE"
+_YEAR_COLUMN = re.compile(r"_?(\d{4})")
+
+# Schema of both CSVs: these key columns plus one or more year columns, each
+# cell a non-negative number or empty. The total-count CSV needs a "Total" row
+# (TOTAL_REGION) for every race, with a column for every year of the rates.
+KEY_COLUMNS = ("Group", "Region")
+TOTAL_REGION = "TOTAL"
+
+
+class SchemaError(ValueError):
+    """A CSV does not match the expected schema; `errors` lists every problem found."""
+
+    def __init__(self, path, errors):
+        super().__init__(f"{path}: " + "; ".join(errors[:5])
+                         + (f" (and {len(errors) - 5} more)" if len(errors) > 5 else ""))
+        self.path = path
+        self.errors = errors
+
+
+def race_key(race):
+    return str(race).strip().upper()
+
+
+def region_key(region):
+    return re.sub(r"[\s_-]+", " ", str(region)).strip().upper()
+
+
+def _read_rows(path):
+    """Header-normalized rows plus the {year: column} mapping of a CSV, validated."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = [h.strip() for h in next(reader, [])]
+        rows = [(line, row) for line, row in enumerate(reader, 2) if any(cell.strip() for cell in row)]
+    year_cols = {}
+    errors = []
+    for i, name in enumerate(header):
+        m = _YEAR_COLUMN.fullmatch(name)
+        if m:
+            year_cols[int(m.group(1))] = i
+        elif name not in KEY_COLUMNS:
+            errors.append(f"unexpected column {name!r}")
+    errors += [f"missing column {name!r}" for name in KEY_COLUMNS if name not in header]
+    if not year_cols:
+        errors.append("no year columns (expected names like _2016 or 2016)")
+    if errors:
+        raise SchemaError(path, errors)
+
+    keys = [header.index(name) for name in KEY_COLUMNS]
+    for line, row in rows:
+        if len(row) != len(header):
+            errors.append(f"line {line}: {len(row)} fields, expected {len(header)}")
+            continue
+        errors += [f"line {line}: empty {KEY_COLUMNS[k]}" for k, c in enumerate(keys) if not row[c].strip()]
+        for year, c in year_cols.items():
+            try:
+                if _to_float(row[c]) < 0:
+                    errors.append(f"line {line}: negative value for {year}")
+            except ValueError:
+                errors.append(f"line {line}: {row[c]!r} for {year} is not a number")
+    if errors:
+        raise SchemaError(path, errors)
+    return header, [row for _, row in rows], year_cols
+
+
+def _to_float(cell):
+    cell = cell.strip()
+    return float(cell) if cell else np.nan
+
+
+class RateCube:
+    """Dense (race, region, year) rate array with O(1) keyed lookups."""
+
+    def __init__(self, csv_path=CSV_PATH, total_count_csv=TOTAL_COUNT_CSV):
+        self.csv_path = csv_path
+        self.total_count_csv = total_count_csv
+        self.version = _mtimes(csv_path, total_count_csv)
+        self._load_rates()
+        self._load_totals()
+
+    @classmethod
+    def from_arrays(cls, csv_path, total_count_csv, version, races, regions, years, rates, totals):
+        """Cube over arrays parsed elsewhere, e.g. memory-mapped by rate_store (no copy is made)."""
+        cube = cls.__new__(cls)
+        cube.csv_path = csv_path
+        cube.total_count_csv = total_count_csv
+        cube.version = version
+        cube.races = list(races)
+        cube.regions = list(regions)
+        cube.years = [int(y) for y in years]
+        cube.race_index = {race: i for i, race in enumerate(cube.races)}
+        cube.region_index = {region_key(name): i for i, name in enumerate(cube.regions)}
+        cube.year_index = {year: i for i, year in enumerate(cube.years)}
+        cube.rates = rates
+        cube.totals = totals
+        for array in (rates, totals):
+            array.setflags(write=False)
+        return cube
+
+    def _load_rates(self):
+        header, rows, year_cols = _read_rows(self.csv_path)
+        group_col, region_col = header.index("Group"), header.index("Region")
+        if not rows:
+            raise SchemaError(self.csv_path, ["no data rows"])
+
+        self.years = sorted(year_cols)
+        self.races = []
+        self.regions = []          # display names, in first-seen CSV order
+        self.race_index = {}
+        self.region_index = {}
+        self.year_index = {year: i for i, year in enumerate(self.years)}
+        seen = set()
+        duplicates = []
+        for row in rows:
+            rk, gk = race_key(row[group_col]), region_key(row[region_col])
+            if (rk, gk) in seen:
+                duplicates.append(f"more than one row for {rk} / {row[region_col].strip()}")
+            seen.add((rk, gk))
+            if rk not in self.race_index:
+                self.race_index[rk] = len(self.races)
+                self.races.append(rk)
+            if gk not in self.region_index:
+                self.region_index[gk] = len(self.regions)
+                self.regions.append(row[region_col].strip())
+        if duplicates:
+            raise SchemaError(self.csv_path, duplicates)
+
+        self.rates = np.full((len(self.races), len(self.regions), len(self.years)), np.nan)
+        cols = [year_cols[y] for y in self.years]
+        for row in rows:
+            r = self.race_index[race_key(row[group_col])]
+            g = self.region_index[region_key(row[region_col])]
+            self.rates[r, g, :] = [_to_float(row[c]) for c in cols]
+        self.rates.setflags(write=False)
+
+    def _load_totals(self):
+        header, rows, year_cols = _read_rows(self.total_count_csv)
+        group_col, region_col = header.index("Group"), header.index("Region")
+        errors = [f"no column for {year}" for year in self.years if year not in year_cols]
+        self.totals = np.full((len(self.races), len(self.years)), np.nan)
+        found = set()
+        for row in rows:
+            rk = race_key(row[group_col])
+            if region_key(row[region_col]) != TOTAL_REGION or rk not in self.race_index:
+                continue
+            found.add(rk)
+            for y, c in year_cols.items():
+                if y in self.year_index:
+                    self.totals[self.race_index[rk], self.year_index[y]] = _to_float(row[c])
+        errors += [f"no {TOTAL_REGION.title()} row for {race}" for race in self.races if race not in found]
+        if errors:
+            raise SchemaError(self.total_count_csv, errors)
+        self.totals.setflags(write=False)
+
+    # ---------------------------------------------------------------------
+    # Lookups
+    # ---------------------------------------------------------------------
+    def has(self, race, year):
+        """True if there is at least one rate for this (race, year)."""
+        r, y = self.race_index.get(race_key(race)), self.year_index.get(int(year))
+        return r is not None and y is not None and not np.isnan(self.rates[r, :, y]).all()
+
+    def region_vector(self, race, year):
+        """Rates of every region (order of self.regions) for one race and year."""
+        return self.rates[self.race_index[race_key(race)], :, self.year_index[int(year)]]
+
+    def rate(self, race, region, year):
+        return float(self.rates[self.race_index[race_key(race)],
+                                self.region_index[region_key(region)],
+                                self.year_index[int(year)]])
+
+    def statewide(self, race, year):
+        return self.rate(race, STATEWIDE, year)
+
+    def statewide_by_race(self, year):
+        """{race: statewide rate} for one year, skipping races without a value."""
+        g, y = self.region_index[STATEWIDE], self.year_index[int(year)]
+        values = self.rates[:, g, y]
+        return {race: float(v) for race, v in zip(self.races, values) if not np.isnan(v)}
+
+    def total_count(self, race, year):
+        return int(self.totals[self.race_index[race_key(race)], self.year_index[int(year)]])
+
+    def ranked(self, race, year):
+        """[(region, rate), ...] sorted by rate, highest first; missing regions dropped."""
+        values = self.region_vector(race, year)
+        order = np.argsort(-values, kind="stable")
+        order = order[~np.isnan(values[order])]
+        return [(self.regions[i], float(values[i])) for i in order]
+
+    def selection_fingerprint(self, race, year):
+        """SHA-256 of the data a map of (race, year) is drawn from, None if the cube has no such selection.
+
+        That is the race's rate of every region in that year, the statewide
+        rate of every race in that year, the race's total count and the list
+        of years; an edit anywhere else in the CSVs leaves it unchanged.
+        """
+        r, y = self.race_index.get(race_key(race)), self.year_index.get(int(year))
+        if r is None or y is None:
+            return None
+        payload = {
+            "years": self.years,
+            "rates": list(zip(self.regions, self.rates[r, :, y].tolist())),
+            "statewide": self.statewide_by_race(year),
+            "total_count": float(self.totals[r, y]),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def summary(self, race, year):
+        """JSON-ready payload of one selection, enough for a client to draw the map."""
+        values = self.region_vector(race, year)
+        return {
+            "year": int(year),
+            "race": race_key(race),
+            "rates": {region_key(name): float(v) for name, v in zip(self.regions, values) if not np.isnan(v)},
+            "table": [[region, rate] for region, rate in self.ranked(race, year)],
+            "statewide": self.statewide_by_race(year),
+            "total_count": self.total_count(race, year),
+        }
+
+
+def _mtimes(*paths):
+    return tuple(os.stat(p).st_mtime_ns for p in paths)
+
+
+def _is_current(cube, csv_path, total_count_csv):
+    return (cube is not None
+            and (cube.csv_path, cube.total_count_csv) == (csv_path, total_count_csv)
+            and cube.version == _mtimes(csv_path, total_count_csv))
+
+
+_CUBE = None
+_CUBE_LOCK = threading.Lock()
+
+
+def get_rate_cube(csv_path=CSV_PATH, total_count_csv=TOTAL_COUNT_CSV):
+    """Process-wide cube, reloaded (and re-ingested) when either CSV's mtime changes."""
+    global _CUBE
+    cube = _CUBE
+    if not _is_current(cube, csv_path, total_count_csv):
+        with _CUBE_LOCK:
+            cube = _CUBE
+            if not _is_current(cube, csv_path, total_count_csv):
+                # Imported here: rate_store pulls in pyarrow when it is installed
+                from rate_store import load_cube
+                cube = _CUBE = load_cube(csv_path, total_count_csv)
+    return cube
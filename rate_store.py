@@ -0,0 +1,159 @@
+"""
+Columnar, memory-mapped copy of the rate cube.
+
+Ingestion parses and validates the two CSVs once (see rate_cube.SchemaError)
+and writes a single uncompressed Arrow IPC file, one row per (race, region,
+year) in the cube's C order:
+
+    race         dictionary<string>   normalized race key
+    region       dictionary<string>   region display name
+    year         int16
+    rate         float64              NaN where the CSV has no value
+    total_count  float64              statewide count of the race and year
+
+Because the rate column is the flattened cube, loading it is a memory map and
+a reshape: the arrays handed to RateCube point straight into the page cache,
+so load time does not grow with the number of regions or years, and every
+process on the machine shares the same physical pages. Other tools can read
+the file as an ordinary table (pyarrow.feather, pandas, DuckDB). Parquet would
+need decoding on every load, so it is only offered as an export format
+(derived_metrics.py).
+
+The dimension labels and the size and mtime of the source CSVs are kept in
+the schema metadata; a file whose sources have changed is re-ingested on the
+next load. Without pyarrow, load_cube() parses the CSVs directly.
+
+    python rate_store.py            # ingest if missing or stale
+    python rate_store.py --rebuild  # force ingestion
+"""
+import json
+import os
+
+import numpy as np
+
+from rate_cube import CSV_PATH, TOTAL_COUNT_CSV, RateCube, _mtimes
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional: load_cube() falls back to the CSVs
+    pa = None
+
+RATE_STORE_PATH = os.environ.get("RATE_STORE_PATH", "static/data/asthma_rates.arrow")
+# Bump whenever the layout of the Arrow file changes
+STORE_FORMAT = 1
+_META_KEY = b"rate_store"
+
+
+def _sources(csv_path, total_count_csv):
+    return {path: [os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in (csv_path, total_count_csv)}
+
+
+def write_store(cube, store_path=None):
+    """Write a parsed (validated) RateCube as the Arrow file."""
+    from render_cache import atomic_write
+
+    store_path = store_path or RATE_STORE_PATH
+    sources = _sources(cube.csv_path, cube.total_count_csv)
+
+    # Row i of the table is cube.rates.flat[i]
+    race_idx, region_idx, year_idx = np.indices(cube.rates.shape, dtype=np.int32).reshape(3, -1)
+    table = pa.table({
+        "race": pa.DictionaryArray.from_arrays(race_idx, pa.array(cube.races, pa.string())),
+        "region": pa.DictionaryArray.from_arrays(region_idx, pa.array(cube.regions, pa.string())),
+        "year": pa.array(np.asarray(cube.years, dtype=np.int16)[year_idx]),
+        "rate": pa.array(cube.rates.ravel()),
+        "total_count": pa.array(np.broadcast_to(cube.totals[:, None, :], cube.rates.shape).ravel()),
+    })
+    meta = {
+        "format": STORE_FORMAT,
+        "races": cube.races,
+        "regions": cube.regions,
+        "years": cube.years,
+        "sources": sources,
+    }
+    table = table.replace_schema_metadata({_META_KEY: json.dumps(meta).encode()})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        # One record batch, so every column is a single contiguous buffer
+        writer.write_table(table, max_chunksize=max(1, table.num_rows))
+    atomic_write(store_path, sink.getvalue().to_pybytes())
+
+
+def _read_meta(reader):
+    return json.loads(reader.schema.metadata[_META_KEY])
+
+
+def _zero_copy(batch, name, shape):
+    return batch.column(name).to_numpy(zero_copy_only=True).reshape(shape)
+
+
+def read_store(store_path=None, csv_path=CSV_PATH, total_count_csv=TOTAL_COUNT_CSV):
+    """Memory-map the Arrow file; None if it is missing, of another format or stale."""
+    store_path = store_path or RATE_STORE_PATH
+    if not os.path.exists(store_path):
+        return None
+    version = _mtimes(csv_path, total_count_csv)
+    source = pa.memory_map(store_path)
+    try:
+        reader = pa.ipc.open_file(source)
+        meta = _read_meta(reader)
+    except (pa.ArrowInvalid, KeyError, TypeError, ValueError):
+        # Truncated or foreign file: ingest again
+        source.close()
+        return None
+    if meta.get("format") != STORE_FORMAT or meta.get("sources") != _sources(csv_path, total_count_csv):
+        source.close()
+        return None
+
+    shape = (len(meta["races"]), len(meta["regions"]), len(meta["years"]))
+    batch = reader.get_batch(0)
+    rates = _zero_copy(batch, "rate", shape)
+    # total_count repeats per region; region 0's slice is the (race, year) totals
+    totals = _zero_copy(batch, "total_count", shape)[:, 0, :]
+    cube = RateCube.from_arrays(csv_path, total_count_csv, version,
+                                meta["races"], meta["regions"], meta["years"], rates, totals)
+    # The arrays borrow the mapped buffers; keep them alive with the cube
+    cube._store_batch = batch
+    return cube
+
+
+def load_cube(csv_path=CSV_PATH, total_count_csv=TOTAL_COUNT_CSV, store_path=None, rebuild=False):
+    """Rate cube backed by the Arrow file, ingesting the CSVs first when it is missing or stale."""
+    if pa is None:
+        return RateCube(csv_path, total_count_csv)
+    cube = None if rebuild else read_store(store_path, csv_path, total_count_csv)
+    if cube is not None:
+        return cube
+    cube = RateCube(csv_path, total_count_csv)
+    try:
+        write_store(cube, store_path)
+    except OSError:
+        # Read-only deployment, or (on Windows) the old file is still mapped
+        # by another process: serve the freshly parsed cube from memory
+        return cube
+    return read_store(store_path, csv_path, total_count_csv) or cube
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    from rate_cube import SchemaError
+
+    parser = argparse.ArgumentParser(description="Validate the asthma CSVs and write the memory-mapped rate store.")
+    parser.add_argument("--rebuild", action="store_true", help="ingest even if the store is up to date")
+    parser.add_argument("--output", default=None, help="path of the Arrow file")
+    args = parser.parse_args()
+    if pa is None:
+        sys.exit("The rate store needs pyarrow (pip install pyarrow)")
+
+    try:
+        cube = load_cube(store_path=args.output, rebuild=args.rebuild)
+    except SchemaError as e:
+        print(f"{e.path} does not match the schema:", file=sys.stderr)
+        for error in e.errors:
+            print(f"  {error}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Rate store: {len(cube.races)} races x {len(cube.regions)} regions x "
+          f"{len(cube.years)} years ({cube.years[0]}-{cube.years[-1]}) -> {args.output or RATE_STORE_PATH}")
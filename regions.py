@@ -0,0 +1,105 @@
+"""
+Region schemes: which counties make up each region, its map color and label anchor.
+
+A scheme is a JSON definition file (see static/regions/), so another grouping
+(IDPH EMS regions, another state's counties) is a new file, not new code:
+
+    {
+      "scheme": "illinois-health-regions",
+      "version": 1,
+      "crs": "EPSG:26971",
+      "regions": [
+        {"name": "NORTH", "color": "#66CDAA",
+         "label": {"x": 250000, "y": 4600000, "text": "1"},
+         "counties": ["Boone", "Carroll", ...]},
+        ...
+      ]
+    }
+
+load_region_scheme() parses a file once and reloads it when its mtime changes.
+The scheme's fingerprint (SHA-256 of the file) keys everything derived from it,
+e.g. the dissolved region polygons cached by GeometryStore.regions(). Kept free
+of plotting and GeoPandas imports so the Flask app can use it cheaply.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from rate_cube import region_key
+
+REGION_SCHEME_PATH = os.environ.get("REGION_SCHEME_PATH", "static/regions/illinois_health_regions.json")
+
+
+def _hex_to_rgb(color):
+    color = color.lstrip("#")
+    return tuple(int(color[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+class RegionScheme:
+    """Parsed region definition file.
+
+    names         region names, in file order (also the legend order)
+    counties      {region: [county, ...]}
+    colors        {region: (r, g, b)} with components in 0..1
+    labels        {region: (x, y, text)} label anchors in the scheme's CRS
+    county_index  {county: region}
+    """
+
+    def __init__(self, definition, fingerprint, path=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.scheme = definition["scheme"]
+        self.version = definition.get("version", 1)
+        self.crs = definition.get("crs")
+
+        self.names = []
+        self.counties = {}
+        self.colors = {}
+        self.labels = {}
+        self.county_index = {}
+        for region in definition["regions"]:
+            name = region["name"]
+            self.names.append(name)
+            self.counties[name] = list(region["counties"])
+            self.colors[name] = _hex_to_rgb(region["color"])
+            if "label" in region:
+                label = region["label"]
+                self.labels[name] = (label["x"], label["y"], label.get("text", name))
+            for county in region["counties"]:
+                if county in self.county_index:
+                    raise ValueError(f"{self.scheme}: county {county!r} is in both "
+                                     f"{self.county_index[county]!r} and {name!r}")
+                self.county_index[county] = name
+
+    def region_keys(self):
+        """{county: normalized region key}, the key rate_cube uses for the region."""
+        return {county: region_key(region) for county, region in self.county_index.items()}
+
+
+def _read_scheme(path):
+    with open(path, "rb") as f:
+        payload = f.read()
+    return RegionScheme(json.loads(payload), hashlib.sha256(payload).hexdigest(), path)
+
+
+_SCHEMES = {}
+_SCHEMES_LOCK = threading.Lock()
+
+
+def load_region_scheme(path=None):
+    """Parsed scheme at `path` (default REGION_SCHEME_PATH), reloaded when the file changes."""
+    path = path or REGION_SCHEME_PATH
+    mtime = os.stat(path).st_mtime_ns
+    cached = _SCHEMES.get(path)
+    if cached is None or cached[0] != mtime:
+        with _SCHEMES_LOCK:
+            cached = _SCHEMES.get(path)
+            if cached is None or cached[0] != mtime:
+                cached = _SCHEMES[path] = (mtime, _read_scheme(path))
+    return cached[1]
+
+
+def county_regions(path=None):
+    """{county name: normalized region key} of a scheme (default: the configured one)."""
+    return load_region_scheme(path).region_keys()
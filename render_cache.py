@@ -0,0 +1,158 @@
+"""
+Content-addressed on-disk cache of rendered maps.
+
+A cache key is the SHA-256 of everything that determines the image: year,
+race, output options, the fingerprint of the rates that selection is drawn
+from (RateCube.selection_fingerprint()), the hashes of county_type.csv, the
+geometry store and the region definitions, and RENDERER_VERSION. Because the
+key changes whenever an input changes, entries never need to be invalidated,
+and the key doubles as the HTTP ETag. Editing a cell of the rate CSVs only
+changes the keys of the maps that show it.
+
+Files are written atomically (temp file + rename) and the directory is kept
+under a size budget by evicting the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from rate_cube import CSV_PATH, TOTAL_COUNT_CSV, get_rate_cube
+
+# Bump whenever the drawing code changes what a map looks like
+RENDERER_VERSION = "v9.8"
+
+# Hashed whole, as every map depends on them; the rate CSVs are keyed per selection
+COUNTY_TYPE_FILE = "county_type.csv"
+GEOMETRY_FILE = os.environ.get("GEOMETRY_STORE_PATH", "static/geo/illinois_counties_26971.npz")
+REGION_SCHEME_FILE = os.environ.get("REGION_SCHEME_PATH", "static/regions/illinois_health_regions.json")
+
+DEFAULT_CACHE_DIR = "static/maps/cache"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def atomic_write(path, data):
+    """Write `data` to a temp file next to `path`, then rename it into place."""
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class RenderCache:
+    """Size-bounded LRU directory of rendered images keyed by content hash."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 input_files=(COUNTY_TYPE_FILE, GEOMETRY_FILE, REGION_SCHEME_FILE),
+                 data_files=(CSV_PATH, TOTAL_COUNT_CSV)):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.input_files = tuple(input_files)
+        self.data_files = tuple(data_files)
+        self._hashes = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # ---------------------------------------------------------------------
+    # Keys
+    # ---------------------------------------------------------------------
+    def _file_hash(self, path):
+        """SHA-256 of a file, recomputed only when its size or mtime changes."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return "missing"
+        stamp = (st.st_size, st.st_mtime_ns)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._hashes[path] = (stamp, digest)
+        return digest
+
+    def input_hashes(self):
+        return {path: self._file_hash(path) for path in self.input_files}
+
+    def key(self, year, race, ext="png", **options):
+        payload = {
+            "year": int(year),
+            "race": race.upper(),
+            "ext": ext,
+            "options": options,
+            "data": get_rate_cube(*self.data_files).selection_fingerprint(race, year),
+            "inputs": self.input_hashes(),
+            "renderer": RENDERER_VERSION,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, f"{key}.{ext}")
+
+    # ---------------------------------------------------------------------
+    # Entries
+    # ---------------------------------------------------------------------
+    def get(self, key, ext="png"):
+        """Cached bytes for `key`, or None. A hit marks the entry as recently used."""
+        path = self._path(key, ext)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def put(self, key, data, ext="png"):
+        """Store `data` atomically, then evict old entries beyond the size budget."""
+        atomic_write(self._path(key, ext), data)
+        self.evict()
+
+    def contains(self, key, ext="png"):
+        return os.path.exists(self._path(key, ext))
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                total += st.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+def cache_from_env():
+    return RenderCache(
+        cache_dir=os.environ.get("MAP_CACHE_DIR", DEFAULT_CACHE_DIR),
+        max_bytes=int(os.environ.get("MAP_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+    )
@@ -0,0 +1,234 @@
+"""
+Render timing spans and Prometheus-style metrics.
+
+The render pipeline wraps its stages in `span("name")`. A span only measures
+anything while a caller is collecting:
+
+    with collect_spans() as spans:
+        png = render_map_png(2023, "NHB")
+    # spans == [("data_prep", 0.0001), ("base_layer", 0.0002), ...]
+
+Outside collect_spans() (the CLI, batch renders) a span is a context-variable
+lookup and nothing else. Spans recorded in a render worker are returned with
+the image and merged into the caller's collection with record_spans().
+
+The Flask app aggregates spans into the Counter/Gauge/Histogram objects below
+and serves them at /metrics in the Prometheus text exposition format, next to
+the memory of each render worker (process_memory()). Only the standard library
+is used.
+"""
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+_ACTIVE_SPANS = contextvars.ContextVar("render_spans", default=None)
+
+
+# -------------------------------------------------------------------------
+# Spans
+# -------------------------------------------------------------------------
+@contextmanager
+def span(name):
+    """Time the enclosed block as stage `name` if spans are being collected."""
+    spans = _ACTIVE_SPANS.get()
+    if spans is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((name, time.perf_counter() - start))
+
+
+@contextmanager
+def collect_spans():
+    """Collect every span recorded in this context into the yielded list."""
+    spans = []
+    token = _ACTIVE_SPANS.set(spans)
+    try:
+        yield spans
+    finally:
+        _ACTIVE_SPANS.reset(token)
+
+
+def record_spans(spans):
+    """Add spans measured elsewhere (e.g. in a worker process) to the active collection."""
+    active = _ACTIVE_SPANS.get()
+    if active is not None:
+        active.extend(spans)
+
+
+# -------------------------------------------------------------------------
+# Process memory
+# -------------------------------------------------------------------------
+_SMAPS_FIELDS = {"Rss:": "rss", "Pss:": "pss", "Shared_Clean:": "shared", "Shared_Dirty:": "shared",
+                 "Private_Clean:": "private", "Private_Dirty:": "private"}
+
+
+def process_memory(pid="self"):
+    """Memory of a process in bytes: rss, pss, shared and private.
+
+    RSS counts every resident page, including pages of memory-mapped files
+    that other processes map too; pss charges each shared page to its
+    processes in equal parts, so the pss of all workers adds up to what they
+    really use. On systems without /proc only rss is known (the peak, via
+    getrusage, and only for this process).
+    """
+    memory = dict.fromkeys(("rss", "pss", "shared", "private"), 0)
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                field = line.split()
+                if field and field[0] in _SMAPS_FIELDS:
+                    memory[_SMAPS_FIELDS[field[0]]] += int(field[1]) * 1024
+    except OSError:
+        if pid != "self":
+            return None
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return {"rss": peak if sys.platform == "darwin" else peak * 1024}
+    return memory
+
+
+# -------------------------------------------------------------------------
+# Metrics
+# -------------------------------------------------------------------------
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", r"\\").replace('"', r'\"'))
+                    for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Unlabelled metrics are exposed (as zero) before their first update
+            self._values[()] = self._initial()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._sample_lines(key, value) for key, value in items)
+        return "\n".join(line for line in lines if line)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _initial(self):
+        return 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _sample_lines(self, key, value):
+        return f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self):
+        """Drop every labelled sample, e.g. of workers that no longer exist."""
+        with self._lock:
+            self._values = {(): self._initial()} if not self.labelnames else {}
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _initial(self):
+        return [0] * (len(self.buckets) + 1), 0.0
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or self._initial()
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _sample_lines(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def exposition(self):
+        """All registered metrics in the Prometheus text format (version 0.0.4)."""
+        return "\n".join(m.expose() for m in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,281 @@
+"""
+Pool of pre-warmed map render workers for the Flask app.
+
+Each worker process runs map_render.warm_up() once (plotting imports, county
+geometry, base layer, layout), then serves render jobs and sends the image
+bytes back over the pool's pipe, together with the timing spans measured in
+the worker; a worker's first job also carries its cold-start spans. This
+replaces one `python v9_main_map.py` subprocess per request.
+
+Workers share what they can through the page cache: the rate cube is a
+memory map of the Arrow rate store and the county geometry arrays a memory map
+of the geometry store, so adding a worker mostly adds its private heap: GEOS
+geometries, Matplotlib state, up to MAP_BASE_LAYER_CACHE base layers (3 by
+default; 6 MB each at 100 dpi, 58 MB at 300 dpi) and up to MAP_MASTER_CACHE_MB
+of rendered masters (64 MB by default). Budget for those caches per worker. Every job also reports the
+worker's memory (render_metrics.process_memory()); worker_memory() has the
+latest figures per worker, which the app exposes at /metrics.
+
+Admission is bounded: at most MAP_RENDER_QUEUE jobs may be queued or running
+at once, and further renders fail fast with RenderQueueFull (HTTP 503) rather
+than piling up. SingleFlight lets concurrent requests for the same map share
+one render. A job that times out gets the whole pool replaced; the other jobs
+of that pool fail at once with RenderInterrupted (also HTTP 503) instead of
+each waiting out its own timeout for a result that will never come.
+
+The renderer keeps no global pyplot state, so the workers can also be threads
+of the app process (MAP_RENDER_MODE=thread): they share one copy of the
+geometry, data and base layers instead of one per process. Agg rasterization
+mostly holds the GIL, so processes still scale better across cores; threads
+trade some throughput for memory and start-up time.
+
+Configuration (environment variables):
+    MAP_RENDER_MODE      "process" (default) or "thread"
+    MAP_RENDER_WORKERS   number of worker processes or threads (default: CPU count, max 4)
+    MAP_RENDER_TIMEOUT   seconds to wait for a single render (default: 60)
+    MAP_RENDER_QUEUE     renders queued or running before new ones are refused
+                         (default: 4 per worker)
+"""
+import concurrent.futures
+import math
+import multiprocessing
+import multiprocessing.pool
+import os
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+from render_metrics import collect_spans, process_memory, record_spans, span
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_TIMEOUT = 60.0
+QUEUE_PER_WORKER = 4
+RENDER_MODES = ("process", "thread")
+
+
+class RenderTimeout(Exception):
+    """A render job did not finish within the configured timeout."""
+
+
+class RenderQueueFull(Exception):
+    """The render queue is at capacity; retry_after is a suggested wait in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RenderInterrupted(Exception):
+    """The job's worker pool was replaced before it finished; retry_after is a suggested wait in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# -------------------------------------------------------------------------
+# REQUEST COALESCING
+# -------------------------------------------------------------------------
+class SingleFlight:
+    """One call per key at a time; callers arriving meanwhile share its outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Return (fn's result, shared), where shared is True for callers that only waited."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+# -------------------------------------------------------------------------
+# WORKER SIDE
+# -------------------------------------------------------------------------
+def _init_worker():
+    import map_render
+    map_render.warm_up()
+
+
+def _render_job(year, race, dpi, fmt="png", width=None):
+    import map_render
+    with collect_spans() as spans:
+        data = map_render.render_map(year, race, fmt, dpi=dpi, width=width)
+    return data, spans, (os.getpid(), process_memory())
+
+
+# -------------------------------------------------------------------------
+# POOL
+# -------------------------------------------------------------------------
+def _settle(future, result=None, error=None):
+    """Resolve a job's future unless it already has an outcome (e.g. the pool was recycled)."""
+    try:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+    except InvalidStateError:
+        pass
+
+
+class RenderPool:
+    """Fixed-size pool of warm render processes (or threads, with mode="thread").
+
+    A job that exceeds `timeout` raises RenderTimeout; the pool is then
+    replaced so the stuck worker cannot hold on to its slot (a thread cannot
+    be killed, so in thread mode the stuck render only stops counting against
+    the pool). Terminating the pool loses the results of its other queued and
+    running jobs, so those raise RenderInterrupted right away. A render that
+    would take the number of queued and running jobs past `max_queue` raises
+    RenderQueueFull immediately.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, start_method="spawn", max_queue=None,
+                 mode="process"):
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode '{mode}' (use one of {', '.join(RENDER_MODES)})")
+        self.workers = max(1, int(workers))
+        self.timeout = float(timeout)
+        self.max_queue = max(1, int(max_queue or self.workers * QUEUE_PER_WORKER))
+        self.mode = mode
+        self._context = multiprocessing.get_context(start_method)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = 0
+        # Moving average of render time, used for Retry-After estimates
+        self._avg_seconds = 2.0
+        # Latest process_memory() of each worker process, by pid
+        self._memory = {}
+        # Result futures of the jobs submitted to the current pool
+        self._jobs = set()
+
+    def _get_pool(self):
+        with self._lock:
+            return self._current_pool()
+
+    def _current_pool(self):
+        if self._pool is None:
+            if self.mode == "thread":
+                self._pool = multiprocessing.pool.ThreadPool(self.workers, initializer=_init_worker)
+            else:
+                self._pool = self._context.Pool(processes=self.workers, initializer=_init_worker)
+        return self._pool
+
+    def _submit(self, args):
+        """Queue a job on the current pool; return (pool, future of its result)."""
+        future = Future()
+        with self._lock:
+            pool = self._current_pool()
+            self._jobs.add(future)
+            pool.apply_async(_render_job, args, callback=lambda result: _settle(future, result=result),
+                             error_callback=lambda error: _settle(future, error=error))
+        return pool, future
+
+    def _recycle(self, pool):
+        with self._lock:
+            if self._pool is not pool:
+                # Already replaced by another job's timeout
+                return
+            self._pool = None
+            self._memory.clear()
+            orphans, self._jobs = self._jobs, set()
+            retry_after = max(1, math.ceil(self._avg_seconds))
+        for future in orphans:
+            _settle(future, error=RenderInterrupted(
+                "A stuck render forced a restart of the render workers", retry_after))
+        pool.terminate()
+
+    def warm_up(self):
+        """Start the worker processes ahead of the first request."""
+        self._get_pool()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def worker_memory(self):
+        """{pid: process_memory()} of the current workers as of their latest job.
+
+        In thread mode the workers are the app process itself: one entry.
+        """
+        with self._lock:
+            return dict(self._memory)
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.max_queue:
+                # Time for the workers to drain the current queue
+                retry_after = max(1, math.ceil(self._avg_seconds * self._pending / self.workers))
+                raise RenderQueueFull(f"{self._pending} renders already queued or running", retry_after)
+            self._pending += 1
+
+    def _release(self, seconds=None):
+        with self._lock:
+            self._pending -= 1
+            if seconds is not None:
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * seconds
+
+    def render(self, year, race, dpi=100, fmt="png", width=None):
+        """Render one selection in a worker and return the image bytes (see map_render.render_map).
+
+        The worker's spans are added to the caller's collect_spans(), next to a
+        "worker_roundtrip" span for the whole job (queueing and transfer included).
+        """
+        self._admit()
+        seconds = None
+        future = None
+        try:
+            start = time.perf_counter()
+            with span("worker_roundtrip"):
+                pool, future = self._submit((int(year), race.upper(), dpi, fmt, width))
+                try:
+                    data, spans, (pid, memory) = future.result(timeout=self.timeout)
+                except concurrent.futures.TimeoutError:
+                    self._recycle(pool)
+                    raise RenderTimeout(f"Rendering {race}_{year} took longer than {self.timeout:g}s")
+            seconds = time.perf_counter() - start
+            with self._lock:
+                if self._pool is pool and memory is not None:
+                    self._memory[pid] = memory
+        finally:
+            if future is not None:
+                with self._lock:
+                    self._jobs.discard(future)
+            self._release(seconds)
+        record_spans(spans)
+        return data
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._memory.clear()
+            self._jobs.clear()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def pool_from_env():
+    return RenderPool(
+        workers=int(os.environ.get("MAP_RENDER_WORKERS", DEFAULT_WORKERS)),
+        timeout=float(os.environ.get("MAP_RENDER_TIMEOUT", DEFAULT_TIMEOUT)),
+        max_queue=int(os.environ.get("MAP_RENDER_QUEUE", 0)) or None,
+        mode=os.environ.get("MAP_RENDER_MODE", "process"),
+    )
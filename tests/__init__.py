@@ -0,0 +1,16 @@
+"""
+Unit tests for the map service modules.
+
+Run from the repository root (pytest puts it on sys.path, next to the flat
+modules under test):
+
+    python -m pytest -q tests
+
+The tests use small synthetic inputs in temporary directories (geometry comes
+from the synthetic fixture in benchmarks/data) and thread-mode render pools
+with stand-in jobs, so they need neither the county GeoJSON nor a render;
+only test_render_leaks draws real maps, a few dozen at 50 dpi. The
+long-running thread-safety check stays a command of its own:
+
+    python benchmarks/bench_pipeline.py soak --renders 2000 --threads 4
+"""
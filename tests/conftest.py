@@ -0,0 +1,9 @@
+import pytest
+
+import rate_store
+
+
+@pytest.fixture(autouse=True)
+def private_rate_store(tmp_path, monkeypatch):
+    """Keep the Arrow rate store of CSVs written by a test out of the repository."""
+    monkeypatch.setattr(rate_store, "RATE_STORE_PATH", str(tmp_path / "rates.arrow"))
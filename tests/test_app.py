@@ -0,0 +1,53 @@
+import pytest
+
+import app as map_app
+import geometry_store
+import render_service
+from render_cache import COUNTY_TYPE_FILE, REGION_SCHEME_FILE, RenderCache
+from render_service import RenderPool
+
+FIXTURE_GEOJSON = "benchmarks/data/synthetic-counties.geojson"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """The Flask app with a fresh geometry store and render cache, and a thread pool of stand-in renders.
+
+    The stand-in job loads the geometry store as a real worker does, which
+    builds the store if nothing built it before.
+    """
+    store_path = str(tmp_path / "store.npz")
+    monkeypatch.setattr(geometry_store, "GEOMETRY_STORE_PATH", store_path)
+    monkeypatch.setattr(geometry_store, "ILLINOIS_GEOJSON_PATH", FIXTURE_GEOJSON)
+    monkeypatch.setattr(geometry_store, "_STORE", None)
+    monkeypatch.setattr(map_app, "_geometry_meta", None)
+    monkeypatch.setattr(map_app, "render_cache", RenderCache(
+        str(tmp_path / "cache"), input_files=(COUNTY_TYPE_FILE, store_path, REGION_SCHEME_FILE)))
+
+    renders = []
+
+    def job(year, race, dpi, fmt="png", width=None):
+        geometry_store.get_geometry_store()
+        renders.append((year, race))
+        return b"map", [], (0, None)
+
+    monkeypatch.setattr(render_service, "_init_worker", lambda: None)
+    monkeypatch.setattr(render_service, "_render_job", job)
+    pool = RenderPool(workers=1, timeout=30, mode="thread")
+    monkeypatch.setattr(map_app, "_render_pool", pool)
+    try:
+        yield map_app.app.test_client(), renders
+    finally:
+        pool.close()
+
+
+def test_etag_is_the_same_before_and_after_the_first_render(client):
+    client, renders = client
+    first = client.get("/update_map?race=NHB")
+    second = client.get("/update_map?race=NHB")
+    assert first.status_code == second.status_code == 200
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert len(renders) == 1
+
+    revalidated = client.get("/update_map?race=NHB", headers={"If-None-Match": first.headers["ETag"]})
+    assert revalidated.status_code == 304
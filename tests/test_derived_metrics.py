@@ -0,0 +1,38 @@
+import json
+
+from derived_metrics import DerivedMetrics
+from rate_cube import RateCube
+
+# NHA's North rate is 0 in 2021, and so is NHW's Statewide rate in 2020
+RATES = """Group,Region,_2020,_2021,_2022
+NHA,North,4,0,5
+NHA,Statewide,6,7,8
+NHW,North,10,0,12
+NHW,Statewide,0,9,10
+"""
+TOTALS = """Group,Region,_2020,_2021,_2022
+NHA,Total,10,11,12
+NHW,Total,20,21,22
+"""
+
+
+def _metrics(tmp_path):
+    (tmp_path / "rates.csv").write_text(RATES)
+    (tmp_path / "totals.csv").write_text(TOTALS)
+    return DerivedMetrics(RateCube(str(tmp_path / "rates.csv"), str(tmp_path / "totals.csv")))
+
+
+def test_ratios_over_a_zero_rate_are_null(tmp_path):
+    rows = {(r["race"], r["region"], r["year"]): r for r in _metrics(tmp_path).records()}
+    assert rows["NHA", "North", 2022]["yoy_change"] == 5
+    assert rows["NHA", "North", 2022]["yoy_pct"] is None
+    assert rows["NHA", "North", 2021]["yoy_pct"] == -1
+    assert rows["NHA", "North", 2021]["disparity_vs_nhw"] is None
+    assert rows["NHA", "Statewide", 2020]["disparity_vs_nhw"] is None
+    assert rows["NHA", "North", 2020]["disparity_vs_nhw"] == 0.4
+
+
+def test_exports_carry_no_infinity(tmp_path):
+    metrics = _metrics(tmp_path)
+    json.dumps(metrics.records(), allow_nan=False)
+    assert b"inf" not in metrics.to_csv()
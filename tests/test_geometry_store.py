@@ -0,0 +1,64 @@
+import zipfile
+
+import numpy as np
+import pytest
+import shapely
+
+from geometry_store import ARRAY_ALIGN, _map_npz, _pack_geometries, _unpack_geometries, _write_aligned_npz
+
+
+def _arrays():
+    arrays = {
+        "meta": np.array('{"version": 3}'),
+        "names": np.array(["Adams", "Cook"]),
+        "cx": np.array([1.5, 2.5]),
+        "flag": np.array([1, 2, 3], dtype=np.uint8),
+        "grid": np.arange(12, dtype=np.int32).reshape(3, 4),
+    }
+    _pack_geometries("county", [shapely.box(0, 0, 1, 1), shapely.box(1, 0, 3, 2)], arrays)
+    return arrays
+
+
+@pytest.fixture
+def store_file(tmp_path):
+    path = tmp_path / "store.npz"
+    with open(path, "wb") as f:
+        _write_aligned_npz(f, _arrays())
+    return path
+
+
+def test_round_trip(store_file):
+    expected = _arrays()
+    mapped = _map_npz(str(store_file))
+    assert set(mapped) == set(expected)
+    for name, array in expected.items():
+        assert mapped[name].dtype == array.dtype
+        np.testing.assert_array_equal(mapped[name], array)
+    boxes = _unpack_geometries("county", mapped)
+    assert shapely.equals(boxes, [shapely.box(0, 0, 1, 1), shapely.box(1, 0, 3, 2)]).all()
+
+
+def test_members_are_uncompressed_and_aligned(store_file):
+    mapped = _map_npz(str(store_file))
+    with zipfile.ZipFile(store_file) as archive:
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist())
+    for name, array in mapped.items():
+        assert array.size == 0 or array.__array_interface__["data"][0] % ARRAY_ALIGN == 0, name
+
+
+def test_mapped_arrays_are_read_only(store_file):
+    mapped = _map_npz(str(store_file))
+    with pytest.raises(ValueError):
+        mapped["cx"][0] = 0
+
+
+def test_numpy_can_still_read_the_file(store_file):
+    with np.load(store_file) as data:
+        np.testing.assert_array_equal(data["grid"], _arrays()["grid"])
+
+
+def test_compressed_store_is_refused(tmp_path):
+    path = tmp_path / "old.npz"
+    np.savez_compressed(path, cx=np.array([1.0]))
+    with pytest.raises(ValueError):
+        _map_npz(str(path))
@@ -0,0 +1,42 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from image_encode import encode_image
+from map_render import DEFAULT_DPI, MASTER_DPIS, cache_key, map_options, snap_dpi
+
+
+class RecordingCache:
+    """Stands in for RenderCache: the key is the arguments it was built from."""
+
+    def key(self, year, race, ext="png", **options):
+        return (year, race, ext, tuple(sorted(options.items())))
+
+
+def test_dpi_snaps_up_to_a_master_resolution():
+    assert [snap_dpi(d) for d in (1, 50, 51, 100, 120, 299, 300, 600)] == [50, 50, 100, 100, 150, 300, 300, 300]
+    assert all(snap_dpi(d) == d for d in MASTER_DPIS)
+
+
+def test_map_options():
+    assert map_options() == (DEFAULT_DPI, None)
+    assert map_options("png", width=640) == (None, 640)
+    assert map_options("webp", dpi=120, width=640) == (150, 640)
+    # Formats Matplotlib saves have no pixel width
+    assert map_options("svg", width=640) == (DEFAULT_DPI, None)
+
+
+def test_equivalent_requests_share_a_cache_key():
+    cache = RecordingCache()
+    assert cache_key(cache, 2020, "NHB") == cache_key(cache, 2020, "NHB", "png", dpi=DEFAULT_DPI)
+    assert cache_key(cache, 2020, "NHB", dpi=120) == cache_key(cache, 2020, "NHB", dpi=150)
+    assert cache_key(cache, 2020, "NHB", "svg", dpi=140, width=500) == cache_key(cache, 2020, "NHB", "svg", dpi=150)
+    assert cache_key(cache, 2020, "NHB", "png") != cache_key(cache, 2020, "NHB", "webp")
+    assert cache_key(cache, 2020, "NHB", "png", width=640) != cache_key(cache, 2020, "NHB", "png")
+
+
+def test_encoded_maps_are_downscaled_but_never_upscaled():
+    pixels = np.full((50, 100, 4), 255, dtype=np.uint8)
+    assert Image.open(io.BytesIO(encode_image(pixels, "png", width=40))).size == (40, 20)
+    assert Image.open(io.BytesIO(encode_image(pixels, "webp", width=400))).size == (100, 50)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from rate_cube import RateCube, SchemaError
+
+RATES = """Group,Region,_2020,_2021
+Hisp,North,10.5,11
+NHB,North,20,
+NHB,Statewide,15,16
+Hisp,Statewide,9,8
+"""
+TOTALS = """Group,Region,_2020,_2021
+Hisp,Total,100,110
+NHB,Total,200,210
+"""
+
+
+def _cube(tmp_path, rates=RATES, totals=TOTALS):
+    (tmp_path / "rates.csv").write_text(rates)
+    (tmp_path / "totals.csv").write_text(totals)
+    return RateCube(str(tmp_path / "rates.csv"), str(tmp_path / "totals.csv"))
+
+
+def _schema_errors(tmp_path, **csvs):
+    with pytest.raises(SchemaError) as excinfo:
+        _cube(tmp_path, **csvs)
+    return excinfo.value
+
+
+def test_valid_csvs_load(tmp_path):
+    cube = _cube(tmp_path)
+    assert cube.years == [2020, 2021]
+    assert cube.races == ["HISP", "NHB"]
+    assert cube.rate("NHB", "north", 2020) == 20
+    assert np.isnan(cube.rate("NHB", "North", 2021))
+    assert cube.total_count("hisp", 2021) == 110
+    assert not cube.rates.flags.writeable
+
+
+def test_every_bad_cell_is_reported(tmp_path):
+    error = _schema_errors(tmp_path, rates=RATES + "NHW,North,abc,-1\n")
+    assert error.path.endswith("rates.csv")
+    assert len(error.errors) == 2
+    assert "not a number" in error.errors[0]
+    assert "negative value" in error.errors[1]
+
+
+def test_unexpected_and_missing_columns(tmp_path):
+    error = _schema_errors(tmp_path, rates="Group,Area,_2020\nNHB,North,1\n")
+    assert "unexpected column 'Area'" in error.errors
+    assert "missing column 'Region'" in error.errors
+
+
+def test_no_year_columns(tmp_path):
+    error = _schema_errors(tmp_path, rates="Group,Region\nNHB,North\n")
+    assert any("no year columns" in e for e in error.errors)
+
+
+def test_ragged_rows_and_duplicates(tmp_path):
+    assert "fields, expected" in _schema_errors(tmp_path, rates=RATES + "NHW,North,1\n").errors[0]
+    assert "more than one row" in _schema_errors(tmp_path, rates=RATES + "NHB,North,1,2\n").errors[0]
+
+
+def test_totals_need_every_race_and_year(tmp_path):
+    error = _schema_errors(tmp_path, totals="Group,Region,_2020\nHisp,Total,100\n")
+    assert error.path.endswith("totals.csv")
+    assert "no column for 2021" in error.errors
+    assert "no Total row for NHB" in error.errors
@@ -0,0 +1,84 @@
+import os
+
+from render_cache import RenderCache
+
+RATES = """Group,Region,_2020,_2021
+NHB,North,20,21
+NHB,Statewide,15,16
+NHW,North,10,11
+NHW,Statewide,5,6
+"""
+TOTALS = """Group,Region,_2020,_2021
+NHB,Total,200,210
+NHW,Total,100,110
+"""
+
+
+def _write(path, text, mtime_ns=None):
+    with open(path, "w") as f:
+        f.write(text)
+    if mtime_ns is not None:
+        # Changes within one mtime tick must still be seen
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def _cache(tmp_path, cache_dir="cache"):
+    inputs = [_write(tmp_path / "county_type.csv", "County,Urban_Rural\n"), _write(tmp_path / "b.json", "{}")]
+    data = [_write(tmp_path / "rates.csv", RATES), _write(tmp_path / "totals.csv", TOTALS)]
+    return RenderCache(cache_dir=str(tmp_path / cache_dir), input_files=inputs, data_files=data), inputs, data
+
+
+def test_key_is_stable_across_instances(tmp_path):
+    cache, _, _ = _cache(tmp_path)
+    other, _, _ = _cache(tmp_path, "other")
+    assert cache.key(2020, "NHB", "png", dpi=100) == other.key(2020, "nhb", "png", dpi=100)
+    # Option order does not matter
+    assert cache.key(2020, "NHB", "png", dpi=100, width=640) == cache.key(2020, "NHB", "png", width=640, dpi=100)
+
+
+def test_key_changes_with_selection_options_and_inputs(tmp_path):
+    cache, inputs, _ = _cache(tmp_path)
+    key = cache.key(2020, "NHB", "png", dpi=100)
+    assert key != cache.key(2021, "NHB", "png", dpi=100)
+    assert key != cache.key(2020, "NHW", "png", dpi=100)
+    assert key != cache.key(2020, "NHB", "webp", dpi=100)
+    assert key != cache.key(2020, "NHB", "png", dpi=150)
+
+    _write(inputs[1], '{"changed": true}', mtime_ns=1)
+    assert cache.key(2020, "NHB", "png", dpi=100) != key
+
+
+def test_key_only_follows_the_data_of_its_selection(tmp_path):
+    cache, _, (rates, totals) = _cache(tmp_path)
+    keys = {(y, r): cache.key(y, r) for y in (2020, 2021) for r in ("NHB", "NHW")}
+
+    # Another race's regional rate in 2021: only that map changes
+    _write(rates, RATES.replace("NHW,North,10,11", "NHW,North,10,12"), mtime_ns=1)
+    assert cache.key(2021, "NHW") != keys[2021, "NHW"]
+    assert [cache.key(y, r) for y, r in [(2020, "NHB"), (2021, "NHB"), (2020, "NHW")]] == \
+        [keys[2020, "NHB"], keys[2021, "NHB"], keys[2020, "NHW"]]
+
+    # A statewide rate is drawn on every race's map of that year
+    _write(rates, RATES.replace("NHW,Statewide,5,6", "NHW,Statewide,7,6"), mtime_ns=2)
+    assert cache.key(2020, "NHB") != keys[2020, "NHB"]
+    assert cache.key(2021, "NHB") == keys[2021, "NHB"]
+
+    # Total count of one race and year
+    _write(rates, RATES, mtime_ns=3)
+    _write(totals, TOTALS.replace("NHB,Total,200,210", "NHB,Total,200,211"), mtime_ns=3)
+    assert cache.key(2021, "NHB") != keys[2021, "NHB"]
+    assert cache.key(2021, "NHW") == keys[2021, "NHW"]
+
+
+def test_put_get_and_eviction(tmp_path):
+    cache, _, _ = _cache(tmp_path)
+    cache.max_bytes = 10
+    first, second = cache.key(2020, "NHB"), cache.key(2021, "NHB")
+    cache.put(first, b"123456")
+    assert cache.get(first) == b"123456"
+    os.utime(cache._path(first, "png"), ns=(1, 1))
+    cache.put(second, b"abcdef")
+    # Over budget: the least recently used entry goes
+    assert cache.get(first) is None
+    assert cache.get(second) == b"abcdef"
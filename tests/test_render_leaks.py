@@ -0,0 +1,48 @@
+import gc
+import itertools
+
+import matplotlib.pyplot as plt
+import pytest
+from matplotlib.figure import Figure
+
+import geometry_store
+import map_render
+from render_metrics import process_memory
+
+FIXTURE_GEOJSON = "benchmarks/data/synthetic-counties.geojson"
+RENDERS = 20
+# Loose bound on RSS growth over RENDERS renders after warm-up; a leaked
+# figure per render (a few MB each at 50 dpi) would blow it
+MAX_RSS_GROWTH = 64 * 1024 * 1024
+
+
+def _live_figures():
+    gc.collect()
+    return sum(isinstance(obj, Figure) for obj in gc.get_objects())
+
+
+@pytest.fixture
+def renderer(tmp_path, monkeypatch):
+    """map_render on a geometry store built from the synthetic fixture, with no master cache."""
+    monkeypatch.setattr(geometry_store, "GEOMETRY_STORE_PATH", str(tmp_path / "store.npz"))
+    monkeypatch.setattr(geometry_store, "ILLINOIS_GEOJSON_PATH", FIXTURE_GEOJSON)
+    monkeypatch.setattr(geometry_store, "_STORE", None)
+    # Every render must draw a figure, not reuse a cached master
+    monkeypatch.setattr(map_render, "MASTER_CACHE_BYTES", 0)
+    return map_render
+
+
+def test_repeated_renders_leak_no_figures_or_memory(renderer):
+    cube = renderer._load_renderer().get_rate_cube()
+    selections = [(year, race) for year in cube.years[-2:] for race in ("NHB", "NHW") if cube.has(race, year)]
+    for year, race in selections:
+        renderer.render_map(year, race, dpi=50)
+    figures, rss = _live_figures(), process_memory()["rss"]
+
+    for year, race in itertools.islice(itertools.cycle(selections), RENDERS):
+        renderer.render_map(year, race, dpi=50)
+
+    # The renderer never registers figures with pyplot, and drops the ones it draws
+    assert plt.get_fignums() == []
+    assert _live_figures() <= figures
+    assert process_memory()["rss"] - rss < MAX_RSS_GROWTH
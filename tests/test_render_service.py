@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+import render_service
+from render_service import RenderInterrupted, RenderPool, RenderQueueFull, RenderTimeout, SingleFlight
+
+
+# -------------------------------------------------------------------------
+# SingleFlight
+# -------------------------------------------------------------------------
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "image"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("k", slow)))
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do("k", slow))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    # Followers are waiting on the leader's call
+    time.sleep(0.05)
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [("image", False)] + [("image", True)] * 3
+
+
+def test_single_flight_shares_errors_and_forgets_finished_calls():
+    flights = SingleFlight()
+    with pytest.raises(KeyError):
+        flights.do("k", lambda: {}["missing"])
+    assert flights.do("k", lambda: 42) == (42, False)
+
+
+# -------------------------------------------------------------------------
+# RenderPool (thread mode, with a stand-in job instead of a real render)
+# -------------------------------------------------------------------------
+@pytest.fixture
+def blocking_jobs(monkeypatch):
+    """Make pool jobs wait for `release` (the returned event) instead of rendering."""
+    release = threading.Event()
+
+    def job(year, race, dpi, fmt="png", width=None):
+        release.wait(10)
+        return f"{race}_{year}".encode(), [("stub", 0.0)], (0, None)
+
+    monkeypatch.setattr(render_service, "_init_worker", lambda: None)
+    monkeypatch.setattr(render_service, "_render_job", job)
+    yield release
+    release.set()
+
+
+def _render_in_thread(pool, year, outcomes):
+    def run():
+        try:
+            outcomes.append(pool.render(year, "NHB"))
+        except Exception as e:
+            outcomes.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_render_returns_job_result(blocking_jobs):
+    blocking_jobs.set()
+    pool = RenderPool(workers=1, timeout=5, mode="thread")
+    try:
+        assert pool.render(2020, "nhb") == b"NHB_2020"
+        assert pool.pending == 0
+    finally:
+        pool.close()
+
+
+def test_render_refuses_work_beyond_queue_bound(blocking_jobs):
+    pool = RenderPool(workers=1, timeout=5, max_queue=2, mode="thread")
+    outcomes = []
+    try:
+        threads = [_render_in_thread(pool, year, outcomes) for year in (2020, 2021)]
+        deadline = time.monotonic() + 5
+        while pool.pending < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with pytest.raises(RenderQueueFull) as excinfo:
+            pool.render(2022, "NHB")
+        assert excinfo.value.retry_after >= 1
+
+        blocking_jobs.set()
+        for t in threads:
+            t.join(5)
+        assert sorted(outcomes) == [b"NHB_2020", b"NHB_2021"]
+        assert pool.pending == 0
+    finally:
+        pool.close()
+
+
+def test_render_times_out_and_replaces_the_pool(blocking_jobs):
+    pool = RenderPool(workers=1, timeout=0.2, mode="thread")
+    try:
+        with pytest.raises(RenderTimeout):
+            pool.render(2020, "NHB")
+        assert pool.pending == 0
+        assert pool._pool is None
+
+        blocking_jobs.set()
+        assert pool.render(2021, "NHB") == b"NHB_2021"
+    finally:
+        pool.close()
+
+
+def test_timeout_fails_the_other_jobs_of_the_pool_at_once(blocking_jobs):
+    pool = RenderPool(workers=2, timeout=1.0, mode="thread")
+    outcomes, started = [], time.perf_counter()
+    try:
+        stuck = _render_in_thread(pool, 2020, outcomes)
+        time.sleep(0.5)
+        # Submitted half a timeout later: it must not wait out a timeout of its own
+        other = _render_in_thread(pool, 2021, outcomes)
+        other.join(5)
+        stuck.join(5)
+        elapsed = time.perf_counter() - started
+
+        assert any(isinstance(o, RenderTimeout) for o in outcomes)
+        interrupted = [o for o in outcomes if isinstance(o, RenderInterrupted)]
+        assert len(interrupted) == 1 and interrupted[0].retry_after >= 1
+        assert elapsed < 1.4
+        assert pool.pending == 0
+    finally:
+        pool.close()
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        RenderPool(mode="fiber")
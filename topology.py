@@ -0,0 +1,164 @@
+"""
+Quantized TopoJSON encoding of the county coverage.
+
+Coordinates are snapped to a quantization x quantization integer grid, every
+ring is cut into arcs at the points where neighbouring rings diverge, and each
+arc is stored once: a border shared by two counties (or by a county and the
+state outline) is referenced by both, reversed where needed. Arcs are
+delta-encoded, as in the TopoJSON specification:
+
+    https://github.com/topojson/topojson-specification
+
+Only NumPy and shapely are used; the result is a plain dict ready for
+json.dumps() and decodes with topojson-client's feature()/mesh().
+"""
+import numpy as np
+import shapely
+
+DEFAULT_QUANTIZATION = 10_000
+
+
+def _rings(polygon):
+    return [polygon.exterior] + list(polygon.interiors)
+
+
+def _parts(geom):
+    """Polygons of a Polygon/MultiPolygon (empty geometries have none)."""
+    if geom is None or geom.is_empty:
+        return []
+    return list(geom.geoms) if geom.geom_type == "MultiPolygon" else [geom]
+
+
+def _canonical(ring):
+    """Rotation of an open ring that starts at its smallest point."""
+    start = min(range(len(ring)), key=ring.__getitem__)
+    return tuple(ring[start:] + ring[:start])
+
+
+class _ArcIndex:
+    """Cuts quantized rings into arcs and stores every distinct arc once."""
+
+    def __init__(self):
+        self.arcs = []
+        self._open = {}
+        self._closed = {}
+
+    @staticmethod
+    def junctions(rings):
+        """Points whose neighbours differ between the rings that pass through them."""
+        neighbours = {}
+        junctions = set()
+        for ring in rings:
+            n = len(ring)
+            for i, point in enumerate(ring):
+                pair = frozenset((ring[i - 1], ring[(i + 1) % n]))
+                seen = neighbours.setdefault(point, pair)
+                if seen != pair:
+                    junctions.add(point)
+        return junctions
+
+    def _add_open(self, arc):
+        arc = tuple(arc)
+        index = self._open.get(arc)
+        if index is not None:
+            return index
+        index = self._open.get(arc[::-1])
+        if index is not None:
+            return ~index
+        self._open[arc] = len(self.arcs)
+        self.arcs.append(arc)
+        return len(self.arcs) - 1
+
+    def _add_closed(self, ring):
+        # Closed rings without junctions (islands, enclaves) match in any rotation
+        forward, backward = _canonical(ring), _canonical(ring[::-1])
+        if forward in self._closed:
+            return self._closed[forward]
+        if backward in self._closed:
+            return ~self._closed[backward]
+        self._closed[forward] = len(self.arcs)
+        self.arcs.append(forward + forward[:1])
+        return len(self.arcs) - 1
+
+    def add_ring(self, ring, junctions):
+        """Arc references of one open ring (no repeated closing point)."""
+        cuts = [i for i, point in enumerate(ring) if point in junctions]
+        if not cuts:
+            return [self._add_closed(ring)]
+        start = cuts[0]
+        ring = ring[start:] + ring[:start]
+        cuts = [i - start for i in cuts] + [len(ring)]
+        ring = ring + ring[:1]
+        return [self._add_open(ring[a:b + 1]) for a, b in zip(cuts[:-1], cuts[1:])]
+
+
+def _quantize_ring(ring, x0, y0, kx, ky):
+    coords = np.asarray(ring.coords)[:-1]
+    q = np.column_stack((np.round((coords[:, 0] - x0) / kx), np.round((coords[:, 1] - y0) / ky))).astype(int)
+    # Drop points that collapse onto their predecessor after snapping
+    keep = np.any(q != np.roll(q, 1, axis=0), axis=1)
+    return [tuple(p) for p in q[keep].tolist()]
+
+
+def _quantize_polygons(geom, x0, y0, kx, ky):
+    """Quantized rings of every polygon part; parts that snap to nothing are dropped."""
+    polygons = []
+    for polygon in _parts(geom):
+        rings = [_quantize_ring(ring, x0, y0, kx, ky) for ring in _rings(polygon)]
+        if len(rings[0]) >= 3:
+            polygons.append([rings[0]] + [r for r in rings[1:] if len(r) >= 3])
+    return polygons
+
+
+def _delta_encode(arc):
+    a = np.asarray(arc)
+    return np.vstack((a[:1], np.diff(a, axis=0))).tolist()
+
+
+def encode_topology(layers, quantization=DEFAULT_QUANTIZATION):
+    """TopoJSON dict of {object name: (geometries, properties)} layers.
+
+    Polygons are oriented with clockwise exteriors, the winding d3-geo expects.
+    """
+    layers = {
+        name: (shapely.orient_polygons(np.asarray(list(geoms), dtype=object), exterior_cw=True), props)
+        for name, (geoms, props) in layers.items()
+    }
+    every = np.concatenate([geoms for geoms, _ in layers.values()])
+    x0, y0, x1, y1 = shapely.total_bounds(every)
+    kx = (x1 - x0) / (quantization - 1) or 1.0
+    ky = (y1 - y0) / (quantization - 1) or 1.0
+
+    # Quantize every ring first: junctions are found across all layers at once
+    quantized = {
+        name: [_quantize_polygons(geom, x0, y0, kx, ky) for geom in geoms]
+        for name, (geoms, _) in layers.items()
+    }
+    junctions = _ArcIndex.junctions(
+        ring for geoms in quantized.values() for polys in geoms for rings in polys for ring in rings
+    )
+
+    index = _ArcIndex()
+    objects = {}
+    for name, (geoms, props) in layers.items():
+        geometries = []
+        for polys, properties in zip(quantized[name], props):
+            polys = [[index.add_ring(ring, junctions) for ring in rings] for rings in polys]
+            if not polys:
+                geometry = {"type": None}
+            elif len(polys) == 1:
+                geometry = {"type": "Polygon", "arcs": polys[0]}
+            else:
+                geometry = {"type": "MultiPolygon", "arcs": polys}
+            if properties:
+                geometry["properties"] = properties
+            geometries.append(geometry)
+        objects[name] = {"type": "GeometryCollection", "geometries": geometries}
+
+    return {
+        "type": "Topology",
+        "bbox": [float(x0), float(y0), float(x1), float(y1)],
+        "transform": {"scale": [float(kx), float(ky)], "translate": [float(x0), float(y0)]},
+        "objects": objects,
+        "arcs": [_delta_encode(arc) for arc in index.arcs],
+    }
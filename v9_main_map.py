@@ -1,368 +1,404 @@
 import geopandas as gpd
-import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from matplotlib.patches import Patch
 from matplotlib.lines import Line2D
 from matplotlib.patheffects import withStroke
 from matplotlib.table import Table
-from shapely.ops import unary_union
 from matplotlib.offsetbox import OffsetImage, AnnotationBbox
+from matplotlib.image import BboxImage, imread
+from matplotlib.collections import PathCollection
+from matplotlib.font_manager import FontProperties
+from matplotlib.textpath import TextPath, text_to_path
+from matplotlib.transforms import Affine2D, Bbox, TransformedBbox
 import matplotlib.patches as patches
 import numpy as np
-import streamlit as st
+import shapely
+import io
 import os
+import threading
+from collections import OrderedDict
+
+from geometry_store import get_geometry_store
+from rate_cube import get_rate_cube
+from regions import load_region_scheme
+from render_metrics import span
 
 # -------------------------------------------------------------------------
-# 1) PARAMETERS (Updated for Streamlit)
+# 1) PARAMETERS (shared by every render)
 # -------------------------------------------------------------------------
-def plot_illinois_map():
-    # Pull the selected values from Streamlit session state
-    PARAM_YEAR = st.session_state.selected_year
-    PARAM_RACE = st.session_state.selected_race
-
-    # Paths and URLs
-    CSV_PATH = "Asthma_regional_data.csv"
-    COUNTY_TYPE_CSV = "county_type.csv"
-    ILLINOIS_GEOJSON_URL = "https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/illinois-counties.geojson"
-    TOTAL_COUNT_CSV = "total_count_per_race_ethnicity.csv"
-    # For Streamlit Cloud deployment consider using a hosted URL; local paths may fail
-    IDPH_LOGO_PATH = "static/maps/IDPH_logo.png"
-
-    # Define color for each race group
-    dynamic_line_color = {
-        "NHB": "#FF8C00",
-        "NHW": "#377EB8",
-        "NHA": "#4DAF4A",
-        "HISP": "#984EA3"
-    }
-    LINE_COLOR = dynamic_line_color[PARAM_RACE.upper()]
+# Paths
+CSV_PATH = "Asthma_regional_data.csv"
+TOTAL_COUNT_CSV = "total_count_per_race_ethnicity.csv"
+# For Streamlit Cloud deployment consider using a hosted URL; local paths may fail
+IDPH_LOGO_PATH = "static/maps/IDPH_logo.png"
+
+# Output size; front ends pass their own DPI (see map_render.render_map)
+FIGSIZE = (16, 10)
+DPI = 100
+# Base layers kept per process, least recently used dropped first. Each is the
+# RGBA raster of the whole figure: 6 MB at 100 dpi, 58 MB at 300 dpi.
+BASE_LAYER_CACHE_ENTRIES = int(os.environ.get("MAP_BASE_LAYER_CACHE", 3))
+
+# County labels: font size (pt) and offset of the urban/rural marker below them.
+# Below LABEL_DECIMATION_BELOW_PX of figure width, labels that do not fit inside
+# their county are dropped (they would only overlap into an unreadable blur).
+COUNTY_LABEL_FONTSIZE = 6
+MARKER_OFFSET = 5000
+LABEL_DECIMATION_BELOW_PX = 1200
+
+# Formats saved as vector graphics: their base map is drawn as vector artists
+# at full resolution instead of being pasted in as the cached raster
+VECTOR_FORMATS = ("svg", "pdf", "eps", "ps")
+
+# Define color for each race group
+dynamic_line_color = {
+    "NHB": "#FF8C00",
+    "NHW": "#377EB8",
+    "NHA": "#4DAF4A",
+    "HISP": "#984EA3"
+}
+
+race_descriptions = {
+    "NHB": "Non-Hispanic Black",
+    "NHW": "Non-Hispanic White",
+    "NHA": "Non-Hispanic Asian",
+    "HISP": "Hispanic"
+}
+
 
-    # -------------------------------------------------------------------------
-    # 2) READ & PREPARE THE ASTHMA DATA
-    # -------------------------------------------------------------------------
-    df = pd.read_csv(CSV_PATH)
-    rename_map = {
-        "Group": "Race",
-        "_2016": "2016", "_2017": "2017", "_2018": "2018",
-        "_2019": "2019", "_2020": "2020", "_2021": "2021",
-        "_2022": "2022", "_2023": "2023"
-    }
-    df = df.rename(columns=rename_map)
-
-    year_cols = ["2016", "2017", "2018", "2019", "2020", "2021", "2022", "2023"]
-    df_melted = df.melt(
-        id_vars=["Race", "Region"],
-        value_vars=year_cols,
-        var_name="Year",
-        value_name="Rate"
-    )
-    df_melted["Year"] = df_melted["Year"].astype(int)
-
-    df_filtered = df_melted[
-        (df_melted["Year"] == PARAM_YEAR) &
-        (df_melted["Race"].str.upper() == PARAM_RACE.upper())
-    ]
-
-    if df_filtered.empty:
-        st.error(f"No data found for Race={PARAM_RACE}, Year={PARAM_YEAR}")
-        return
-
-    # Prepare table data
-    table_data = [[PARAM_RACE.upper()]]
-    for _, row in df_filtered.iterrows():
-        table_data.append([f"{row['Region']}, {row['Rate']}"])
-
-    # Sort table rows in descending order by Rate
-    parsed = []
-    for row in table_data[1:]:
-        region, val = row[0].split(",", 1)
-        parsed.append((region.strip(), float(val.strip())))
-    parsed.sort(key=lambda x: x[1], reverse=True)
-    table_data = [table_data[0]] + [[f"{r}, {v}"] for (r, v) in parsed]
-
-    # Read total counts for the selected year
-    df_total_counts = pd.read_csv(TOTAL_COUNT_CSV).rename(columns=rename_map)
-    total_row = df_total_counts[
-        (df_total_counts["Race"].str.upper() == PARAM_RACE.upper()) &
-        (df_total_counts["Region"].str.upper() == "TOTAL")
-    ]
-    TOTAL_COUNT = int(total_row[str(PARAM_YEAR)].iloc[0])
+
+# -------------------------------------------------------------------------
+# 2) READ & PREPARE THE ASTHMA DATA
+# -------------------------------------------------------------------------
+def prepare_map_data(PARAM_YEAR, PARAM_RACE, cube=None):
+    """Return (table_data, TOTAL_COUNT, circle_dict), or None if there is no data."""
+    cube = cube or get_rate_cube(CSV_PATH, TOTAL_COUNT_CSV)
+    if not cube.has(PARAM_RACE, PARAM_YEAR):
+        return None
+
+    # Table rows sorted in descending order by Rate
+    table_data = [[PARAM_RACE.upper()]] + [[f"{r}, {v}"] for (r, v) in cube.ranked(PARAM_RACE, PARAM_YEAR)]
+
+    # Total counts for the selected year
+    TOTAL_COUNT = cube.total_count(PARAM_RACE, PARAM_YEAR)
 
     # -------------------------------------------------------------------------
     # 3) BUILD THE CIRCLE VALUES
     # -------------------------------------------------------------------------
     valid_circle_races = ["NHB", "NHW", "NHA", "HISP"]
-    df_circle = df_melted[
-        (df_melted["Year"] == PARAM_YEAR) &
-        (df_melted["Region"].str.lower() == "statewide")
-    ]
-    circle_dict = {}
-    for rc in valid_circle_races:
-        row_rc = df_circle[df_circle["Race"].str.upper() == rc]
-        if not row_rc.empty:
-            circle_dict[rc] = str(row_rc["Rate"].iloc[0])
-
-    selected_year = PARAM_YEAR
+    statewide = cube.statewide_by_race(PARAM_YEAR)
+    circle_dict = {rc: str(statewide[rc]) for rc in valid_circle_races if rc in statewide}
 
-    # -------------------------------------------------------------------------
-    # 4) READ & PREPARE GEOGRAPHY
-    # -------------------------------------------------------------------------
-    illinois = gpd.read_file(ILLINOIS_GEOJSON_URL).to_crs(epsg=26971)
-    state_boundary = illinois.dissolve()
-    df_county_type = pd.read_csv(COUNTY_TYPE_CSV)
-    illinois = illinois.merge(df_county_type, left_on="name", right_on="County", how="left")
-
-    regions = {
-        "NORTH": ["Boone", "Carroll", "Dekalb", "Jo Daviess", "Lee", "Ogle",
-                  "Stephenson", "Whiteside", "Winnebago"],
-        "NORTH-CENTRAL": ["Bureau", "Fulton", "Grundy", "Henderson", "Henry",
-                          "Kendall", "Knox", "Lasalle", "Livingston", "Marshall",
-                          "Mcdonough", "Mclean", "Mercer", "Peoria", "Putnam",
-                          "Rock Island", "Stark", "Tazewell", "Warren", "Woodford"],
-        "WEST-CENTRAL": ["Adams", "Brown", "Calhoun", "Cass", "Christian",
-                         "Greene", "Hancock", "Jersey", "Logan", "Macoupin",
-                         "Mason", "Menard", "Montgomery", "Morgan", "Pike",
-                         "Sangamon", "Schuyler", "Scott"],
-        "METRO EAST": ["Bond", "Clinton", "Madison", "Monroe", "Randolph",
-                       "St. Clair", "Washington"],
-        "SOUTHERN": ["Alexander", "Edwards", "Franklin", "Gallatin", "Hamilton",
-                     "Hardin", "Jackson", "Jefferson", "Johnson", "Marion",
-                     "Massac", "Perry", "Pope", "Pulaski", "Saline", "Union",
-                     "Wabash", "Wayne", "White", "Williamson"],
-        "EAST-CENTRAL": ["Champaign", "Clark", "Clay", "Coles", "Crawford",
-                         "Cumberland", "Dewitt", "Douglas", "Edgar", "Effingham",
-                         "Fayette", "Ford", "Iroquois", "Jasper", "Lawrence",
-                         "Macon", "Moultrie", "Piatt", "Richland", "Shelby",
-                         "Vermilion"],
-        "SOUTH SUBURBAN": ["Kankakee", "Will"],
-        "WEST SUBURBAN": ["Dupage", "Kane"],
-        "NORTH SUBURBAN": ["Lake", "Mchenry"],
-        "COOK": ["Cook"]
-    }
+    return table_data, TOTAL_COUNT, circle_dict
 
-    region_colors = {
-        "NORTH": (102/255, 205/255, 170/255),
-        "NORTH-CENTRAL": (255/255, 206/255, 250/255),
-        "WEST-CENTRAL": (245/255, 245/255, 220/255),
-        "METRO EAST": (255/255, 160/255, 122/255),
-        "SOUTHERN": (195/255, 243/255, 253/255),
-        "EAST-CENTRAL": (255/255, 215/255, 0/255),
-        "SOUTH SUBURBAN": (102/255, 255/255, 102/255),
-        "WEST SUBURBAN": (255/255, 0/255, 0/255),
-        "NORTH SUBURBAN": (211/255, 211/255, 211/255),
-        "COOK": (255/255, 255/255, 255/255)
-    }
 
-    # Assign each county to a region
-    illinois["Region"] = "Other"
-    for region_name, county_list in regions.items():
-        illinois.loc[illinois["name"].isin(county_list), "Region"] = region_name
-    illinois["color"] = illinois["Region"].map(region_colors)
+# -------------------------------------------------------------------------
+# 4) READ & PREPARE GEOGRAPHY
+# -------------------------------------------------------------------------
+def prepare_geography(geo=None, scheme=None):
+    """Counties (pre-projected, joined with county_type.csv) colored by region.
+
+    geo selects a level of detail of the geometry store (default: full resolution),
+    scheme a region definition file (default: regions.REGION_SCHEME_PATH).
+    """
+    geo = geo or get_geometry_store()
+    scheme = scheme or load_region_scheme()
+    illinois = geo.counties.copy()
+
+    # Region of each county, from the scheme's cached county -> region index
+    illinois["Region"] = geo.county_regions(scheme)
+    illinois["Region"] = illinois["Region"].fillna("Other")
+    illinois["color"] = illinois["Region"].map(scheme.colors)
+    return illinois
+
+
+# Region labels (anchors come from the region definition file) are not drawn
+# (they showed up as unwanted numbers)
+# for region_name, (x, y, label) in load_region_scheme().labels.items():
+#     ax.text(
+#         x, y, str(label),
+#         fontsize=12, ha='center', va='center',
+#         color='white', fontweight='bold',
+#         path_effects=[withStroke(linewidth=3, foreground="black")]
+#     )
 
-    # Updated sources text (ensure it is defined)
-    sources_text = f"""Sources
-+ Population: Census Data, {PARAM_YEAR}
-+ Asthma Count: Hospital Discharge Data, {PARAM_YEAR}
-+ Region: https://graphics.chicagotribune.com/
-  illinois-tier-mitigations/map-blurb.html"""
 
-    # Define region_labels (we still define them but do not draw them)
-    region_labels = {
-        "NORTH": (250000, 4600000, 1),
-        "NORTH-CENTRAL": (350000, 4400000, 2),
-        "WEST-CENTRAL": (200000, 4200000, 3),
-        "METRO EAST": (700000, 4100000, 4),
-        "SOUTHERN": (500000, 3900000, 5),
-        "EAST-CENTRAL": (500000, 4400000, 6),
-        "SOUTH SUBURBAN": (800000, 4500000, 7),
-        "WEST SUBURBAN": (900000, 4600000, 8),
-        "NORTH SUBURBAN": (950000, 4700000, 9),
-        "COOK": (1050000, 4600000, 10)
+# -------------------------------------------------------------------------
+# 5) HELPER FUNCTIONS
+# -------------------------------------------------------------------------
+def add_image(ax, image_path, position, zoom):
+    img = imread(image_path)
+    imagebox = OffsetImage(img, zoom=zoom)
+    ab = AnnotationBbox(imagebox, position, frameon=False, xycoords='axes fraction')
+    ax.add_artist(ab)
+
+def add_illinois_outline(fig, boundary_gdf, position, zoom, line_color):
+    inset_ax = fig.add_axes([position[0], position[1], zoom, zoom], zorder=1)
+    boundary_gdf.boundary.plot(ax=inset_ax, linewidth=2, edgecolor=line_color)
+    inset_ax.axis('off')
+
+def metres_per_pixel(fig, width, height, bounds):
+    """Map scale when `bounds` is fit (equal aspect) into width x height figure fractions."""
+    minx, miny, maxx, maxy = bounds
+    width_px = width * fig.get_figwidth() * fig.dpi
+    height_px = height * fig.get_figheight() * fig.dpi
+    return max((maxx - minx) / width_px, (maxy - miny) / height_px)
+
+def draw_circle_with_cord(ax, center_x, center_y, radius, value, cord_x, cord_y, line_color, label="", highlight=False):
+    angle = np.arctan2(cord_y - center_y, cord_x - center_x)
+    contact_x = center_x + radius * np.cos(angle)
+    contact_y = center_y + radius * np.sin(angle)
+    circle = patches.Circle((center_x, center_y), radius, color=line_color, fill=False, linewidth=1.5)
+    ax.add_patch(circle)
+    ax.text(center_x, center_y, value, ha="center", va="center", fontsize=9)
+    text_props = {'ha': "center", 'va': "center", 'fontsize': 9}
+    if highlight:
+        ax.text(cord_x, cord_y + 0.15, label.upper(), **text_props, fontweight="bold")
+    else:
+        ax.text(cord_x, cord_y + 0.1, label.upper(), **text_props)
+    ax.plot([cord_x, contact_x], [cord_y, contact_y], color=line_color, linewidth=1)
+
+def draw_complete_diagram(fig, position, circle_dict, PARAM_RACE, selected_year, line_color):
+    diagram_ax = fig.add_axes(position, zorder=1)
+    diagram_ax.axis("off")
+    edge_length_factor = 0.8
+    base_length = 1.8
+    length = base_length * edge_length_factor
+    angle = 60
+    y_offset = 1.5
+    vertical_line_length = 1.6
+    circle_radius = 0.14
+    fan_count = 8
+    fan_angle = 120
+    scale_factor = 0.78
+
+    x_left = -length * np.cos(np.radians(angle / 2))
+    y_left = length * np.sin(np.radians(angle / 2)) + y_offset
+    x_right = length * np.cos(np.radians(angle / 2))
+    y_right = length * np.sin(np.radians(angle / 2)) + y_offset
+    apex_x, apex_y = 0, y_offset
+    vertical_x, vertical_y = apex_x, apex_y - vertical_line_length
+
+    diagram_ax.plot([x_left, apex_x], [y_left, apex_y], color=line_color, linewidth=2)
+    diagram_ax.plot([apex_x, x_right], [apex_y, y_right], color=line_color, linewidth=2)
+    diagram_ax.plot([vertical_x, vertical_x], [apex_y, vertical_y], color=line_color, linewidth=2)
+
+    for i in range(fan_count):
+        angle_offset = -fan_angle / 2 + i * (fan_angle / (fan_count - 1))
+        x_fan = vertical_x + 0.3 * np.sin(np.radians(angle_offset))
+        y_fan = vertical_y - 0.3 * np.cos(np.radians(angle_offset))
+        diagram_ax.plot([vertical_x, x_fan], [vertical_y, y_fan], color=line_color, linewidth=1)
+
+    val_nhb = circle_dict["NHB"]
+    val_nhw = circle_dict["NHW"]
+    val_nha = circle_dict["NHA"]
+    val_hisp = circle_dict["HISP"]
+
+    draw_circle_with_cord(
+        diagram_ax,
+        (x_left+apex_x)/2,
+        (y_left+apex_y)/2 - 0.3,
+        circle_radius,
+        val_nhb,
+        (x_left+apex_x)/2,
+        (y_left+apex_y+0.03)/2,
+        line_color,
+        "NHB",
+        PARAM_RACE=="NHB"
+    )
+    draw_circle_with_cord(
+        diagram_ax,
+        (x_left+apex_x*2)/3,
+        (y_left+apex_y*2)/3 - 0.4,
+        circle_radius,
+        val_nhw,
+        (x_left+apex_x*2)/3,
+        (y_left+apex_y*2)/3,
+        line_color,
+        "NHW",
+        PARAM_RACE=="NHW"
+    )
+    draw_circle_with_cord(
+        diagram_ax,
+        (x_right+apex_x)/2,
+        (y_right+apex_y)/2 - 0.3,
+        circle_radius,
+        val_nha,
+        (x_right+apex_x)/2,
+        (y_right+apex_y)/2,
+        line_color,
+        "NHA",
+        PARAM_RACE=="NHA"
+    )
+    draw_circle_with_cord(
+        diagram_ax,
+        (x_right+apex_x*2)/3,
+        (y_right+apex_y*2)/3 - 0.4,
+        circle_radius,
+        val_hisp,
+        (x_right+apex_x*2)/3,
+        (y_right+apex_y*2)/3,
+        line_color,
+        "HISP",
+        PARAM_RACE=="HISP"
+    )
+
+    legend_items = {
+        "NHA": "Non-Hispanic Asian",
+        "NHB": "Non-Hispanic Black",
+        "NHW": "Non-Hispanic White",
+        "HISP": "Hispanic"
     }
+    y_legend_start = vertical_y + 0.6
+    line_spacing = 0.3
+
+    for i, (rc, desc) in enumerate(legend_items.items()):
+        txt_line = f"{rc} = {desc}"
+        diagram_ax.text(
+            apex_x + 1,
+            y_legend_start - i*line_spacing,
+            txt_line,
+            fontsize=9,
+            ha="center",
+            fontweight="bold" if rc==PARAM_RACE else "normal"
+        )
 
-    # Comment out the loop that draws region labels to remove the unwanted numbers
-    # for region_name, (x, y, label) in region_labels.items():
-    #     ax.text(
-    #         x, y, str(label),
-    #         fontsize=12, ha='center', va='center',
-    #         color='white', fontweight='bold',
-    #         path_effects=[withStroke(linewidth=3, foreground="black")]
-    #     )
+    diagram_ax.set_xlim(-length*scale_factor, length*scale_factor)
+    diagram_ax.set_ylim(-length*scale_factor, (y_offset+length)*scale_factor)
+    diagram_ax.set_aspect('equal')
+
+    title_text = f"Statewide Asthma Age-Adjusted Rate Per 100,000\nby Race/Ethnicity ({selected_year})"
+    title = diagram_ax.set_title(title_text, fontsize=9, y=1.05)
+    if PARAM_RACE in title.get_text():
+        title.set_bbox(dict(facecolor="yellow", alpha=0.8, edgecolor="none"))
+
+
+_LABEL_PATHS = {}
+_LABEL_PATHS_LOCK = threading.Lock()
+
+
+def _build_label_paths(names, fontsize):
+    prop = FontProperties(size=fontsize)
+    paths, widths = [], []
+    for name in names:
+        # Centered on the layout box, as Text(ha='center') does; Path.get_extents()
+        # would solve for the exact curve extrema of every glyph outline instead
+        width, _, _ = text_to_path.get_text_width_height_descent(name, prop, ismath=False)
+        path = TextPath((0, 0), name, size=fontsize, prop=prop)
+        paths.append(path.transformed(Affine2D().translate(-width / 2, 0)))
+        widths.append(width)
+    widths = np.asarray(widths)
+    widths.setflags(write=False)
+    return paths, widths
+
+
+def _label_paths(names, fontsize):
+    """Horizontally centered text outlines (in points) and their widths, built once per (names, fontsize).
+
+    Building the glyph outlines is the slow part of drawing labels as paths;
+    the result does not depend on the figure, so every base layer shares it.
+    """
+    key = (tuple(names), float(fontsize))
+    cached = _LABEL_PATHS.get(key)
+    if cached is None:
+        with _LABEL_PATHS_LOCK:
+            cached = _LABEL_PATHS.get(key)
+            if cached is None:
+                cached = _LABEL_PATHS[key] = _build_label_paths(key[0], fontsize)
+    return cached
+
+def draw_county_labels(fig, ax, counties, decimate=False, fontsize=COUNTY_LABEL_FONTSIZE):
+    """All county names as one PathCollection anchored at the centroids."""
+    names = counties["name"].to_numpy()
+    offsets = counties[["cx", "cy"]].to_numpy()
+    paths, widths = _label_paths(names, fontsize)
+
+    if decimate:
+        # Keep a label only if it fits across its county at this output size
+        ax.apply_aspect()
+        x0, x1 = ax.get_xlim()
+        axes_px = ax.get_position().width * fig.get_figwidth() * fig.dpi
+        county_px = np.ptp(shapely.bounds(counties.geometry.values)[:, [0, 2]], axis=1) * axes_px / (x1 - x0)
+        keep = widths * fig.dpi / 72 <= county_px
+        paths = [p for p, k in zip(paths, keep) if k]
+        offsets = offsets[keep]
+
+    # Text paths are in points: scale to inches, then to pixels at draw time
+    labels = PathCollection(
+        paths, offsets=offsets, offset_transform=ax.transData,
+        transform=Affine2D().scale(1 / 72) + fig.dpi_scale_trans,
+        facecolors='black', edgecolors='none', linewidths=0, zorder=3
+    )
+    ax.add_collection(labels, autolim=False)
+    return labels
 
-    # -------------------------------------------------------------------------
-    # 5) HELPER FUNCTIONS
-    # -------------------------------------------------------------------------
-    def add_image(ax, image_path, position, zoom):
-        img = plt.imread(image_path)
-        imagebox = OffsetImage(img, zoom=zoom)
-        ab = AnnotationBbox(imagebox, position, frameon=False, xycoords='axes fraction')
-        ax.add_artist(ab)
-
-    def add_illinois_outline(ax, boundary_gdf, position, zoom):
-        inset_ax = fig.add_axes([position[0], position[1], zoom, zoom])
-        boundary_gdf.boundary.plot(ax=inset_ax, linewidth=2, edgecolor=LINE_COLOR)
-        inset_ax.axis('off')
-
-    def draw_circle_with_cord(ax, center_x, center_y, radius, value, cord_x, cord_y, label="", highlight=False):
-        angle = np.arctan2(cord_y - center_y, cord_x - center_x)
-        contact_x = center_x + radius * np.cos(angle)
-        contact_y = center_y + radius * np.sin(angle)
-        circle = patches.Circle((center_x, center_y), radius, color=LINE_COLOR, fill=False, linewidth=1.5)
-        ax.add_patch(circle)
-        ax.text(center_x, center_y, value, ha="center", va="center", fontsize=9)
-        text_props = {'ha': "center", 'va': "center", 'fontsize': 9}
-        if highlight:
-            ax.text(cord_x, cord_y + 0.15, label.upper(), **text_props, fontweight="bold")
-        else:
-            ax.text(cord_x, cord_y + 0.1, label.upper(), **text_props)
-        ax.plot([cord_x, contact_x], [cord_y, contact_y], color=LINE_COLOR, linewidth=1)
-
-    def draw_complete_diagram(ax, position):
-        diagram_ax = fig.add_axes(position)
-        diagram_ax.axis("off")
-        edge_length_factor = 0.8
-        base_length = 1.8
-        length = base_length * edge_length_factor
-        angle = 60
-        y_offset = 1.5
-        vertical_line_length = 1.6
-        circle_radius = 0.14
-        fan_count = 8
-        fan_angle = 120
-        scale_factor = 0.78
-
-        x_left = -length * np.cos(np.radians(angle / 2))
-        y_left = length * np.sin(np.radians(angle / 2)) + y_offset
-        x_right = length * np.cos(np.radians(angle / 2))
-        y_right = length * np.sin(np.radians(angle / 2)) + y_offset
-        apex_x, apex_y = 0, y_offset
-        vertical_x, vertical_y = apex_x, apex_y - vertical_line_length
-
-        diagram_ax.plot([x_left, apex_x], [y_left, apex_y], color=LINE_COLOR, linewidth=2)
-        diagram_ax.plot([apex_x, x_right], [apex_y, y_right], color=LINE_COLOR, linewidth=2)
-        diagram_ax.plot([vertical_x, vertical_x], [apex_y, vertical_y], color=LINE_COLOR, linewidth=2)
-
-        for i in range(fan_count):
-            angle_offset = -fan_angle / 2 + i * (fan_angle / (fan_count - 1))
-            x_fan = vertical_x + 0.3 * np.sin(np.radians(angle_offset))
-            y_fan = vertical_y - 0.3 * np.cos(np.radians(angle_offset))
-            diagram_ax.plot([vertical_x, x_fan], [vertical_y, y_fan], color=LINE_COLOR, linewidth=1)
-
-        val_nhb = circle_dict["NHB"]
-        val_nhw = circle_dict["NHW"]
-        val_nha = circle_dict["NHA"]
-        val_hisp = circle_dict["HISP"]
-
-        draw_circle_with_cord(
-            diagram_ax,
-            (x_left+apex_x)/2,
-            (y_left+apex_y)/2 - 0.3,
-            circle_radius,
-            val_nhb,
-            (x_left+apex_x)/2,
-            (y_left+apex_y+0.03)/2,
-            "NHB",
-            PARAM_RACE=="NHB"
-        )
-        draw_circle_with_cord(
-            diagram_ax,
-            (x_left+apex_x*2)/3,
-            (y_left+apex_y*2)/3 - 0.4,
-            circle_radius,
-            val_nhw,
-            (x_left+apex_x*2)/3,
-            (y_left+apex_y*2)/3,
-            "NHW",
-            PARAM_RACE=="NHW"
-        )
-        draw_circle_with_cord(
-            diagram_ax,
-            (x_right+apex_x)/2,
-            (y_right+apex_y)/2 - 0.3,
-            circle_radius,
-            val_nha,
-            (x_right+apex_x)/2,
-            (y_right+apex_y)/2,
-            "NHA",
-            PARAM_RACE=="NHA"
-        )
-        draw_circle_with_cord(
-            diagram_ax,
-            (x_right+apex_x*2)/3,
-            (y_right+apex_y*2)/3 - 0.4,
-            circle_radius,
-            val_hisp,
-            (x_right+apex_x*2)/3,
-            (y_right+apex_y*2)/3,
-            "HISP",
-            PARAM_RACE=="HISP"
-        )
+def draw_county_markers(ax, counties, offset=MARKER_OFFSET):
+    """One scatter call per county type instead of one per county."""
+    urban = (counties["Urban_Rural"] == "Urban").to_numpy()
+    rural = (counties["Urban_Rural"] == "Rural").to_numpy()
+    cx = counties["cx"].to_numpy()
+    cy = counties["cy"].to_numpy() - offset
+    ax.scatter(cx[urban], cy[urban], color='teal', s=20, marker='o')
+    ax.scatter(cx[rural], cy[rural], color='magenta', s=40, marker='*')
 
-        legend_items = {
-            "NHA": "Non-Hispanic Asian",
-            "NHB": "Non-Hispanic Black",
-            "NHW": "Non-Hispanic White",
-            "HISP": "Hispanic"
-        }
-        y_legend_start = vertical_y + 0.6
-        line_spacing = 0.3
-        
-        for i, (rc, desc) in enumerate(legend_items.items()):
-            txt_line = f"{rc} = {desc}"
-            diagram_ax.text(
-                apex_x + 1,
-                y_legend_start - i*line_spacing,
-                txt_line,
-                fontsize=9,
-                ha="center",
-                fontweight="bold" if rc==PARAM_RACE else "normal"
-            )
-
-        diagram_ax.set_xlim(-length*scale_factor, length*scale_factor)
-        diagram_ax.set_ylim(-length*scale_factor, (y_offset+length)*scale_factor)
-        diagram_ax.set_aspect('equal')
-
-        title_text = f"Statewide Asthma Age-Adjusted Rate Per 100,000\nby Race/Ethnicity ({selected_year})"
-        title = diagram_ax.set_title(title_text, fontsize=9, y=1.05)
-        if PARAM_RACE in title.get_text():
-            title.set_bbox(dict(facecolor="yellow", alpha=0.8, edgecolor="none"))
 
-    # -------------------------------------------------------------------------
-    # 6) PLOT ILLINOIS MAP
-    # -------------------------------------------------------------------------
-    # CHANGED: Increased figsize to improve visibility
-    fig, ax = plt.subplots(figsize=(16, 10))
+# -------------------------------------------------------------------------
+# 6) STATIC BASE LAYER (rasterized once per output size/DPI)
+# -------------------------------------------------------------------------
+class BaseLayer:
+    """Pre-rendered RGBA pixels of everything that does not depend on year/race.
+
+    position/xlim/ylim describe the main map axes so that per-request overlays
+    line up exactly; tight_bbox (inches) keeps bbox_inches="tight" cropping the
+    composite the same way it cropped the single-pass figure.
+    """
 
-    # Map halo
-    halo = unary_union(illinois.geometry).buffer(5000)
-    gpd.GeoSeries([halo]).plot(ax=ax, color=LINE_COLOR, edgecolor='none')
+    def __init__(self, image, position, xlim, ylim, tight_bbox):
+        self.image = image
+        self.position = position
+        self.xlim = xlim
+        self.ylim = ylim
+        self.tight_bbox = tight_bbox
 
-    # Main map
-    illinois.plot(ax=ax, color=illinois["color"], edgecolor='darkgray')
+
+_BASE_LAYERS = OrderedDict()
+_BASE_LAYERS_LOCK = threading.Lock()
+# Held while a layer is built, so lookups of cached layers never wait for a build
+_BASE_LAYERS_BUILD_LOCK = threading.Lock()
+
+
+def new_figure(figsize=FIGSIZE, dpi=DPI):
+    """Figure with its own Agg canvas, outside pyplot's global figure registry.
+
+    Nothing global is touched, so figures can be built and saved concurrently
+    in threads, and one that is dropped is simply garbage collected.
+    """
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _draw_base(fig, ax, geo, scheme, decimate_labels):
+    """Draw everything that does not depend on year/race onto the map axes `ax`."""
+    illinois = prepare_geography(geo, scheme)
+
+    # Main map: one dissolved polygon per region, then the county borders
+    region_polygons = geo.regions(scheme)
+    region_polygons.plot(ax=ax, color=list(region_polygons["color"]), edgecolor='none')
     illinois.boundary.plot(ax=ax, edgecolor='gray', linewidth=1)
 
+    # Keep the view the halo would have produced
+    ax.update_datalim(np.reshape(geo.halo.bounds, (2, 2)))
+    ax.autoscale_view()
+
     # County labels and markers
-    for idx, row in illinois.iterrows():
-        cx, cy = row.geometry.centroid.x, row.geometry.centroid.y
-        ax.text(cx, cy, row["name"], fontsize=6, ha='center', color='black')
-        marker_offset = 5000
-        if row["Urban_Rural"] == "Urban":
-            ax.scatter(cx, cy - marker_offset, color='teal', s=20, marker='o')
-        elif row["Urban_Rural"] == "Rural":
-            ax.scatter(cx, cy - marker_offset, color='magenta', s=40, marker='*')
-
-    # Region labels (commented out to remove the weird numbers)
-    # for region_name, (x, y, label) in region_labels.items():
-    #     ax.text(
-    #         x, y, str(label),
-    #         fontsize=12, ha='center', va='center',
-    #         color='white', fontweight='bold',
-    #         path_effects=[withStroke(linewidth=3, foreground="black")]
-    #     )
+    draw_county_labels(fig, ax, illinois, decimate=decimate_labels)
+    draw_county_markers(ax, illinois)
 
     # Legends
     region_legend = ax.legend(
-        handles=[Patch(facecolor=c, edgecolor='black', label=l) for l, c in region_colors.items()],
+        handles=[Patch(facecolor=c, edgecolor='black', label=l) for l, c in scheme.colors.items()],
         loc='upper left', bbox_to_anchor=(1.35, 0.90), title='Regions',
         fontsize=8, title_fontsize=10
     )
@@ -379,13 +415,139 @@ def plot_illinois_map():
         fontsize=10, title_fontsize=10
     )
 
+    # IDPH logo
+    add_image(ax, IDPH_LOGO_PATH, (0.12, 0.07), 0.25)
+    ax.set_axis_off()
+
+
+def _build_base_layer(figsize, dpi, decimate_labels=None, scheme=None):
+    fig = new_figure(figsize, dpi)
+    ax = fig.subplots()
+
+    # Coarsest geometry that still looks identical at this output size
+    geo = get_geometry_store()
+    position = ax.get_position()
+    geo = geo.for_resolution(metres_per_pixel(fig, position.width, position.height, geo.halo.bounds))
+    if decimate_labels is None:
+        decimate_labels = figsize[0] * dpi < LABEL_DECIMATION_BELOW_PX
+    # Transparent background so the race-colored halo can show through
+    fig.patch.set_alpha(0)
+    _draw_base(fig, ax, geo, scheme or load_region_scheme(), decimate_labels)
+
+    fig.canvas.draw()
+    layer = BaseLayer(
+        image=np.asarray(fig.canvas.buffer_rgba()).copy(),
+        position=ax.get_position(original=True),
+        xlim=ax.get_xlim(),
+        ylim=ax.get_ylim(),
+        tight_bbox=fig.get_tightbbox(fig.canvas.get_renderer()),
+    )
+    return layer
+
+
+def get_base_layer(figsize=FIGSIZE, dpi=DPI, decimate_labels=None):
+    """Cached base layer for the given output size and region scheme, built on first use.
+
+    decimate_labels=None decides from the output width (LABEL_DECIMATION_BELOW_PX).
+    At most BASE_LAYER_CACHE_ENTRIES layers are kept (MAP_BASE_LAYER_CACHE).
+    """
+    scheme = load_region_scheme()
+    key = (tuple(float(v) for v in figsize), float(dpi), decimate_labels, scheme.fingerprint)
+    with _BASE_LAYERS_LOCK:
+        layer = _BASE_LAYERS.get(key)
+        if layer is not None:
+            _BASE_LAYERS.move_to_end(key)
+            return layer
+    with _BASE_LAYERS_BUILD_LOCK:
+        layer = _BASE_LAYERS.get(key)
+        if layer is None:
+            layer = _build_base_layer(figsize, dpi, decimate_labels, scheme)
+            with _BASE_LAYERS_LOCK:
+                _BASE_LAYERS[key] = layer
+                while len(_BASE_LAYERS) > max(1, BASE_LAYER_CACHE_ENTRIES):
+                    _BASE_LAYERS.popitem(last=False)
+    return layer
+
+
+def _map_overlay_axes(fig, base, zorder):
+    """Transparent axes sitting exactly on top of the base layer's map axes."""
+    ax = fig.add_axes(base.position, zorder=zorder)
+    ax.set_xlim(base.xlim)
+    ax.set_ylim(base.ylim)
+    ax.set_aspect('equal')
+    ax.set_axis_off()
+    return ax
+
+
+# -------------------------------------------------------------------------
+# 7) PER-SELECTION OVERLAYS ON TOP OF THE BASE LAYER
+# -------------------------------------------------------------------------
+def compose_map_figure(PARAM_YEAR, PARAM_RACE, data=None, figsize=FIGSIZE, dpi=DPI, vector=False):
+    """Build the full map figure for one (year, race) selection.
+
+    With vector=True the base map is drawn into the figure itself, from the
+    full-resolution geometry and with every county label, instead of being
+    the cached raster of get_base_layer(); use it for VECTOR_FORMATS.
+    """
+    PARAM_RACE = PARAM_RACE.upper()
+    if data is None:
+        with span("data_prep"):
+            data = prepare_map_data(PARAM_YEAR, PARAM_RACE)
+    if data is None:
+        raise ValueError(f"No data found for Race={PARAM_RACE}, Year={PARAM_YEAR}")
+    table_data, TOTAL_COUNT, circle_dict = data
+    LINE_COLOR = dynamic_line_color[PARAM_RACE]
+
+    with span("geometry"):
+        geo = get_geometry_store()
+    fig = new_figure(figsize, dpi)
+    if vector:
+        # Base map as vector artists (counties, labels, markers, legends, logo)
+        with span("base_layer"):
+            base_ax = fig.subplots()
+            _draw_base(fig, base_ax, geo.for_resolution(0), load_region_scheme(), decimate_labels=False)
+            base = BaseLayer(None, base_ax.get_position(original=True), base_ax.get_xlim(), base_ax.get_ylim(), None)
+    else:
+        with span("base_layer"):
+            base = get_base_layer(figsize, dpi)
+
+    # Map halo, drawn underneath the base layer
+    with span("halo"):
+        halo_ax = _map_overlay_axes(fig, base, zorder=-1)
+        map_bounds = (base.xlim[0], base.ylim[0], base.xlim[1], base.ylim[1])
+        resolution = 0 if vector else metres_per_pixel(fig, base.position.width, base.position.height, map_bounds)
+        gpd.GeoSeries([geo.for_resolution(resolution).halo]).plot(ax=halo_ax, color=LINE_COLOR, edgecolor='none')
+        halo_ax.set_xlim(base.xlim)
+        halo_ax.set_ylim(base.ylim)
+
+    if not vector:
+        # Cached base layer (counties, labels, markers, legends, logo)
+        base_image = BboxImage(TransformedBbox(Bbox.unit(), fig.transFigure), interpolation='none', zorder=0)
+        base_image.set_data(base.image)
+        base_image.set_in_layout(False)
+        fig.add_artist(base_image)
+        x0, y0, x1, y1 = base.tight_bbox.extents
+        fig.add_artist(patches.Rectangle(
+            (x0, y0), x1 - x0, y1 - y0, transform=fig.dpi_scale_trans,
+            fill=False, linewidth=0, edgecolor='none'
+        ))
+
+    ax = _map_overlay_axes(fig, base, zorder=1)
+
+    # Updated sources text (ensure it is defined)
+    sources_text = f"""Sources
++ Population: Census Data, {PARAM_YEAR}
++ Asthma Count: Hospital Discharge Data, {PARAM_YEAR}
++ Region: https://graphics.chicagotribune.com/
+  illinois-tier-mitigations/map-blurb.html"""
+
     # Data table
-    table_ax = fig.add_axes([0.25, 0.38, 0.12, 0.4])
+    table_ax = fig.add_axes([0.25, 0.38, 0.12, 0.4], zorder=1)
     table_ax.axis("off")
-    
+
     # 1) Create the Table object
     tab = Table(table_ax, bbox=[0, 0, 1, 1])
-    
+
     # 2) Add cells to the Table
     for i, row_data in enumerate(table_data):
         cell = tab.add_cell(
@@ -394,13 +556,13 @@ def plot_illinois_map():
             loc='center', facecolor='white', edgecolor='black'
         )
         cell.set_text_props(fontweight='bold' if i == 0 else 'normal')
-    
+
     # 3) **Add the Table object to the axes** so it appears
     table_ax.add_table(tab)
 
 
     # Sources text
-    text_ax = fig.add_axes([0.237, 0.125, 0.22, 0.2])
+    text_ax = fig.add_axes([0.237, 0.125, 0.22, 0.2], zorder=1)
     text_ax.axis("off")
     text_ax.text(
         0, 1, sources_text,
@@ -408,11 +570,9 @@ def plot_illinois_map():
         fontsize=9, va="top", ha="left", linespacing=1.5
     )
 
-    # IDPH logo
-    add_image(ax, IDPH_LOGO_PATH, (0.12, 0.07), 0.25)
-
     # Illinois outline inset
-    add_illinois_outline(ax, state_boundary, (0.65, 0.65), 0.057)
+    inset_geo = geo.for_resolution(metres_per_pixel(fig, 0.057, 0.057, geo.state_boundary.total_bounds))
+    add_illinois_outline(fig, inset_geo.state_boundary, (0.65, 0.65), 0.057, LINE_COLOR)
 
     # Total count text
     ax.text(
@@ -422,50 +582,132 @@ def plot_illinois_map():
     )
 
     # Funnel diagram
-    draw_complete_diagram(ax, [0.66, 0.03, 0.15, 0.5])
+    draw_complete_diagram(fig, [0.66, 0.03, 0.15, 0.5], circle_dict, PARAM_RACE, PARAM_YEAR, LINE_COLOR)
 
     # Main title
-    race_descriptions = {
-        "NHB": "Non-Hispanic Black",
-        "NHW": "Non-Hispanic White",
-        "NHA": "Non-Hispanic Asian",
-        "HISP": "Hispanic"
-    }
     title_text = (
         f"Regional Asthma Age-Adjusted Rates Per 100,000 HOSPITALIZATION Discharges\n"
         f"for {race_descriptions[PARAM_RACE]} ({PARAM_RACE}) Population, {PARAM_YEAR}"
     )
     ax.set_title(title_text, fontsize=12, y=1.05)
-    ax.set_axis_off()
 
-    # -------------------------------------------------------------------------
-    # 7) RENDER IN STREAMLIT
-    # -------------------------------------------------------------------------
-    st.pyplot(fig, use_container_width=True)
-    plt.close(fig)
+    return fig
+
+
+# -------------------------------------------------------------------------
+# 8) FIXED OUTPUT LAYOUT
+# -------------------------------------------------------------------------
+# Margin kept around the drawn content, as savefig's pad_inches
+LAYOUT_PAD_INCHES = 0.1
+
+_LAYOUTS = {}
+_LAYOUTS_LOCK = threading.Lock()
+
+
+def _build_layout(figsize, cube):
+    """Union of the tight bboxes of every race's latest map, padded and clamped to the figure.
+
+    Everything but the title (whose width depends on the race name) sits at
+    the same place on every map, so this box fits any selection. Text extents
+    shift by a few hundredths of an inch between resolutions, well inside the
+    padding, so the box is measured once at DPI and used at every DPI.
+    """
+    bbox = None
+    for race in dynamic_line_color:
+        years = [y for y in cube.years if cube.has(race, y)]
+        if not years:
+            continue
+        fig = compose_map_figure(years[-1], race, figsize=figsize, dpi=DPI)
+        tight = fig.get_tightbbox(fig.canvas.get_renderer())
+        bbox = tight if bbox is None else Bbox.union([bbox, tight])
+    page = Bbox.from_bounds(0, 0, *figsize)
+    if bbox is None:
+        return page
+    return Bbox.intersection(bbox.padded(LAYOUT_PAD_INCHES), page)
+
+
+def get_map_layout(figsize=FIGSIZE):
+    """Cached output bbox (inches) of the maps of one figure size, built on first use.
+
+    Saving with this bbox instead of bbox_inches="tight" skips the extra
+    layout pass that "tight" needs, and every map of a figure size and DPI
+    gets the same pixel dimensions.
+    """
+    cube = get_rate_cube(CSV_PATH, TOTAL_COUNT_CSV)
+    key = (tuple(float(v) for v in figsize), cube.version, load_region_scheme().fingerprint)
+    layout = _LAYOUTS.get(key)
+    if layout is None:
+        with _LAYOUTS_LOCK:
+            layout = _LAYOUTS.get(key)
+            if layout is None:
+                layout = _LAYOUTS[key] = _build_layout(figsize, cube)
+    return layout
+
+
+def layout_pixels(layout, dpi, height):
+    """(left, top, right, bottom) pixel box of `layout` in an RGBA buffer `height` pixels high."""
+    x0, y0, x1, y1 = (round(v * dpi) for v in layout.extents)
+    return x0, height - y1, x1, height - y0
+
+
+def render_map_image(PARAM_YEAR, PARAM_RACE, fmt="png", figsize=FIGSIZE, dpi=DPI, data=None):
+    """Render one (year, race) selection and return the image bytes encoded by Matplotlib.
+
+    Timing spans: "layout" covers the lookup of the output bbox, "compose"
+    the whole figure build (including the data_prep, geometry, base_layer
+    and halo spans inside it), "encode" the savefig. VECTOR_FORMATS get a
+    vector base map.
+    """
+    with span("layout"):
+        layout = get_map_layout(figsize)
+    with span("compose"):
+        fig = compose_map_figure(PARAM_YEAR, PARAM_RACE, data=data, figsize=figsize, dpi=dpi,
+                                 vector=fmt in VECTOR_FORMATS)
+    buf = io.BytesIO()
+    with span("encode"):
+        fig.savefig(buf, format=fmt, bbox_inches=layout)
+    return buf.getvalue()
+
+
+def render_map_rgba(PARAM_YEAR, PARAM_RACE, figsize=FIGSIZE, dpi=DPI, data=None):
+    """Render one (year, race) selection and return its pixels, cropped to the layout.
+
+    The figure is drawn exactly once ("draw" span); the result is an
+    (height, width, 4) uint8 array for image_encode.encode_image().
+    """
+    with span("layout"):
+        layout = get_map_layout(figsize)
+    with span("compose"):
+        fig = compose_map_figure(PARAM_YEAR, PARAM_RACE, data=data, figsize=figsize, dpi=dpi)
+    with span("draw"):
+        fig.canvas.draw()
+        buffer = np.asarray(fig.canvas.buffer_rgba())
+        left, top, right, bottom = layout_pixels(layout, dpi, buffer.shape[0])
+        pixels = buffer[top:bottom, left:right].copy()
+    return pixels
+
+
+def render_map_png(PARAM_YEAR, PARAM_RACE, figsize=FIGSIZE, dpi=DPI):
+    """Render one (year, race) selection and return the PNG bytes."""
+    return render_map_image(PARAM_YEAR, PARAM_RACE, "png", figsize=figsize, dpi=dpi)
+
 
 # -------------------------------------------------------------------------
 # Command-line execution: Save the map as a PNG file for external use (e.g., by Flask)
 # -------------------------------------------------------------------------
 if __name__ == '__main__':
     import sys
-    if len(sys.argv) == 3:
+    if len(sys.argv) == 3 and not sys.argv[1].startswith("-"):
         year = int(sys.argv[1])
         race = sys.argv[2].upper()
-        # If st.session_state is not available, create a dummy one
-        if not hasattr(st, 'session_state'):
-            st.session_state = {}
-        st.session_state['selected_year'] = year
-        st.session_state['selected_race'] = race
-
-        # Generate the plot
-        plot_illinois_map()
-        # Ensure output folder exists
-        output_folder = os.path.join(os.getcwd(), "static/maps")
-        os.makedirs(output_folder, exist_ok=True)
-        output_file = os.path.join(output_folder, f"{race}_{year}.png")
-        # Save the figure to the file for Flask to serve
-        plt.savefig(output_file, bbox_inches="tight")
-        plt.close()
+
+        # Headless render (Agg backend) saved for Flask to serve
+        import map_render
+        output_file = os.path.join(os.getcwd(), "static/maps", f"{race}_{year}.png")
+        map_render.render_map(year, race, output=output_file)
+    elif len(sys.argv) > 1 and sys.argv[1].startswith("-"):
+        # Batch mode, e.g. --all or --years 2022 2023 --races NHB
+        import batch_render
+        sys.exit(batch_render.main(sys.argv[1:]))
     else:
-        print("Expected 2 arguments: year and race")
+        print("Expected 2 arguments: year and race (or --all for every combination)")